@@ -6,6 +6,19 @@ from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_wtf.csrf import CSRFProtect
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+from .cache import UserCache
+from .password_pool import PasswordPool
+from .metrics import Metrics
+from .query_profiler import QueryProfiler
+from . import serializers
+from .conditional import VersionCache
+from .membership_index import MembershipIndex
+from .rate_limit import RateLimiter
+from .replicas import ReplicaRouter
+from .sharding import Shards
+from .events import EventLog
+from .jobs import JobQueue
 
 load_dotenv()
 
@@ -13,17 +26,42 @@ db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
 csrf = CSRFProtect()
+user_cache = UserCache()
+password_pool = PasswordPool()
+metrics = Metrics()
+query_profiler = QueryProfiler()
+version_cache = VersionCache()
+membership_index = MembershipIndex()
+rate_limiter = RateLimiter()
+replicas = ReplicaRouter()
+shards = Shards()
+event_log = EventLog()
+jobs = JobQueue()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object('app.config.Config')
     app.config['WTF_CSRF_CHECK_DEFAULT'] = False
+    # Take the client address from the proxies' X-Forwarded-* headers
+    if app.config['TRUSTED_PROXIES']:
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 
-
+    replicas.init_app(app)
+    shards.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     csrf.init_app(app)
+    user_cache.init_app(app)
+    password_pool.init_app(app)
+    metrics.init_app(app)
+    query_profiler.init_app(app)
+    serializers.init_app(app)
+    version_cache.init_app(app)
+    membership_index.init_app(app)
+    rate_limiter.init_app(app)
+    event_log.init_app(app)
     # Disable CSRF protection for all routes
     # csrf.init_app(app, exempt_methods=['POST', 'PUT', 'PATCH', 'DELETE'])
   
@@ -34,6 +72,21 @@ def create_app():
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
 
+    # CLI commands
+    from .hashers import hashers_cli
+    app.cli.add_command(hashers_cli)
+    from .server import serve_command
+    app.cli.add_command(serve_command)
+    from .sharding import shards_cli
+    app.cli.add_command(shards_cli)
+    from .jobs import jobs_cli
+    app.cli.add_command(jobs_cli)
+    from .bulk import bulk_cli
+    app.cli.add_command(bulk_cli)
+
+    # Job tasks
+    from . import tasks
+
     return app
 
 
@@ -1,11 +1,24 @@
 #app/auth.py
 
+import json
 import logging
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import Blueprint, current_app, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_wtf.csrf import generate_csrf
-from .models import db, User, Organization
-from .forms import RegistrationForm, LoginForm
+from sqlalchemy.orm.exc import StaleDataError
+from .models import db, User, Organization, add_members, chunked
+from .validation import registration_validator, login_validator
+from . import user_cache, password_pool, membership_index, rate_limiter, replicas, shards, event_log
+from .password_pool import PasswordPoolBusy
+from .rate_limit import RateLimited
+from .hashers import needs_rehash
+from .registration import RegistrationConflict, check_registration, create_registration, register_batch
+from .serializers import jsonify, user_schema, organization_schema, requested_schema, FieldsError
+from .conditional import check_not_modified, make_etag, not_modified, not_modified_response, with_etag
+from . import version_cache
+from .claims import issue_tokens, caller_user_id, may_view_organization
+from .replicas import used_replica
+from .pagination import PaginationError, parse_page_args, wants_ndjson, ndjson_response, export_format, stream_response
 
 auth = Blueprint('auth', __name__)
 
@@ -19,144 +32,253 @@ def get_csrf_token():
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Password pool saturated: shed load instead of queueing behind it
+@auth.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    response = jsonify({'message': 'Server busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@auth.errorhandler(RateLimited)
+def rate_limited(e):
+    response = jsonify({'message': 'Too many attempts, please retry later'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 # Registration endpoint
 @auth.route('/register', methods=['POST'])
+@rate_limiter.limit('register')
 # @csrf.exempt
 def register():
     data = request.get_json()
-    form = RegistrationForm(data=data)
+    form, form_errors = registration_validator.validate_request(data)
   
-    if form.validate_on_submit():
-        userId = form.userId.data
-        email = form.email.data
-        password = form.password.data
-        organization_name = form.organization_name.data
-        organization_description = form.organization_description.data
+    if not form_errors:
+        userId = form['userId']
+        email = form['email']
+        password = form['password']
+        organization_name = form['organization_name']
+        organization_description = form['organization_description']
   
-        # Check if username or email already exists
-        existing_user = User.query.filter((User.userId == userId) | (User.email == email)).first()
-        if existing_user:
-            return jsonify({'message': 'User already exists'}), 400
-
-        # Create new organization if it doesn't exist
-        existing_organization = Organization.query.filter_by(name=organization_name).first()
-        if not existing_organization:
-            new_organization = Organization(name=organization_name, description=organization_description)
-            db.session.add(new_organization)
-            db.session.commit()
-            organization_id = new_organization.id
-        else:
-            organization_id = existing_organization.id
+        # userId/email uniqueness and the organisation lookup in one query
+        errors, organization_id, orgId = check_registration(userId, email, organization_name)
+        if errors:
+            return jsonify({'errors': errors}), 422
 
-        # Create new user and hash password
-        new_user = User(userId=userId, email=email, firstName=form.firstName.data, lastName=form.lastName.data, phone=form.phone.data)
-        new_user.set_password(password)
-        new_user.organizations.append(Organization.query.get(organization_id))
-        db.session.add(new_user)
-        db.session.commit()
+        # Hash before writing anything, so a busy pool leaves no partial rows
+        password_hash = password_pool.hash(password)
+
+        # Organisation, user and membership in one transaction
+        try:
+            new_user, orgId, organization_id = create_registration(userId, email, password_hash, form['firstName'], form['lastName'],
+                                                  form['phone'], organization_name, organization_description,
+                                                  organization_id, orgId)
+        except RegistrationConflict as e:
+            return jsonify({'errors': e.errors}), 422
+        user_cache.invalidate(userId)
+        membership_index.add([(new_user.id, organization_id)])
+        replicas.stick(userId)
+        event_log.record('register', userId, organization_id)
   
-        # Generate access token
-        access_token = create_access_token(identity=userId)
+        # Generate tokens; the new user's only membership is already known
+        access_token, refresh_token = issue_tokens(userId, new_user.id, [organization_id])
   
         return jsonify({
             'status': 'success',
             'message': 'Registration successful',
             'data': {
                 'accessToken': access_token,
-                'user': {
-                    'userId': new_user.userId,
-                    'firstName': new_user.firstName,
-                    'lastName': new_user.lastName,
-                    'email': new_user.email,
-                    'phone': new_user.phone
-                },
+                'refreshToken': refresh_token,
+                'user': user_schema.dump(new_user),
                 'organization': {
+                    'orgId': orgId,
                     'name': organization_name,
                     'description': organization_description
                 }
             }
         }), 201
     else:
-        return jsonify({'errors': form.errors}), 422
+        return jsonify({'errors': form_errors}), 422
+
+# Items of a batch body, reading no more than max_bytes of it and, for
+# NDJSON, no more than max_rows + 1 lines. None if the body is too large;
+# raises ValueError if it is not JSON.
+def _read_batch(max_rows, max_bytes):
+    if request.content_length is not None and request.content_length > max_bytes:
+        return None
+    stream = request.stream
+    if request.mimetype != 'application/x-ndjson':
+        body = stream.read(max_bytes + 1)
+        return json.loads(body) if len(body) <= max_bytes else None
+    items, remaining = [], max_bytes
+    while len(items) <= max_rows:
+        line = stream.readline(remaining + 1)
+        if not line:
+            break
+        remaining -= len(line)
+        if remaining < 0:
+            return None
+        if line.strip():
+            items.append(json.loads(line))
+    return items
+
+# Bulk registration endpoint: a JSON array or NDJSON stream of registrations
+@auth.route('/register/batch', methods=['POST'])
+@jwt_required()
+def register_batch_endpoint():
+    max_rows = current_app.config['REGISTER_BATCH_MAX']
+    try:
+        items = _read_batch(max_rows, current_app.config['REGISTER_BATCH_MAX_BYTES'])
+    except ValueError:
+        return jsonify({'message': 'Body must be a JSON array or NDJSON'}), 400
+    if items is None:
+        return jsonify({'message': 'At most {} bytes per batch'.format(current_app.config['REGISTER_BATCH_MAX_BYTES'])}), 413
+    if not isinstance(items, list):
+        return jsonify({'message': 'Body must be a JSON array or NDJSON'}), 400
+    if len(items) > max_rows:
+        return jsonify({'message': 'At most {} registrations per batch'.format(max_rows)}), 413
+
+    # Same field rules as /auth/register
+    rows, errors = {}, {}
+    for index, item in enumerate(items):
+        values, row_errors = registration_validator.validate(item)
+        if row_errors:
+            errors[index] = row_errors
+        else:
+            rows[index] = values
+
+    created, conflicts = register_batch(rows, password_pool.hash_many, actor=get_jwt_identity())
+    errors.update(conflicts)
+
+    results = []
+    for index in range(len(items)):
+        if index in created:
+            results.append({'index': index, 'status': 'success', 'userId': rows[index]['userId'], 'orgId': created[index]})
+        else:
+            results.append({'index': index, 'status': 'error', 'errors': errors[index]})
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Batch registration processed',
+        'data': {
+            'created': len(created),
+            'failed': len(items) - len(created),
+            'results': results
+        }
+    }), 200
 
 # Login endpoint
 @auth.route('/login', methods=['POST'])
+@rate_limiter.limit('login')
 def login():
     data = request.get_json()
-    form = LoginForm(data=data)
+    form, form_errors = login_validator.validate_request(data)
   
-    if form.validate_on_submit():
-        userId = form.userId.data
-        password = form.password.data
+    if not form_errors:
+        userId = form['userId']
+        password = form['password']
   
         # Verify user credentials
         user = User.query.filter_by(userId=userId).first()
-        if not user or not user.check_password(password):
+        if not user or not password_pool.verify(user.password_hash, password):
+            event_log.record('login_failed', userId)
             return jsonify({'message': 'Invalid username or password'}), 401
+
+        # Upgrade hashes written with an older algorithm or cost. If the row
+        # changed meanwhile (a details update, or another login that already
+        # rehashed), that write stands and a later login rehashes if needed.
+        if needs_rehash(user.password_hash):
+            user.password_hash = password_pool.hash(password)
+            try:
+                db.session.commit()
+            except StaleDataError:
+                db.session.rollback()
+            else:
+                user_cache.invalidate(userId)
+        event_log.record('login', userId)
   
-        # Generate access token
-        access_token = create_access_token(identity=userId)
+        # Generate tokens carrying the caller's memberships
+        access_token, refresh_token = issue_tokens(userId, user.id)
   
         return jsonify({
             'status': 'success',
             'message': 'Login successful',
             'data': {
                 'accessToken': access_token,
-                'user': {
-                    'userId': user.userId,
-                    'firstName': user.firstName,
-                    'lastName': user.lastName,
-                    'email': user.email,
-                    'phone': user.phone
-                }
+                'refreshToken': refresh_token,
+                'user': user_schema.dump(user)
             }
         }), 200
     else:
-        return jsonify({'errors': form.errors}), 422
+        return jsonify({'errors': form_errors}), 422
+
+# Token refresh endpoint: new access token with current membership claims
+@auth.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    userId = get_jwt_identity()
+    user = user_cache.get(userId)
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    access_token, _ = issue_tokens(userId, user.id)
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Token refreshed successfully',
+        'data': {
+            'accessToken': access_token
+        }
+    }), 200
 
 # User details endpoint
 @auth.route('/api/users/<id>', methods=['GET', 'PUT'])
 @jwt_required()
 def user_details(id):
     current_user_id = get_jwt_identity()
-    if current_user_id != id:
+    if current_user_id != id and request.method != 'GET':
         return jsonify({'message': 'Unauthorized'}), 401
 
-    user = User.query.filter_by(userId=id).first()
+    user = user_cache.get(id)
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
+    # Other users are visible to members of any of their organisations
+    if current_user_id != id and not membership_index.share_organization(caller_user_id(), user.id):
+        return jsonify({'message': 'Unauthorized'}), 401
+
     if request.method == 'GET':
-        return jsonify({
+        # The cached snapshot carries the row version, so a 304 needs no query
+        etag = make_etag('user', id, user.version)
+        if not_modified(etag):
+            return not_modified_response(etag)
+
+        return with_etag(jsonify({
             'status': 'success',
             'message': 'User details retrieved successfully',
-            'data': {
-                'userId': user.userId,
-                'firstName': user.firstName,
-                'lastName': user.lastName,
-                'email': user.email,
-                'phone': user.phone
-            }
-        }), 200
+            'data': user_schema.dump(user)
+        }), etag), 200
 
     elif request.method == 'PUT':
         data = request.get_json()
+        user = User.query.get(user.id)
         user.firstName = data.get('firstName', user.firstName)
         user.lastName = data.get('lastName', user.lastName)
         user.email = data.get('email', user.email)
         user.phone = data.get('phone', user.phone)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            # Another request updated the row since it was read here
+            db.session.rollback()
+            return jsonify({'message': 'User was modified concurrently, try again'}), 409
+        user_cache.invalidate(id)
+        replicas.stick(id)
 
         return jsonify({
             'status': 'success',
             'message': 'User details updated successfully',
-            'data': {
-                'userId': user.userId,
-                'firstName': user.firstName,
-                'lastName': user.lastName,
-                'email': user.email,
-                'phone': user.phone
-            }
+            'data': user_schema.dump(user)
         }), 200
 
 # Organizations endpoints
@@ -164,18 +286,36 @@ def user_details(id):
 @jwt_required()
 def organizations():
     if request.method == 'GET':
-        organizations = Organization.query.all()
-        org_list = [{
-            'orgId': org.orgId,
-            'name': org.name,
-            'description': org.description
-        } for org in organizations]
+        # Only the caller's organisations, as in routes.get_organisations
+        user_id = caller_user_id()
+        if user_id is None:
+            return jsonify({'message': 'User not found'}), 404
+
+        try:
+            schema = requested_schema(organization_schema)
+        except FieldsError as e:
+            return jsonify({'message': str(e)}), 400
+
+        # Rows carry the keyset column first, then only the requested fields
+        columns = schema.columns(Organization)
+
+        if wants_ndjson():
+            return ndjson_response(shards.organizations_of(user_id, columns), schema.dump)
+
+        try:
+            limit, after = parse_page_args()
+        except PaginationError as e:
+            return jsonify({'message': str(e)}), 400
+
+        organizations, next_cursor = shards.organizations_page(user_id, columns, limit, after)
+        org_list = schema.dump_many(organizations)
 
         return jsonify({
             'status': 'success',
             'message': 'Organizations retrieved successfully',
             'data': {
-                'organizations': org_list
+                'organizations': org_list,
+                'nextCursor': next_cursor
             }
         }), 200
 
@@ -185,68 +325,72 @@ def organizations():
         name = data.get('name')
         description = data.get('description')
 
-        existing_org = Organization.query.filter_by(orgId=orgId).first()
+        existing_org = shards.find(orgId, Organization.id)
         if existing_org:
             return jsonify({'message': 'Organization already exists'}), 400
 
-        new_org = Organization(orgId=orgId, name=name, description=description)
-        db.session.add(new_org)
-        db.session.commit()
+        new_org = shards.create(orgId, name, description)
+        replicas.stick(get_jwt_identity())
 
         return jsonify({
             'status': 'success',
             'message': 'Organization created successfully',
-            'data': {
-                'orgId': new_org.orgId,
-                'name': new_org.name,
-                'description': new_org.description
-            }
+            'data': organization_schema.dump(new_org)
         }), 201
 
 # Organization details endpoint
 @auth.route('/api/organisations/<orgId>', methods=['GET'])
 @jwt_required()
 def organization_details(orgId):
-    organization = Organization.query.filter_by(orgId=orgId).first()
+    # Members only, as in routes.get_organization
+    unchanged = check_not_modified('organization', orgId,
+                                   lambda: shards.find(orgId, Organization.id, Organization.version),
+                                   may_view_organization)
+    if unchanged:
+        return unchanged
+
+    organization = shards.find(orgId, Organization.id, *organization_schema.columns(Organization), Organization.version)
     if not organization:
         return jsonify({'message': 'Organization not found'}), 404
+    if not may_view_organization(organization.id):
+        return jsonify({'message': 'Forbidden'}), 403
+    if not used_replica():
+        version_cache.set('organization', orgId, organization.id, organization.version)
 
-    return jsonify({
+    return with_etag(jsonify({
         'status': 'success',
         'message': 'Organization retrieved successfully',
-        'data': {
-            'orgId': organization.orgId,
-            'name': organization.name,
-            'description': organization.description
-        }
-    }), 200
+        'data': organization_schema.dump(organization)
+    }), make_etag('organization', orgId, organization.version)), 200
 
 # Users in organization endpoint
 @auth.route('/api/organisations/<orgId>/users', methods=['GET'])
 @jwt_required()
 def organization_users(orgId):
-    organization = Organization.query.filter_by(orgId=orgId).first()
+    try:
+        schema = requested_schema(user_schema)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+
+    organization = shards.find(orgId, Organization.id, Organization.orgId, Organization.name, Organization.description)
     if not organization:
         return jsonify({'message': 'Organization not found'}), 404
 
-    users = organization.users.all()
-    user_list = [{
-        'userId': user.userId,
-        'firstName': user.firstName,
-        'lastName': user.lastName,
-        'email': user.email,
-        'phone': user.phone
-    } for user in users]
+    # Column-only projection: plain rows, nothing enters the identity map
+    query = shards.members(organization.id, schema.columns(User))
+
+    fmt = export_format(('ndjson', 'csv'))
+    if fmt:
+        return stream_response(query, schema.dump, fmt, schema.fields,
+                               filename='{}-users.{}'.format(organization.orgId, fmt))
+
+    user_list = schema.dump_many(query)
 
     return jsonify({
         'status': 'success',
         'message': 'Users in organization retrieved successfully',
         'data': {
-            'organization': {
-                'orgId': organization.orgId,
-                'name': organization.name,
-                'description': organization.description
-            },
+            'organization': organization_schema.dump(organization),
             'users': user_list
         }
     }), 200
@@ -258,19 +402,60 @@ def add_user_to_organization(orgId):
     data = request.get_json()
     userId = data.get('userId')
 
-    organization = Organization.query.filter_by(orgId=orgId).first()
-    if not organization:
+    organization = shards.find(orgId, Organization.id)
+    if organization is None:
         return jsonify({'message': 'Organization not found'}), 404
+    organization_id = organization.id
 
-    user = User.query.filter_by(userId=userId).first()
+    user = user_cache.get(userId)
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    if user not in organization.users:
-        organization.users.append(user)
+    # add_members skips existing memberships with an indexed lookup
+    if add_members(organization_id, [user.id]):
         db.session.commit()
+        membership_index.add([(user.id, organization_id)])
+        replicas.stick(get_jwt_identity())
+        event_log.record('member_added', userId, organization_id, actor=get_jwt_identity())
 
     return jsonify({
         'status': 'success',
         'message': 'User added to organization successfully'
     }), 200
+
+# Add many users to organization endpoint
+@auth.route('/api/organisations/<orgId>/users/batch', methods=['POST'])
+@jwt_required()
+def add_users_to_organization(orgId):
+    data = request.get_json()
+    userIds = data.get('userIds') if data else None
+    if not isinstance(userIds, list) or not all(isinstance(userId, str) for userId in userIds):
+        return jsonify({'message': 'userIds must be a list of strings'}), 400
+
+    organization = shards.find(orgId, Organization.id)
+    if organization is None:
+        return jsonify({'message': 'Organization not found'}), 404
+    organization_id = organization.id
+
+    # Resolve every userId with one IN query per chunk
+    user_ids = {}
+    for chunk in chunked(list(dict.fromkeys(userIds))):
+        user_ids.update(db.session.query(User.userId, User.id).filter(User.userId.in_(chunk)))
+
+    added = set(add_members(organization_id, list(user_ids.values())))
+    db.session.commit()
+    for userId, user_id in user_ids.items():
+        if user_id in added:
+            event_log.record('member_added', userId, organization_id, actor=get_jwt_identity())
+    membership_index.add([(user_id, organization_id) for user_id in added])
+    replicas.stick(get_jwt_identity())
+
+    return jsonify({
+        'status': 'success',
+        'message': 'Users added to organization successfully',
+        'data': {
+            'added': [userId for userId, user_id in user_ids.items() if user_id in added],
+            'alreadyMembers': [userId for userId, user_id in user_ids.items() if user_id not in added],
+            'notFound': [userId for userId in dict.fromkeys(userIds) if userId not in user_ids]
+        }
+    }), 200
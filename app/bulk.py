@@ -0,0 +1,396 @@
+#app/bulk.py
+
+import csv
+import io
+import itertools
+import json
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+from .hashers import HASHERS
+from .serializers import dumps, loads
+from .validation import user_import_validator, organization_import_validator, membership_import_validator
+
+FORMATS = ('csv', 'jsonl')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+# Columns of each kind of file, in order
+FIELDS = {
+    'users': ['userId', 'email', 'firstName', 'lastName', 'phone', 'password_hash'],
+    'organizations': ['orgId', 'name', 'description'],
+    'memberships': ['userId', 'orgId']
+}
+
+# Rows of an open CSV or JSONL file, starting at `offset` (a position from
+# f.tell(), 0 for the top). Lines are read one at a time, so f.tell() after a
+# row is where the next one starts.
+def _read(f, fmt, offset=0):
+    def lines():
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            yield line
+
+    if fmt == 'csv':
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        if header is None:
+            return
+        if offset:
+            f.seek(offset)
+        for values in reader:
+            # Empty CSV cells are missing values
+            yield {name: value for name, value in zip(header, values) if value != ''}
+    else:
+        if offset:
+            f.seek(offset)
+        for line in lines():
+            if line.strip():
+                try:
+                    yield loads(line)
+                except ValueError:
+                    yield None
+
+def _format(path, fmt):
+    fmt = fmt or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise click.ClickException('Cannot tell the format of {}; pass --format'.format(path))
+    return fmt
+
+# Insert rows (dicts with the same keys) into `table` in the session's
+# transaction: COPY on Postgres, one executemany elsewhere
+def _insert(table, rows):
+    from .models import db
+    if not rows:
+        return
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        connection.execute(table.insert(), rows)
+        return
+
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(row[column]) for column in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    sql = 'COPY {} ({}) FROM STDIN'.format(preparer.format_table(table), ', '.join(map(preparer.quote, columns)))
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
+
+# A value in COPY's text format
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _known_hash(password_hash):
+    return any(hasher_class.identify(password_hash) for hasher_class in HASHERS.values())
+
+# Each importer takes a chunk of (row number, row) and writes what it can in
+# one transaction. Rows already in the database are skipped, so a chunk that
+# committed just before an interruption is harmless to run again. Returns
+# (inserted, skipped, {row number: errors}).
+
+def _import_users(chunk):
+    from . import password_pool
+    from .models import db, User, chunked
+    rows, errors = _validated(chunk, user_import_validator)
+    for number, row in list(rows.items()):
+        if row['password_hash'] is not None and not _known_hash(row['password_hash']):
+            errors[number] = {'password_hash': ['Unknown hash format.']}
+        elif row['password_hash'] is None and not row['password']:
+            errors[number] = {'password': ['A password or password_hash is required.']}
+        else:
+            continue
+        del rows[number]
+
+    existing_userIds, existing_emails = set(), set()
+    for part in chunked(list({row['userId'] for row in rows.values()})):
+        existing_userIds.update(userId for userId, in db.session.query(User.userId).filter(User.userId.in_(part)))
+    for part in chunked(list({row['email'] for row in rows.values()})):
+        existing_emails.update(email for email, in db.session.query(User.email).filter(User.email.in_(part)))
+
+    new, skipped, seen_userIds, seen_emails = {}, 0, set(), set()
+    for number, row in rows.items():
+        if row['userId'] in existing_userIds:
+            skipped += 1
+        elif row['userId'] in seen_userIds:
+            errors[number] = {'userId': ['Duplicate userId.']}
+        elif row['email'] in existing_emails or row['email'] in seen_emails:
+            errors[number] = {'email': ['Email address already registered.']}
+        else:
+            new[number] = row
+            seen_userIds.add(row['userId'])
+            seen_emails.add(row['email'])
+
+    # Plain passwords are hashed on the password pool, alongside logins
+    to_hash = [number for number, row in new.items() if row['password_hash'] is None]
+    for number, password_hash in zip(to_hash, password_pool.hash_many([new[number]['password'] for number in to_hash])):
+        new[number]['password_hash'] = password_hash
+
+    _insert(User.__table__, [{field: row[field] for field in FIELDS['users']} for row in new.values()])
+    db.session.commit()
+    return len(new), skipped, errors
+
+def _import_organizations(chunk):
+    from . import shards
+    from .models import db, Organization, OrganizationDirectory, chunked
+    organizations = OrganizationDirectory if shards.enabled else Organization
+    rows, errors = _validated(chunk, organization_import_validator)
+
+    existing = set()
+    for part in chunked(list({row['orgId'] for row in rows.values()})):
+        existing.update(orgId for orgId, in db.session.query(organizations.orgId).filter(organizations.orgId.in_(part)))
+    new, skipped = {}, 0
+    for number, row in rows.items():
+        if row['orgId'] in existing:
+            skipped += 1
+        elif row['orgId'] in new:
+            errors[number] = {'orgId': ['Duplicate orgId.']}
+        else:
+            new[row['orgId']] = row
+
+    if not shards.enabled:
+        _insert(Organization.__table__, list(new.values()))
+        db.session.commit()
+        return len(new), skipped, errors
+
+    # Sharded: the directory hands out the ids, then each shard gets its rows
+    _insert(OrganizationDirectory.__table__, [
+        {'orgId': orgId, 'name': row['name'], 'shard': shards.placement(orgId)} for orgId, row in new.items()
+    ])
+    writes = {}
+    for part in chunked(list(new)):
+        for organization_id, orgId, shard in db.session.query(OrganizationDirectory.id, OrganizationDirectory.orgId,
+                                                              OrganizationDirectory.shard)\
+                .filter(OrganizationDirectory.orgId.in_(part)):
+            writes.setdefault(shard, []).append(dict(new[orgId], id=organization_id))
+    shards.commit({shard: [(Organization.__table__, rows)] for shard, rows in writes.items()})
+    return len(new), skipped, errors
+
+def _import_memberships(chunk):
+    from . import shards
+    from .models import db, User, Organization, OrganizationDirectory, user_organization, chunked
+    organizations = OrganizationDirectory if shards.enabled else Organization
+    rows, errors = _validated(chunk, membership_import_validator)
+
+    user_ids, organization_ids = {}, {}
+    for part in chunked(list({row['userId'] for row in rows.values()})):
+        user_ids.update(db.session.query(User.userId, User.id).filter(User.userId.in_(part)))
+    for part in chunked(list({row['orgId'] for row in rows.values()})):
+        organization_ids.update(db.session.query(organizations.orgId, organizations.id)
+                                .filter(organizations.orgId.in_(part)))
+
+    pairs, resolved = set(), 0
+    for number, row in rows.items():
+        if row['userId'] not in user_ids:
+            errors[number] = {'userId': ['No such user.']}
+        elif row['orgId'] not in organization_ids:
+            errors[number] = {'orgId': ['No such organisation.']}
+        else:
+            pairs.add((user_ids[row['userId']], organization_ids[row['orgId']]))
+            resolved += 1
+
+    # Existing memberships, grouped by where they live
+    by_shard = {}
+    for user_id, organization_id in pairs:
+        shard = shards.shard_of(organization_id) if shards.enabled else None
+        by_shard.setdefault(shard, []).append((user_id, organization_id))
+    existing = set()
+    for shard, shard_pairs in by_shard.items():
+        existing.update(_existing_memberships(shard, shard_pairs))
+    new = [pair for pair in pairs if pair not in existing]
+
+    if shards.enabled:
+        shards.write({shard: [(user_organization, [
+            {'user_id': user_id, 'organization_id': organization_id}
+            for user_id, organization_id in shard_pairs if (user_id, organization_id) not in existing
+        ])] for shard, shard_pairs in by_shard.items()})
+    else:
+        _insert(user_organization, [{'user_id': user_id, 'organization_id': organization_id} for user_id, organization_id in new])
+        db.session.commit()
+    return len(new), resolved - len(new), errors
+
+# Which of `pairs` are already memberships, on one shard (None: the primary)
+def _existing_memberships(shard, pairs):
+    from . import shards
+    from .models import db, user_organization, chunked
+    found = set()
+    for part in chunked(list({user_id for user_id, _ in pairs})):
+        query = select(user_organization.c.user_id, user_organization.c.organization_id)\
+            .where(user_organization.c.user_id.in_(part))
+        if shard is None:
+            found.update(map(tuple, db.session.execute(query)))
+        else:
+            with shards.engine(shard).connect() as connection:
+                found.update(map(tuple, connection.execute(query)))
+    return found & set(pairs)
+
+def _validated(chunk, validator):
+    rows, errors = {}, {}
+    for number, data in chunk:
+        values, row_errors = validator.validate(data)
+        if row_errors:
+            errors[number] = row_errors
+        else:
+            rows[number] = values
+    return rows, errors
+
+IMPORTERS = {
+    'users': _import_users,
+    'organizations': _import_organizations,
+    'memberships': _import_memberships
+}
+
+# Where an interrupted import of `path` resumes: the file position after the
+# last committed chunk, plus the file's size and mtime to notice edits
+def _checkpoint_path(path):
+    return path + '.checkpoint'
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _load_checkpoint(path, kind):
+    try:
+        with open(_checkpoint_path(path)) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint['kind'] != kind or checkpoint['stamp'] != _file_stamp(path):
+        raise click.ClickException('{} belongs to another import or the file has changed; '
+                                   'use --restart to start over'.format(_checkpoint_path(path)))
+    return checkpoint
+
+def _save_checkpoint(path, checkpoint):
+    tmp = _checkpoint_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, _checkpoint_path(path))
+
+# Stream `path` into the database BULK_CHUNK_SIZE rows per transaction.
+# Memory holds one chunk at a time whatever the file's size. Rows that fail
+# validation are reported through `reject(row number, errors)` and skipped.
+def import_file(kind, path, fmt=None, chunk_size=None, restart=False, reject=None):
+    fmt = _format(path, fmt)
+    chunk_size = chunk_size or current_app.config['BULK_CHUNK_SIZE']
+    checkpoint = None if restart else _load_checkpoint(path, kind)
+    if checkpoint is None:
+        checkpoint = {'kind': kind, 'stamp': _file_stamp(path), 'offset': 0, 'rows': 0,
+                      'inserted': 0, 'skipped': 0, 'rejected': 0}
+
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = enumerate(_read(f, fmt, checkpoint['offset']), checkpoint['rows'] + 1)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            inserted, skipped, errors = IMPORTERS[kind](chunk)
+            for number in sorted(errors):
+                if reject is not None:
+                    reject(number, errors[number])
+            checkpoint.update(offset=f.tell(), rows=chunk[-1][0], inserted=checkpoint['inserted'] + inserted,
+                              skipped=checkpoint['skipped'] + skipped, rejected=checkpoint['rejected'] + len(errors))
+            _save_checkpoint(path, checkpoint)
+
+    if os.path.exists(_checkpoint_path(path)):
+        os.remove(_checkpoint_path(path))
+    return checkpoint
+
+# Rows of each kind, as dicts of FIELDS[kind], streamed in a fixed order
+
+def _export_users():
+    from .models import db, User
+    columns = [getattr(User, field) for field in FIELDS['users']]
+    query = db.session.query(*columns).order_by(User.id)\
+        .execution_options(stream_results=True).yield_per(current_app.config['STREAM_BATCH_SIZE'])
+    for row in query:
+        yield dict(zip(FIELDS['users'], row))
+
+def _export_organizations():
+    from . import shards
+    from .models import Organization
+    columns = [getattr(Organization, field) for field in FIELDS['organizations']]
+    for row in shards.all_organizations(columns):
+        yield dict(zip(FIELDS['organizations'], row[1:]))
+
+# Memberships are read as id pairs (from every shard when sharded); each
+# batch's userIds and orgIds are then looked up with IN queries
+def _export_memberships():
+    from . import shards
+    from .models import db, User, Organization, OrganizationDirectory, user_organization, chunked
+    organizations = OrganizationDirectory if shards.enabled else Organization
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    if shards.enabled:
+        pairs = shards.all_memberships()
+    else:
+        pairs = db.session.query(user_organization.c.user_id, user_organization.c.organization_id)\
+            .order_by(user_organization.c.user_id, user_organization.c.organization_id)\
+            .execution_options(stream_results=True).yield_per(batch_size)
+    pairs = iter(pairs)
+    while True:
+        batch = list(itertools.islice(pairs, batch_size))
+        if not batch:
+            return
+        userIds, orgIds = {}, {}
+        for part in chunked(list({user_id for user_id, _ in batch})):
+            userIds.update(db.session.query(User.id, User.userId).filter(User.id.in_(part)))
+        for part in chunked(list({organization_id for _, organization_id in batch})):
+            orgIds.update(db.session.query(organizations.id, organizations.orgId).filter(organizations.id.in_(part)))
+        for user_id, organization_id in batch:
+            yield {'userId': userIds[user_id], 'orgId': orgIds[organization_id]}
+
+EXPORTERS = {
+    'users': _export_users,
+    'organizations': _export_organizations,
+    'memberships': _export_memberships
+}
+
+# Write every row of `kind` to the open text file f; returns the row count
+def export_file(kind, f, fmt):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(f, fieldnames=FIELDS[kind])
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda row: f.write(dumps(row).decode() + '\n')
+    for row in EXPORTERS[kind]():
+        write(row)
+        count += 1
+    return count
+
+bulk_cli = AppGroup('bulk', help='Bulk import and export of users, organisations and memberships.')
+
+@bulk_cli.command('import')
+@click.argument('kind', type=click.Choice(list(FIELDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Default: from the file extension.')
+@click.option('--chunk-size', type=int, help='Rows per transaction (default BULK_CHUNK_SIZE).')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted import.')
+def import_command(kind, path, fmt, chunk_size, restart):
+    """Import users, organizations or memberships from a CSV or JSONL file, resuming where an earlier run stopped."""
+    def reject(number, errors):
+        click.echo('Row {}: {}'.format(number, json.dumps(errors)), err=True)
+
+    result = import_file(kind, path, fmt, chunk_size, restart, reject)
+    click.echo('{rows} rows: {inserted} imported, {skipped} already present, {rejected} rejected'.format(**result))
+
+@bulk_cli.command('export')
+@click.argument('kind', type=click.Choice(list(FIELDS)))
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Default: from the file extension.')
+def export_command(kind, path, fmt):
+    """Export users, organizations or memberships to a CSV or JSONL file ('-' for stdout)."""
+    if path == '-':
+        with click.open_file(path, 'w') as f:
+            export_file(kind, f, fmt or 'jsonl')
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        count = export_file(kind, f, _format(path, fmt))
+    click.echo('Exported {} {}'.format(count, kind))
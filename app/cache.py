@@ -0,0 +1,217 @@
+#app/cache.py
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from werkzeug.utils import import_string
+
+# Plain snapshot of a user row, safe to share between requests and sessions
+CachedUser = namedtuple('CachedUser', ['id', 'userId', 'firstName', 'lastName', 'email', 'phone', 'version'])
+
+# Process-local LRU store with per-entry TTL
+# A backend only needs get/set/delete/clear and a (maxsize, ttl) constructor,
+# so a shared-memory store can be swapped in through USER_CACHE_BACKEND
+class LocalBackend:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# When each userId was last invalidated, in a memory-mapped file shared by
+# every worker process on the host, laid out like the replicas'
+# SharedMemoryStickyStore behind a header holding a floor time. A cached user
+# loaded before its stamp (or the floor) is stale. Stamps older than ttl are
+# recycled, as anything cached before them has expired anyway; when all PROBE
+# slots are newer, the oldest is folded into the floor, which at worst costs
+# every worker a reload of whatever it has cached.
+class SharedInvalidations:
+    HEADER = struct.Struct('<d')
+    SLOT = struct.Struct('<Qd')
+    PROBE = 8
+
+    def __init__(self, path, slots, ttl):
+        self.path = path
+        self.slots = slots
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    # flock() is per open file, so each process (including forked children)
+    # needs its own descriptor
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.HEADER.size + self.slots * self.SLOT.size
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _slot_hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def _offsets(self, h):
+        home = h % self.slots
+        return [self.HEADER.size + (home + i) % self.slots * self.SLOT.size for i in range(self.PROBE)]
+
+    @contextmanager
+    def _locked(self):
+        if self._pid != os.getpid():
+            self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # Time key was last invalidated, or the floor if later
+    def invalidated_at(self, key):
+        h = self._slot_hash(key)
+        with self._locked():
+            floor, = self.HEADER.unpack_from(self._map, 0)
+            for offset in self._offsets(h):
+                slot_hash, stamp = self.SLOT.unpack_from(self._map, offset)
+                if slot_hash == h:
+                    return max(floor, stamp)
+        return floor
+
+    def invalidate(self, key):
+        h = self._slot_hash(key)
+        now = time.time()
+        with self._locked():
+            slots = [(offset,) + self.SLOT.unpack_from(self._map, offset) for offset in self._offsets(h)]
+            free = [offset for offset, slot_hash, stamp in slots if slot_hash == h] + \
+                   [offset for offset, slot_hash, stamp in slots if slot_hash == 0 or stamp < now - self.ttl]
+            if free:
+                offset = free[0]
+            else:
+                offset, _, stamp = min(slots, key=lambda slot: slot[2])
+                floor, = self.HEADER.unpack_from(self._map, 0)
+                self.HEADER.pack_into(self._map, 0, max(floor, stamp))
+            self.SLOT.pack_into(self._map, offset, h, now)
+
+    # Everything cached so far, in every process, is stale
+    def invalidate_all(self):
+        with self._locked():
+            self._map[:] = bytes(len(self._map))
+            self.HEADER.pack_into(self._map, 0, time.time())
+
+class _CacheState:
+    def __init__(self, backend, invalidations):
+        self.backend = backend
+        # SharedInvalidations when workers share USER_CACHE_INVALIDATION_FILE
+        self.invalidations = invalidations
+        self.hits = 0
+        self.misses = 0
+
+# Read-through cache of users keyed by userId. Entries are (time loaded,
+# user); with shared invalidations, one loaded before its userId was last
+# invalidated by any worker counts as a miss.
+class UserCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_class = app.config['USER_CACHE_BACKEND']
+        if isinstance(backend_class, str):
+            backend_class = import_string(backend_class)
+        backend = backend_class(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+        path = app.config['USER_CACHE_INVALIDATION_FILE']
+        app.extensions['user_cache'] = _CacheState(backend, self._invalidations(app, path) if path else None)
+
+    # Share invalidations through the file `path` from now on
+    def share_invalidations(self, app, path):
+        app.config['USER_CACHE_INVALIDATION_FILE'] = path
+        app.extensions['user_cache'].invalidations = self._invalidations(app, path)
+
+    def _invalidations(self, app, path):
+        return SharedInvalidations(path, app.config['USER_CACHE_INVALIDATION_SLOTS'], app.config['USER_CACHE_TTL'])
+
+    @property
+    def _state(self):
+        return current_app.extensions['user_cache']
+
+    def get(self, userId):
+        state = self._state
+        entry = state.backend.get(userId)
+        if entry is not None:
+            loaded_at, user = entry
+            if state.invalidations is None or loaded_at > state.invalidations.invalidated_at(userId):
+                state.hits += 1
+                return user
+
+        state.misses += 1
+        # Taken before the read, so a write committed meanwhile is newer
+        loaded_at = time.time()
+        user = self._load(userId)
+        if user is not None:
+            state.backend.set(userId, (loaded_at, user))
+        return user
+
+    def invalidate(self, userId):
+        state = self._state
+        state.backend.delete(userId)
+        if state.invalidations is not None:
+            state.invalidations.invalidate(userId)
+
+    def clear(self):
+        state = self._state
+        state.backend.clear()
+        if state.invalidations is not None:
+            state.invalidations.invalidate_all()
+
+    def stats(self):
+        state = self._state
+        return {'hits': state.hits, 'misses': state.misses, 'size': len(state.backend)}
+
+    # From the primary even on GET, see replicas.primary_reads()
+    def _load(self, userId):
+        from .models import db, User
+        from .replicas import primary_reads
+        with primary_reads():
+            row = db.session.query(User.id, User.userId, User.firstName, User.lastName, User.email, User.phone, User.version)\
+                .filter_by(userId=userId).first()
+        if row is None:
+            return None
+        return CachedUser(*row)
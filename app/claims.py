@@ -0,0 +1,50 @@
+#app/claims.py
+
+from flask import current_app
+from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt, get_jwt_identity
+from .models import db, user_organization, is_member
+
+# Access tokens carry:
+#   uid  - the caller's internal user id
+#   orgs - internal ids of the caller's organisations (left out when there
+#          are more than JWT_MEMBERSHIP_CLAIM_MAX of them)
+# Memberships are only ever added, so an orgs claim never lists an
+# organisation the caller has left; it may just miss ones joined since the
+# token was issued, which POST /auth/refresh picks up. Removing members would
+# need a way to retire older claims first.
+
+def membership_claims(user_id, organization_ids=None):
+    if organization_ids is None:
+        from . import shards
+        if shards.enabled:
+            organization_ids = shards.organization_ids_of(user_id)
+        else:
+            organization_ids = [row[0] for row in db.session.query(user_organization.c.organization_id)
+                                .filter(user_organization.c.user_id == user_id)]
+    claims = {'uid': user_id}
+    if len(organization_ids) <= current_app.config['JWT_MEMBERSHIP_CLAIM_MAX']:
+        claims['orgs'] = sorted(organization_ids)
+    return claims
+
+def issue_tokens(userId, user_id, organization_ids=None):
+    claims = membership_claims(user_id, organization_ids)
+    return create_access_token(identity=userId, additional_claims=claims), create_refresh_token(identity=userId)
+
+# Internal id of the caller, straight from the token. Tokens issued before
+# these claims existed fall back to the user cache.
+def caller_user_id():
+    uid = get_jwt().get('uid')
+    if uid is not None:
+        return uid
+    from . import user_cache
+    user = user_cache.get(get_jwt_identity())
+    return user.id if user else None
+
+# The claims can answer yes but not no: the caller may have joined since the
+# token was issued. A no is confirmed against the database, like
+# MembershipIndex does.
+def may_view_organization(organization_id):
+    if organization_id in get_jwt().get('orgs', ()):
+        return True
+    user_id = caller_user_id()
+    return user_id is not None and is_member(user_id, organization_id)
@@ -0,0 +1,68 @@
+#app/conditional.py
+
+from flask import current_app, request
+from .cache import LocalBackend
+
+# Strong ETag for one version of one resource, e.g. "organization-<orgId>-3"
+def make_etag(kind, key, version):
+    return '{}-{}-{}'.format(kind, key, version)
+
+def not_modified(etag):
+    return etag in request.if_none_match
+
+def not_modified_response(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
+
+# (kind, key) -> (row id, row version), so If-None-Match can be answered without
+# loading the row. Entries expire after VERSION_CACHE_TTL seconds, which
+# bounds how stale another worker's view of a write can be.
+class VersionCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['version_cache'] = LocalBackend(app.config['VERSION_CACHE_SIZE'], app.config['VERSION_CACHE_TTL'])
+
+    @property
+    def _backend(self):
+        return current_app.extensions['version_cache']
+
+    def get(self, kind, key):
+        return self._backend.get((kind, key))
+
+    def set(self, kind, key, row_id, version):
+        self._backend.set((kind, key), (row_id, version))
+
+    def invalidate(self, kind, key):
+        self._backend.delete((kind, key))
+
+# For conditional GETs: answer 304 from the cached version if possible,
+# otherwise read just the (id, version) columns with load(). authorize(id),
+# if given, must pass before a 304 is sent. Returns None when the full
+# response has to be built.
+def check_not_modified(kind, key, load, authorize=None):
+    if not request.if_none_match:
+        return None
+    from . import version_cache
+    from .replicas import primary_reads
+    cached = version_cache.get(kind, key)
+    if cached is None:
+        with primary_reads():
+            cached = load()
+        if cached is None:
+            return None
+        version_cache.set(kind, key, *cached)
+    row_id, version = cached
+    if authorize is not None and not authorize(row_id):
+        return None
+    etag = make_etag(kind, key, version)
+    if not_modified(etag):
+        return not_modified_response(etag)
+    return None
@@ -1,8 +1,124 @@
 #app/config.py
 
 import os
+import json
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    WTF_CSRF_ENABLED = (os.environ.get('WTF_CSRF_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+
+    # Keyset pagination for list endpoints
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE') or 50)
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE') or 500)
+    # Rows fetched per round trip when streaming NDJSON
+    STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE') or 1000)
+
+    # Read-through user cache (see app/cache.py). Set
+    # USER_CACHE_INVALIDATION_FILE to a path all workers share (e.g.
+    # /dev/shm/user-auth-users) so a write in one drops the user from every
+    # worker's cache; `flask serve` picks one itself
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND') or 'app.cache.LocalBackend'
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL') or 60)
+    USER_CACHE_INVALIDATION_FILE = os.environ.get('USER_CACHE_INVALIDATION_FILE')
+    USER_CACHE_INVALIDATION_SLOTS = int(os.environ.get('USER_CACHE_INVALIDATION_SLOTS') or 65536)
+
+    # Password hashing pool (see app/password_pool.py); 0 workers hashes inline
+    PASSWORD_POOL_KIND = os.environ.get('PASSWORD_POOL_KIND') or 'thread'
+    PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS') or os.cpu_count() or 1)
+    PASSWORD_POOL_MAX_QUEUE = int(os.environ.get('PASSWORD_POOL_MAX_QUEUE') or 32)
+    PASSWORD_POOL_TIMEOUT = float(os.environ.get('PASSWORD_POOL_TIMEOUT') or 5)
+    # Passwords per pool job when hashing a batch registration or import
+    PASSWORD_POOL_BATCH_CHUNK = int(os.environ.get('PASSWORD_POOL_BATCH_CHUNK') or 8)
+
+    # Password hasher (see app/hashers.py); run `flask hashers calibrate` to pick params
+    PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER') or 'pbkdf2'
+    PASSWORD_HASHER_PARAMS = json.loads(os.environ.get('PASSWORD_HASHER_PARAMS') or '{}')
+
+    # Largest accepted POST /auth/register/batch, in registrations and in bytes
+    REGISTER_BATCH_MAX = int(os.environ.get('REGISTER_BATCH_MAX') or 10000)
+    REGISTER_BATCH_MAX_BYTES = int(os.environ.get('REGISTER_BATCH_MAX_BYTES') or 16 * 1024 * 1024)
+
+    # Prometheus metrics at /metrics (see app/metrics.py). Set METRICS_DIR to a
+    # directory shared by all workers so every scrape sees the combined totals;
+    # `flask serve` picks one itself
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL') or 1)
+
+    # Per-request SQL profiling (see app/query_profiler.py); headers are always on in debug mode
+    QUERY_PROFILER_HEADERS = (os.environ.get('QUERY_PROFILER_HEADERS') or '').lower() in ('1', 'true', 'yes')
+    QUERY_N_PLUS_ONE_THRESHOLD = int(os.environ.get('QUERY_N_PLUS_ONE_THRESHOLD') or 3)
+
+    # Row versions for conditional GETs (see app/conditional.py)
+    VERSION_CACHE_SIZE = int(os.environ.get('VERSION_CACHE_SIZE') or 100000)
+    VERSION_CACHE_TTL = float(os.environ.get('VERSION_CACHE_TTL') or 5)
+
+    # Tokens list the caller's organisation ids up to this many memberships (see app/claims.py)
+    JWT_MEMBERSHIP_CLAIM_MAX = int(os.environ.get('JWT_MEMBERSHIP_CLAIM_MAX') or 50)
+
+    # Token buckets on login and register, per client IP and per userId (see
+    # app/rate_limit.py). Set RATE_LIMIT_FILE to a path all workers share
+    # (e.g. /dev/shm/user-auth-limits) so the limits hold across processes;
+    # `flask serve` makes one itself. Behind load balancers or reverse
+    # proxies, set TRUSTED_PROXIES to how many of them append to
+    # X-Forwarded-For, so the client IP is taken from that header
+    RATE_LIMIT_ENABLED = (os.environ.get('RATE_LIMIT_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+    RATE_LIMIT_FILE = os.environ.get('RATE_LIMIT_FILE')
+    RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS') or 65536)
+    RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST') or 30)
+    RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE') or 60)
+    RATE_LIMIT_USER_BURST = int(os.environ.get('RATE_LIMIT_USER_BURST') or 5)
+    RATE_LIMIT_USER_PER_MINUTE = float(os.environ.get('RATE_LIMIT_USER_PER_MINUTE') or 5)
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES') or 0)
+
+    # Read replicas (see app/replicas.py): comma-separated URLs that GET
+    # requests read from. A caller's reads stay on the primary for
+    # REPLICA_STICKY_SECONDS after they write. Set REPLICA_STICKY_FILE to a
+    # path all workers share (e.g. /dev/shm/user-auth-sticky) so that holds
+    # across processes; `flask serve` picks one itself
+    REPLICA_DATABASE_URLS = [url for url in (os.environ.get('REPLICA_DATABASE_URLS') or '').split(',') if url]
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS') or 5)
+    REPLICA_STICKY_BACKEND = os.environ.get('REPLICA_STICKY_BACKEND') or 'app.cache.LocalBackend'
+    REPLICA_STICKY_FILE = os.environ.get('REPLICA_STICKY_FILE')
+    REPLICA_STICKY_SLOTS = int(os.environ.get('REPLICA_STICKY_SLOTS') or 65536)
+
+    # Organisation sharding (see app/sharding.py): comma-separated URLs of the
+    # shard databases; placements read from the directory are cached for
+    # SHARD_DIRECTORY_TTL seconds
+    SHARD_DATABASE_URLS = [url for url in (os.environ.get('SHARD_DATABASE_URLS') or '').split(',') if url]
+    SHARD_DIRECTORY_TTL = float(os.environ.get('SHARD_DIRECTORY_TTL') or 5)
+
+    # Write-behind auth event log (see app/events.py): events are written in
+    # batches of EVENT_LOG_BATCH_SIZE or every EVENT_LOG_FLUSH_MS. A full queue
+    # holds the request up to EVENT_LOG_PUT_TIMEOUT seconds, then drops the
+    # event; a queue size of 0 writes inline
+    EVENT_LOG_QUEUE_SIZE = int(os.environ.get('EVENT_LOG_QUEUE_SIZE') or 10000)
+    EVENT_LOG_BATCH_SIZE = int(os.environ.get('EVENT_LOG_BATCH_SIZE') or 500)
+    EVENT_LOG_FLUSH_MS = float(os.environ.get('EVENT_LOG_FLUSH_MS') or 200)
+    EVENT_LOG_PUT_TIMEOUT = float(os.environ.get('EVENT_LOG_PUT_TIMEOUT') or 0.5)
+    EVENT_LOG_CLOSE_TIMEOUT = float(os.environ.get('EVENT_LOG_CLOSE_TIMEOUT') or 10)
+
+    # Background jobs (see app/jobs.py), run by `flask jobs work`. Failed jobs
+    # are retried after JOB_BACKOFF_SECONDS, doubling each time; a job still
+    # running after JOB_LEASE_SECONDS is taken to have lost its worker
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 4)
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS') or 5)
+    JOB_BACKOFF_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS') or 10)
+    JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS') or 300)
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL') or 1)
+    # Callable(userId, kind, data, key) that delivers notifications
+    NOTIFIER = os.environ.get('NOTIFIER') or 'app.tasks.log_notifier'
+
+    # Rows per transaction in `flask bulk import` (see app/bulk.py)
+    BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE') or 5000)
+
+    # `flask serve` (see app/server.py): preforked workers, each with a fixed
+    # pool of request threads; in-flight requests get this long on stop/reload.
+    # Idle keep-alive connections are closed after SERVER_KEEPALIVE seconds
+    # (0 closes every connection after its response)
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or os.cpu_count() or 1)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 8)
+    SERVER_GRACEFUL_TIMEOUT = float(os.environ.get('SERVER_GRACEFUL_TIMEOUT') or 30)
+    SERVER_KEEPALIVE = float(os.environ.get('SERVER_KEEPALIVE') or 2)
@@ -0,0 +1,183 @@
+#app/events.py
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import current_app, has_request_context, request
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue by close(): the writer flushes what is ahead of it and stops
+_STOP = object()
+
+class _EventState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.queue = None
+        self.writer = None
+        self.pid = None
+
+    # The queue and its writer thread are started on first use, and again in
+    # forked workers, which do not inherit their parent's threads. None means
+    # events are written inline.
+    def get_queue(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.queue = self.writer = None
+                    config = self.app.config
+                    if config['EVENT_LOG_QUEUE_SIZE'] > 0:
+                        self.queue = queue.Queue(config['EVENT_LOG_QUEUE_SIZE'])
+                    # An in-memory SQLite database is one connection shared by
+                    # every thread; a writer thread would commit in the middle
+                    # of a request's transaction. There the queue is only
+                    # written by flush() or by the request that fills a batch.
+                    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+                    in_memory = uri.rstrip('/') in ('sqlite:', 'sqlite:///:memory:')
+                    if self.queue is not None and not in_memory:
+                        self.writer = threading.Thread(target=self._write_behind, name='event-log', daemon=True,
+                                                       args=(self.queue, config['EVENT_LOG_BATCH_SIZE'],
+                                                             config['EVENT_LOG_FLUSH_MS'] / 1000))
+                        self.writer.start()
+                    self.pid = os.getpid()
+        return self.queue
+
+    # Collect up to batch_size events, waiting at most `interval` after the
+    # first one, and write them in one statement
+    def _write_behind(self, events, batch_size, interval):
+        stopping = False
+        while not stopping:
+            first = events.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                try:
+                    event = events.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            self._write(batch, interval)
+
+    # A failed batch is retried twice, then dropped: the queue keeps filling
+    # meanwhile, and requests are only ever made to wait EVENT_LOG_PUT_TIMEOUT
+    def _write(self, batch, interval, attempts=3):
+        from .models import db, AuthEvent
+        for attempt in range(attempts):
+            try:
+                with self.app.app_context():
+                    # executemany; psycopg2 sends it as multi-row INSERT ... VALUES
+                    with db.engine.begin() as connection:
+                        connection.execute(AuthEvent.__table__.insert(), batch)
+                registry.inc('auth_events_written_total', {}, len(batch))
+                return
+            except Exception:
+                logger.exception('Writing %d auth events failed (attempt %d)', len(batch), attempt + 1)
+                time.sleep(interval)
+        registry.inc('auth_events_dropped_total', {}, len(batch))
+
+    # Write whatever is queued from the calling thread, for queues without a
+    # writer thread
+    def flush(self):
+        batch_size = self.app.config['EVENT_LOG_BATCH_SIZE']
+        while True:
+            batch = []
+            try:
+                while len(batch) < batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch, 0)
+            if len(batch) < batch_size:
+                return
+
+    # Stop accepting events, then wait up to `timeout` seconds for the writer
+    # to flush those already queued. (Without a writer the database is in
+    # memory and ends with the process.)
+    def close(self, timeout):
+        with self.lock:
+            events, writer = self.queue, self.writer
+            if self.pid != os.getpid() or writer is None:
+                return True
+            self.queue = self.writer = None
+            self.pid = None
+        deadline = time.monotonic() + timeout
+        try:
+            events.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return False
+        writer.join(max(0, deadline - time.monotonic()))
+        return not writer.is_alive()
+
+# `value` cut to the length of auth_event's `column`. userId on a failed
+# login comes straight from the client, and one over-long value would fail
+# the whole batch's INSERT and so lose every event in it.
+def _clip(value, column):
+    from .models import AuthEvent
+    if value is None:
+        return None
+    return str(value)[:AuthEvent.__table__.c[column].type.length]
+
+# Audit log of logins, registrations and membership changes in auth_event.
+# record() only queues the event; a background thread writes the queue in
+# batches of EVENT_LOG_BATCH_SIZE, or whatever has arrived within
+# EVENT_LOG_FLUSH_MS of the batch's first event. When the queue is full,
+# record() waits up to EVENT_LOG_PUT_TIMEOUT for room, then drops the event
+# and counts it in auth_events_dropped_total. Queued events are flushed when
+# the process exits.
+class EventLog:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = app.extensions['event_log'] = _EventState(app)
+        atexit.register(state.close, app.config['EVENT_LOG_CLOSE_TIMEOUT'])
+
+    def record(self, type, userId=None, organization_id=None, actor=None):
+        state = current_app.extensions['event_log']
+        event = {
+            'type': type,
+            'userId': _clip(userId, 'userId'),
+            'organization_id': organization_id,
+            'actor': _clip(actor, 'actor'),
+            'ip': _clip(request.remote_addr, 'ip') if has_request_context() else None,
+            'created_at': datetime.utcnow()
+        }
+        events = state.get_queue()
+        if events is None:
+            from .models import db, AuthEvent
+            db.session.execute(AuthEvent.__table__.insert(), [event])
+            db.session.commit()
+            return
+        try:
+            events.put(event, timeout=current_app.config['EVENT_LOG_PUT_TIMEOUT'])
+        except queue.Full:
+            registry.inc('auth_events_dropped_total', {})
+            logger.warning('Auth event queue full, dropped %s event for %s', type, userId)
+            return
+        if state.writer is None and events.qsize() >= current_app.config['EVENT_LOG_BATCH_SIZE']:
+            state.flush()
+
+    # Write queued events now, from this thread
+    def flush(self):
+        state = current_app.extensions['event_log']
+        if state.get_queue() is not None:
+            state.flush()
+
+    # Flush queued events; False if they were not all written within `timeout`
+    def close(self, timeout=None):
+        if timeout is None:
+            timeout = current_app.config['EVENT_LOG_CLOSE_TIMEOUT']
+        return current_app.extensions['event_log'].close(timeout)
@@ -2,9 +2,11 @@
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError
+from wtforms.validators import DataRequired, Email, Length, EqualTo
 from wtforms.fields import TextAreaField  # Import TextAreaField explicitly
-from .models import User, Organization  # Import Organization model
+
+# The JSON endpoints validate with app/validation.py, which applies the same
+# rules without building a form per request; keep the two in step
 
 class RegistrationForm(FlaskForm):
     userId = StringField('Username', validators=[DataRequired(), Length(min=4, max=20)])
@@ -17,16 +19,9 @@ class RegistrationForm(FlaskForm):
     organization_name = StringField('Organization Name', validators=[DataRequired()])
     organization_description = TextAreaField('Organization Description')  # Added organization description field
     submit = SubmitField('Sign Up')
+    # userId/email uniqueness is checked in app/registration.py in the same
+    # query as the organisation lookup, not with one query per field
 
-    def validate_userId(self, userId):
-        user = User.query.filter_by(userId=userId.data).first()
-        if user:
-            raise ValidationError('Username already taken. Please choose a different one.')
-
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user:
-            raise ValidationError('Email address already registered.')
 
 class LoginForm(FlaskForm):
     userId = StringField('User ID', validators=[DataRequired()])
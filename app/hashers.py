@@ -0,0 +1,203 @@
+#app/hashers.py
+
+import hashlib
+import hmac
+import json
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.security import gen_salt, generate_password_hash, check_password_hash
+
+SALT_LENGTH = 16
+
+# pbkdf2:sha256:<iterations>$salt$hash, the format werkzeug already writes
+class PBKDF2Hasher:
+    name = 'pbkdf2'
+    cost_param = 'iterations'
+
+    def __init__(self, iterations=260000, digest='sha256'):
+        self.iterations = int(iterations)
+        self.digest = digest
+
+    @property
+    def method(self):
+        return 'pbkdf2:{}:{}'.format(self.digest, self.iterations)
+
+    @staticmethod
+    def identify(password_hash):
+        return password_hash.startswith('pbkdf2:')
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method, salt_length=SALT_LENGTH)
+
+    @staticmethod
+    def verify(password_hash, password):
+        return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def params(self):
+        return {'iterations': self.iterations, 'digest': self.digest}
+
+# scrypt:<n>:<r>:<p>$salt$hash, the format newer werkzeug releases write
+class ScryptHasher:
+    name = 'scrypt'
+    cost_param = 'n'
+
+    def __init__(self, n=2 ** 15, r=8, p=1):
+        self.n = int(n)
+        self.r = int(r)
+        self.p = int(p)
+
+    @property
+    def method(self):
+        return 'scrypt:{}:{}:{}'.format(self.n, self.r, self.p)
+
+    @staticmethod
+    def identify(password_hash):
+        return password_hash.startswith('scrypt:')
+
+    @staticmethod
+    def _derive(password, salt, n, r, p):
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'),
+                              n=n, r=r, p=p, maxmem=132 * n * r * p).hex()
+
+    def hash(self, password):
+        salt = gen_salt(SALT_LENGTH)
+        return '{}${}${}'.format(self.method, salt, self._derive(password, salt, self.n, self.r, self.p))
+
+    @classmethod
+    def verify(cls, password_hash, password):
+        try:
+            method, salt, expected = password_hash.split('$', 2)
+            n, r, p = (int(x) for x in method.split(':')[1:])
+        except ValueError:
+            return False
+        return hmac.compare_digest(cls._derive(password, salt, n, r, p), expected)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def params(self):
+        return {'n': self.n, 'r': self.r, 'p': self.p}
+
+# $argon2id$... hashes, only available when argon2-cffi is installed
+class Argon2Hasher:
+    name = 'argon2'
+    cost_param = 'time_cost'
+
+    def __init__(self, time_cost=3, memory_cost=65536, parallelism=4):
+        from argon2 import PasswordHasher
+        self._hasher = PasswordHasher(time_cost=int(time_cost), memory_cost=int(memory_cost),
+                                      parallelism=int(parallelism))
+
+    @staticmethod
+    def identify(password_hash):
+        return password_hash.startswith('$argon2')
+
+    def hash(self, password):
+        return self._hasher.hash(password)
+
+    @staticmethod
+    def verify(password_hash, password):
+        from argon2 import PasswordHasher
+        from argon2.exceptions import VerificationError, InvalidHash
+        try:
+            return PasswordHasher().verify(password_hash, password)
+        except (VerificationError, InvalidHash):
+            return False
+
+    def needs_rehash(self, password_hash):
+        return self._hasher.check_needs_rehash(password_hash)
+
+    def params(self):
+        return {'time_cost': self._hasher.time_cost, 'memory_cost': self._hasher.memory_cost,
+                'parallelism': self._hasher.parallelism}
+
+def argon2_available():
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+HASHERS = {
+    'pbkdf2': PBKDF2Hasher,
+    'scrypt': ScryptHasher,
+    'argon2': Argon2Hasher,
+}
+
+def get_hasher(name, params=None):
+    if name not in HASHERS:
+        raise ValueError('Unknown password hasher: {}'.format(name))
+    if name == 'argon2' and not argon2_available():
+        raise ValueError('The argon2 hasher needs the argon2-cffi package')
+    return HASHERS[name](**(params or {}))
+
+# Module-level so they can be shipped to a process pool
+
+def hash_password(name, params, password):
+    return get_hasher(name, params).hash(password)
+
+def verify_password(password_hash, password):
+    for hasher_class in HASHERS.values():
+        if hasher_class.identify(password_hash):
+            return hasher_class.verify(password_hash, password)
+    return False
+
+def configured_hasher(app=None):
+    config = (app or current_app).config
+    return config['PASSWORD_HASHER'], config['PASSWORD_HASHER_PARAMS']
+
+def needs_rehash(password_hash, app=None):
+    name, params = configured_hasher(app)
+    hasher_class = HASHERS[name]
+    if not hasher_class.identify(password_hash):
+        return True
+    return get_hasher(name, params).needs_rehash(password_hash)
+
+# Double the cost parameter until one verify takes at least target_ms
+def calibrate(name, target_ms, params=None):
+    params = dict(params or {})
+    hasher = get_hasher(name, params)
+    cost_param = hasher.cost_param
+    cost = hasher.params()[cost_param]
+    # Start low and work upwards so the search stays quick on slow hosts
+    cost = max(1, cost // 64) if cost_param != 'n' else 2 ** 10
+
+    while True:
+        params[cost_param] = cost
+        hasher = get_hasher(name, params)
+        password_hash = hasher.hash('calibration-password')
+        start = time.perf_counter()
+        hasher.verify(password_hash, 'calibration-password')
+        elapsed = (time.perf_counter() - start) * 1000
+        if elapsed >= target_ms:
+            return hasher.params(), elapsed
+        cost *= 2
+
+hashers_cli = AppGroup('hashers', help='Password hasher tools.')
+
+@hashers_cli.command('calibrate')
+@click.option('--algorithm', default=None, help='Hasher to calibrate (defaults to PASSWORD_HASHER).')
+@click.option('--target-ms', default=250.0, show_default=True, help='Target verify time per login.')
+def calibrate_command(algorithm, target_ms):
+    """Pick cost parameters that hit a target verify time on this host."""
+    name, params = configured_hasher()
+    if algorithm and algorithm != name:
+        name, params = algorithm, {}
+    params, elapsed = calibrate(name, target_ms, params)
+    click.echo('{} verify took {:.1f} ms'.format(name, elapsed))
+    click.echo('PASSWORD_HASHER={}'.format(name))
+    click.echo("PASSWORD_HASHER_PARAMS='{}'".format(json.dumps(params)))
+
+@hashers_cli.command('list')
+def list_command():
+    """Show the available hashers."""
+    current, _ = configured_hasher()
+    for name in HASHERS:
+        if name == 'argon2' and not argon2_available():
+            continue
+        click.echo('{}{}'.format(name, ' (configured)' if name == current else ''))
@@ -0,0 +1,181 @@
+#app/jobs.py
+
+import json
+import logging
+import signal
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, or_, select
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+# Deferred work kept in the primary's job table, so there is no broker to
+# run: request handlers enqueue() in the same transaction as the rows the
+# work is about, and `flask jobs work` runs it. A job is retried with
+# exponential backoff until max_attempts; one whose worker died is run again
+# once its JOB_LEASE_SECONDS lease runs out. Jobs therefore run at least
+# once, and tasks get the job's idempotency key to pass on to anything that
+# can deduplicate. Enqueueing a key that is already in the table does
+# nothing. Tasks are registered with @jobs.task(name) (see app/tasks.py).
+class JobQueue:
+    def __init__(self):
+        # name -> (fn(payload, key), max_attempts or None)
+        self.tasks = {}
+
+    # Register fn(payload, key) as the task `name`
+    def task(self, name, max_attempts=None):
+        def decorator(fn):
+            self.tasks[name] = (fn, max_attempts)
+            return fn
+        return decorator
+
+    def enqueue(self, name, payload, key=None, delay=0):
+        self.enqueue_many([(name, payload, key)], delay)
+
+    # Add [(name, payload, key), ...] to the session with one statement; they
+    # are committed with the caller's transaction
+    def enqueue_many(self, jobs, delay=0):
+        from .models import db, Job, insert_new
+        if not jobs:
+            return
+        now = datetime.utcnow()
+        rows = []
+        for name, payload, key in jobs:
+            max_attempts = self.tasks[name][1] or current_app.config['JOB_MAX_ATTEMPTS']
+            rows.append({'task': name, 'payload': json.dumps(payload), 'key': key, 'status': QUEUED, 'attempts': 0,
+                         'max_attempts': max_attempts, 'run_at': now + timedelta(seconds=delay), 'created_at': now})
+        # A key already taken is skipped
+        db.session.execute(insert_new(db.engine.dialect.name, Job.__table__, ['key']), rows)
+
+    # Mark the next due job as running under a new lease token and return it,
+    # or None. Concurrent workers skip each other's rows (FOR UPDATE SKIP
+    # LOCKED on Postgres; SQLite runs one writer at a time anyway).
+    def claim(self):
+        from .models import db, Job
+        jobs = Job.__table__
+        now = datetime.utcnow()
+        due = or_(and_(jobs.c.status == QUEUED, jobs.c.run_at <= now),
+                  and_(jobs.c.status == RUNNING, jobs.c.locked_until < now))
+        candidate = select(jobs.c.id).where(due).order_by(jobs.c.run_at).limit(1)\
+            .with_for_update(skip_locked=True).scalar_subquery()
+        token = uuid.uuid4().hex
+        # `due` is repeated so a row claimed meanwhile by another worker is left alone
+        claimed = db.session.execute(jobs.update().where(jobs.c.id == candidate).where(due).values(
+            status=RUNNING, locked_by=token, attempts=jobs.c.attempts + 1,
+            locked_until=now + timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])
+        )).rowcount
+        db.session.commit()
+        if not claimed:
+            return None
+        return db.session.execute(select(jobs).where(jobs.c.locked_by == token)).first()
+
+    # Run a claimed job and record the outcome. Returns its new status.
+    def run(self, job):
+        from .models import db, Job
+        jobs = Job.__table__
+        now = datetime.utcnow()
+        task = self.tasks.get(job.task)
+        try:
+            if job.attempts > job.max_attempts:
+                raise RuntimeError('Lease expired on the last attempt')
+            if task is None:
+                raise LookupError('No task named {}'.format(job.task))
+            task[0](json.loads(job.payload), job.key)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Job %d (%s) failed on attempt %d', job.id, job.task, job.attempts)
+            status = FAILED if job.attempts >= job.max_attempts else QUEUED
+            backoff = current_app.config['JOB_BACKOFF_SECONDS'] * 2 ** (job.attempts - 1)
+            values = {'status': status, 'last_error': traceback.format_exc(), 'locked_by': None, 'locked_until': None,
+                      'run_at': now + timedelta(seconds=backoff)}
+            if status == FAILED:
+                values['finished_at'] = now
+        else:
+            status = DONE
+            values = {'status': DONE, 'locked_by': None, 'locked_until': None, 'finished_at': datetime.utcnow()}
+        # A worker whose lease ran out no longer owns the job
+        db.session.execute(jobs.update().where(jobs.c.id == job.id, jobs.c.locked_by == job.locked_by).values(**values))
+        db.session.commit()
+        registry.inc('jobs_total', {'task': job.task, 'status': 'retried' if status == QUEUED else status})
+        return status
+
+    # Claim and run jobs until `stopping` is set or, with burst, until none
+    # is due. Returns how many ran.
+    def work(self, stopping, burst=False):
+        ran = 0
+        while not stopping.is_set():
+            job = self.claim()
+            if job is None:
+                if burst:
+                    break
+                stopping.wait(current_app.config['JOB_POLL_INTERVAL'])
+                continue
+            self.run(job)
+            ran += 1
+        return ran
+
+jobs_cli = AppGroup('jobs', help='Background job tools.')
+
+@jobs_cli.command('work')
+@click.option('--workers', type=int, default=None, help='Worker threads (default JOB_WORKERS).')
+@click.option('--burst', is_flag=True, help='Exit once no job is due.')
+def work_command(workers, burst):
+    """Run queued jobs until stopped."""
+    from . import jobs
+    app = current_app._get_current_object()
+    workers = workers or app.config['JOB_WORKERS']
+    stopping = threading.Event()
+    # The job in hand is finished before stopping
+    handlers = {sig: signal.signal(sig, lambda *args: stopping.set()) for sig in (signal.SIGTERM, signal.SIGINT)}
+    counts = []
+
+    def worker():
+        with app.app_context():
+            counts.append(jobs.work(stopping, burst))
+
+    threads = [threading.Thread(target=worker, name='job-{}'.format(i)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    # Joined with a timeout so signals are handled meanwhile
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+    click.echo('Ran {} jobs'.format(sum(counts)))
+
+@jobs_cli.command('status')
+def status_command():
+    """Show how many jobs there are in each state."""
+    from .models import db, Job
+    counts = dict(db.session.query(Job.status, func.count()).group_by(Job.status))
+    for status in (QUEUED, RUNNING, DONE, FAILED):
+        click.echo('{}: {}'.format(status, counts.get(status, 0)))
+
+@jobs_cli.command('retry')
+def retry_command():
+    """Queue every failed job again with fresh attempts."""
+    from .models import db, Job
+    retried = db.session.query(Job).filter_by(status=FAILED).update(
+        {'status': QUEUED, 'attempts': 0, 'run_at': datetime.utcnow(), 'finished_at': None}, synchronize_session=False)
+    db.session.commit()
+    click.echo('Queued {} failed jobs again'.format(retried))
+
+@jobs_cli.command('purge')
+@click.option('--days', type=float, default=7, help='Age of finished jobs to delete.')
+def purge_command(days):
+    """Delete jobs that finished more than --days ago."""
+    from .models import db, Job
+    purged = db.session.query(Job).filter(Job.status.in_((DONE, FAILED)),
+                                          Job.finished_at < datetime.utcnow() - timedelta(days=days))\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    click.echo('Deleted {} jobs'.format(purged))
@@ -0,0 +1,174 @@
+#app/membership_index.py
+
+import heapq
+import logging
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+def _contains(ids, value):
+    i = bisect_left(ids, value)
+    return i < len(ids) and ids[i] == value
+
+# Copy of `ids` (a sorted array) with `values` (sorted, distinct) merged in,
+# in one pass, or `ids` itself if they are all there already. Arrays are
+# never changed in place, so readers need no lock.
+def _with(ids, values):
+    new = [value for value in values if not _contains(ids, value)]
+    if not new:
+        return ids
+    return array('q', heapq.merge(ids, new))
+
+def _intersects(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return any(_contains(b, value) for value in a)
+
+_EMPTY = array('q')
+
+class _IndexState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        # Background load of this process, see MembershipIndex._ready()
+        self.loader = None
+        self.loader_pid = None
+        self.loader_lock = threading.Lock()
+        # user id -> sorted array of organisation ids, and the reverse
+        self.user_orgs = {}
+        self.org_users = {}
+
+# All of user_organization held as sorted int64 arrays in both directions,
+# so "do these two users share an organisation" never touches the database.
+# Memberships are only ever added, so a positive answer is always right; a
+# negative one may just mean another process added the membership, and is
+# confirmed against the database before it is trusted. `flask serve` loads
+# the index before forking; under any other server the first request in each
+# process starts loading it in the background, and requests are answered from
+# the database until it is ready rather than waiting for the scan.
+class MembershipIndex:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['membership_index'] = _IndexState()
+
+    @property
+    def _state(self):
+        state = current_app.extensions['membership_index']
+        if not state.loaded:
+            self.load()
+        return state
+
+    # The index if it is loaded, otherwise None after making sure this process
+    # is loading it. An in-memory SQLite database is one connection shared by
+    # every thread, so there it is loaded inline.
+    def _ready(self):
+        state = current_app.extensions['membership_index']
+        if state.loaded:
+            return state
+        uri = current_app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        if uri.rstrip('/') in ('sqlite:', 'sqlite:///:memory:'):
+            self.load()
+            return state
+        with state.loader_lock:
+            # Forked workers do not inherit their parent's loader thread
+            if state.loader_pid != os.getpid():
+                state.loader = threading.Thread(target=self._load_in_background, name='membership-index', daemon=True,
+                                                args=(current_app._get_current_object(),))
+                state.loader_pid = os.getpid()
+                state.loader.start()
+        return None
+
+    def _load_in_background(self, app):
+        from .models import db
+        with app.app_context():
+            try:
+                self.load()
+            except Exception:
+                logger.exception('Loading the membership index failed; retrying on next use')
+                with app.extensions['membership_index'].loader_lock:
+                    app.extensions['membership_index'].loader_pid = None
+            finally:
+                db.session.remove()
+
+    # Build the index with a single ordered scan
+    def load(self):
+        from .models import db, user_organization
+        from . import shards
+        state = current_app.extensions['membership_index']
+        with state.lock:
+            if state.loaded:
+                return
+            user_orgs, org_users = {}, {}
+            # Ordered by (user_id, organization_id), so every append keeps
+            # both directions sorted
+            if shards.enabled:
+                rows = shards.all_memberships()
+            else:
+                rows = db.session.query(user_organization.c.user_id, user_organization.c.organization_id)\
+                    .order_by(user_organization.c.user_id, user_organization.c.organization_id)\
+                    .yield_per(current_app.config['STREAM_BATCH_SIZE'])
+            for user_id, organization_id in rows:
+                user_orgs.setdefault(user_id, array('q')).append(organization_id)
+                org_users.setdefault(organization_id, array('q')).append(user_id)
+            state.user_orgs, state.org_users = user_orgs, org_users
+            state.loaded = True
+
+    def clear(self):
+        state = current_app.extensions['membership_index']
+        with state.lock:
+            state.user_orgs, state.org_users = {}, {}
+            state.loaded = False
+
+    # Record committed memberships: pairs of (user_id, organization_id)
+    def add(self, memberships):
+        state = current_app.extensions['membership_index']
+        if not state.loaded:
+            # load() will read them from the database
+            return
+        # Grouped first, so each array is copied once per call, not per pair
+        by_user, by_organization = {}, {}
+        for user_id, organization_id in memberships:
+            by_user.setdefault(user_id, set()).add(organization_id)
+            by_organization.setdefault(organization_id, set()).add(user_id)
+        with state.lock:
+            for user_id, organization_ids in by_user.items():
+                state.user_orgs[user_id] = _with(state.user_orgs.get(user_id, _EMPTY), sorted(organization_ids))
+            for organization_id, user_ids in by_organization.items():
+                state.org_users[organization_id] = _with(state.org_users.get(organization_id, _EMPTY), sorted(user_ids))
+
+    def organizations(self, user_id):
+        return self._state.user_orgs.get(user_id, _EMPTY)
+
+    def members(self, organization_id):
+        return self._state.org_users.get(organization_id, _EMPTY)
+
+    def share_organization(self, user_id, other_user_id):
+        state = self._ready()
+        if state is None:
+            return self._share_organization_in_db(user_id, other_user_id)
+        if _intersects(state.user_orgs.get(user_id, _EMPTY), state.user_orgs.get(other_user_id, _EMPTY)):
+            return True
+        return self._share_organization_in_db(user_id, other_user_id)
+
+    def _share_organization_in_db(self, user_id, other_user_id):
+        from .models import db, user_organization
+        from . import shards
+        if shards.enabled:
+            shared = shards.shared_organizations(user_id, other_user_id)
+        else:
+            mine = user_organization.alias()
+            theirs = user_organization.alias()
+            shared = db.session.query(mine.c.organization_id)\
+                .join(theirs, theirs.c.organization_id == mine.c.organization_id)\
+                .filter(mine.c.user_id == user_id, theirs.c.user_id == other_user_id)\
+                .all()
+        # Catch up on whatever another process added
+        self.add([(uid, organization_id) for organization_id, in shared for uid in (user_id, other_user_id)])
+        return bool(shared)
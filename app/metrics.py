@@ -0,0 +1,284 @@
+#app/metrics.py
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from flask import Response, current_app, g, request
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint.'),
+    'password_hash_duration_seconds': ('histogram', 'Password hash/verify time, including pool queueing.'),
+    'db_pool_checkout_wait_seconds': ('histogram', 'Time spent waiting for a pooled database connection.'),
+    'db_pool_size': ('gauge', 'Configured size of the database connection pool.'),
+    'db_pool_checked_out': ('gauge', 'Database connections currently checked out.'),
+    'db_pool_overflow': ('gauge', 'Database connections open beyond the pool size.'),
+    'user_cache_hits_total': ('counter', 'User cache hits.'),
+    'user_cache_misses_total': ('counter', 'User cache misses.'),
+    'rate_limited_total': ('counter', 'Requests rejected by the rate limiter, by bucket.'),
+    'auth_events_written_total': ('counter', 'Auth events written to auth_event.'),
+    'auth_events_dropped_total': ('counter', 'Auth events dropped because the queue was full or the write failed.'),
+    'jobs_total': ('counter', 'Background jobs run, by task and outcome.'),
+}
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+# {name: {key: value}} as JSON-friendly lists
+def _dump(metrics):
+    return {name: [[list(key), value] for key, value in series.items()] for name, series in metrics.items()}
+
+# Metric values of this process. Counters and histograms are additive, so
+# snapshots from several worker processes can simply be summed.
+class Registry:
+    def __init__(self):
+        self.reset()
+
+    # Forked workers start from zero rather than the master's values; the
+    # lock is new too, another thread may have held it across the fork
+    def reset(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[_key(labels)] = series.get(_key(labels), 0) + value
+
+    def set_counter(self, name, labels, value):
+        with self.lock:
+            self.counters.setdefault(name, {})[_key(labels)] = value
+
+    def set_gauge(self, name, labels, value):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_key(labels)] = value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            buckets = series.get(_key(labels))
+            if buckets is None:
+                # One slot per bucket, then sum and count
+                buckets = series[_key(labels)] = [0] * (len(DEFAULT_BUCKETS) + 2)
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+                    break
+            buckets[-2] += value
+            buckets[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'counters': _dump(self.counters),
+                'gauges': _dump(self.gauges),
+                'histograms': _dump(self.histograms)
+            }
+
+registry = Registry()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Sum counters and histograms across snapshots; gauges only come from live
+# processes and are labelled with their pid
+def merge(snapshots):
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for name, series in snapshot['counters'].items():
+            merged = counters.setdefault(name, {})
+            for key, value in series:
+                key = tuple(map(tuple, key))
+                merged[key] = merged.get(key, 0) + value
+        if snapshot['pid'] == os.getpid() or _pid_alive(snapshot['pid']):
+            for name, series in snapshot['gauges'].items():
+                merged = gauges.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(sorted(list(map(tuple, key)) + [('pid', str(snapshot['pid']))]))
+                    merged[key] = value
+        for name, series in snapshot['histograms'].items():
+            merged = histograms.setdefault(name, {})
+            for key, value in series:
+                key = tuple(map(tuple, key))
+                if key in merged:
+                    merged[key] = [a + b for a, b in zip(merged[key], value)]
+                else:
+                    merged[key] = list(value)
+    return counters, gauges, histograms
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Prometheus text exposition format 0.0.4
+def render(counters, gauges, histograms):
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = {'counter': counters, 'gauge': gauges, 'histogram': histograms}[kind].get(name)
+        if not series:
+            continue
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for key, value in sorted(series.items()):
+            if kind != 'histogram':
+                lines.append('{}{} {}'.format(name, _labels(key), _number(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS, value):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _labels(key, [('le', _number(bound))]), cumulative))
+            lines.append('{}_bucket{} {}'.format(name, _labels(key, [('le', '+Inf')]), value[-1]))
+            lines.append('{}_sum{} {}'.format(name, _labels(key), _number(value[-2])))
+            lines.append('{}_count{} {}'.format(name, _labels(key), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+# QueuePool that records how long each checkout waited for a connection
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe('db_pool_checkout_wait_seconds', {}, time.perf_counter() - start)
+
+# Snapshots read from files, skipping any that are missing or half-written
+def _load_snapshots(paths):
+    snapshots = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+class Metrics:
+    def __init__(self, app=None):
+        self._last_flush = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Postgres and other pooled URIs get a timed pool; SQLite keeps the
+        # pool Flask-SQLAlchemy picks for it (a QueuePool would hand one
+        # thread's SQLite connection to another)
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+        if uri and not uri.startswith('sqlite'):
+            app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).setdefault('poolclass', TimedQueuePool)
+        if app.config['METRICS_DIR']:
+            os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+
+        app.before_request(self._start_timer)
+        app.after_request(self._record_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _start_timer(self):
+        g.metrics_start = time.perf_counter()
+
+    def _record_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None or request.endpoint == 'metrics':
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        registry.observe('http_request_duration_seconds', {'endpoint': endpoint, 'method': request.method},
+                         time.perf_counter() - start)
+        registry.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method,
+                                             'status': str(response.status_code)})
+        self._maybe_flush()
+        return response
+
+    # Values that live elsewhere are copied in just before a snapshot
+    def _collect(self):
+        from . import user_cache
+        from .models import db
+        try:
+            pool = db.engine.pool
+        except Exception:
+            pool = None
+        if isinstance(pool, QueuePool):
+            registry.set_gauge('db_pool_size', {}, pool.size())
+            registry.set_gauge('db_pool_checked_out', {}, pool.checkedout())
+            registry.set_gauge('db_pool_overflow', {}, max(0, pool.overflow()))
+
+        stats = user_cache.stats()
+        registry.set_counter('user_cache_hits_total', {}, stats['hits'])
+        registry.set_counter('user_cache_misses_total', {}, stats['misses'])
+
+    def _path(self, pid=None):
+        return os.path.join(current_app.config['METRICS_DIR'], 'metrics_{}.json'.format(pid or os.getpid()))
+
+    # With METRICS_DIR set, each worker writes its snapshot there (at most
+    # every METRICS_FLUSH_INTERVAL seconds) so any worker can serve the total
+    def _maybe_flush(self, force=False):
+        if not current_app.config['METRICS_DIR']:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < current_app.config['METRICS_FLUSH_INTERVAL']:
+            return
+        self._last_flush = now
+        self._collect()
+        path = self._path()
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp, path)
+
+    # Snapshots of exited workers are summed into metrics_exited.json and
+    # removed, so the directory does not grow with every worker ever started.
+    # Scrapes take a lock for this, or two of them could fold the same file.
+    def _fold_exited(self, directory):
+        with open(os.path.join(directory, 'metrics.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = []
+            for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+                pid = os.path.basename(path)[len('metrics_'):-len('.json')]
+                if pid.isdigit() and not _pid_alive(int(pid)):
+                    exited.append(path)
+            if not exited:
+                return
+            folded = os.path.join(directory, 'metrics_exited.json')
+            snapshots = _load_snapshots([folded] + exited)
+            counters, _, histograms = merge(snapshots)
+            tmp = folded + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'pid': 0, 'counters': _dump(counters), 'gauges': {}, 'histograms': _dump(histograms)}, f)
+            os.replace(tmp, folded)
+            for path in exited:
+                os.unlink(path)
+
+    def metrics_view(self):
+        directory = current_app.config['METRICS_DIR']
+        if directory:
+            self._maybe_flush(force=True)
+            self._fold_exited(directory)
+            snapshots = _load_snapshots(glob.glob(os.path.join(directory, 'metrics_*.json')))
+        else:
+            self._collect()
+            snapshots = [registry.snapshot()]
+        return Response(render(*merge(snapshots)), mimetype='text/plain; version=0.0.4')
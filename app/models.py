@@ -1,9 +1,13 @@
 #app/models.py
 
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from .hashers import hash_password, verify_password, configured_hasher
+from .replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# Reads in GET requests may go to a replica (see app/replicas.py)
+db = RoutingSQLAlchemy()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -13,20 +17,26 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     phone = db.Column(db.String(20))
+    # Bumped by SQLAlchemy on every ORM update; drives the ETag
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     # Relationship to organizations (if a user can belong to multiple organizations)
     organizations = db.relationship('Organization', secondary='user_organization', backref=db.backref('users', lazy='dynamic'))
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(*configured_hasher(), password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
 # Define a many-to-many association table
 user_organization = db.Table('user_organization',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('organization_id', db.Integer, db.ForeignKey('organization.id'), primary_key=True)
+    db.Column('organization_id', db.Integer, db.ForeignKey('organization.id'), primary_key=True),
+    # The primary key covers user -> organizations; this covers organization -> users
+    db.Index('ix_user_organization_organization_id_user_id', 'organization_id', 'user_id')
 )
 
 class Organization(db.Model):
@@ -34,4 +44,118 @@ class Organization(db.Model):
     orgId = db.Column(db.String(100), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+# Where each organisation lives when organisations are sharded (see
+# app/sharding.py). It also hands out organisation ids, which stay global and
+# stable across shards and moves; the name is what registration matches on.
+class OrganizationDirectory(db.Model):
+    __tablename__ = 'organization_directory'
+    id = db.Column(db.Integer, primary_key=True)
+    orgId = db.Column(db.String(100), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
+    shard = db.Column(db.Integer, nullable=False)
+
+# Logins, registrations and membership changes, written behind the request
+# (see app/events.py). No foreign keys: failed logins name users that do not
+# exist, and organisations may live on a shard.
+class AuthEvent(db.Model):
+    __tablename__ = 'auth_event'
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(32), nullable=False)
+    userId = db.Column(db.String(100), index=True)
+    organization_id = db.Column(db.Integer)
+    # userId of the caller who made the change, when that is someone else
+    actor = db.Column(db.String(100))
+    ip = db.Column(db.String(45))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# Background jobs (see app/jobs.py)
+class Job(db.Model):
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # Idempotency key: a second job with the same key is never queued
+    key = db.Column(db.String(255), unique=True)
+    status = db.Column(db.String(16), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False)
+    # Lease of the worker running the job
+    locked_by = db.Column(db.String(32))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+    # What workers poll for: due queued jobs and expired leases
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+# Keep IN (...) lists under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+def chunked(items, size=IN_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# INSERT that skips rows clashing with an existing one on index_elements
+def insert_new(dialect, table, index_elements):
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    return insert(table)
+
+# Indexed existence check instead of iterating organization.users
+def is_member(user_id, organization_id):
+    from . import shards
+    if shards.enabled:
+        return shards.is_member(user_id, organization_id)
+    return db.session.query(db.exists().where(
+        (user_organization.c.organization_id == organization_id) &
+        (user_organization.c.user_id == user_id)
+    )).scalar()
+
+# Insert the memberships that do not exist yet, in one executemany
+# Returns the user ids that were actually added; the caller commits.
+# A concurrent add of the same member is skipped by the insert rather than
+# failing it; both callers then report the member as added.
+def add_members(organization_id, user_ids):
+    from . import shards
+    user_ids = list(dict.fromkeys(user_ids))
+    if shards.enabled:
+        return _add_sharded_members(shards, organization_id, user_ids)
+    existing = set()
+    for chunk in chunked(user_ids):
+        existing.update(row[0] for row in db.session.query(user_organization.c.user_id).filter(
+            user_organization.c.organization_id == organization_id,
+            user_organization.c.user_id.in_(chunk)
+        ))
+
+    added = [user_id for user_id in user_ids if user_id not in existing]
+    if added:
+        db.session.execute(insert_new(db.engine.dialect.name, user_organization, ['user_id', 'organization_id']), [
+            {'user_id': user_id, 'organization_id': organization_id} for user_id in added
+        ])
+    return added
 
+# Sharded, the memberships are written to the shard right away. A write that
+# clashes with a concurrent add is rolled back whole, so the existing
+# members are looked up again.
+def _add_sharded_members(shards, organization_id, user_ids, attempts=3):
+    for attempt in range(attempts):
+        existing = shards.existing_members(organization_id, user_ids)
+        added = [user_id for user_id in user_ids if user_id not in existing]
+        if not added:
+            return added
+        try:
+            shards.write({shards.shard_of(organization_id): [
+                (user_organization, [{'user_id': user_id, 'organization_id': organization_id} for user_id in added])
+            ]})
+            return added
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
@@ -0,0 +1,105 @@
+#app/pagination.py
+
+import csv
+import io
+from flask import Response, current_app, request, stream_with_context
+from .serializers import dumps
+
+class PaginationError(ValueError):
+    pass
+
+# Read ?limit= and ?after= from the query string
+def parse_page_args():
+    default_limit = current_app.config['PAGE_SIZE']
+    max_limit = current_app.config['MAX_PAGE_SIZE']
+
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit < 1 or limit > max_limit:
+        raise PaginationError('limit must be between 1 and {}'.format(max_limit))
+
+    after = request.args.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            raise PaginationError('after must be a cursor returned by a previous page')
+
+    return limit, after
+
+# Keyset page: WHERE key > after ORDER BY key LIMIT limit + 1
+# The extra row tells us whether there is a next page without a COUNT(*)
+def keyset_page(query, key_column, limit, after=None):
+    if after is not None:
+        query = query.filter(key_column > after)
+    rows = query.order_by(key_column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1][0])
+    return rows, next_cursor
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# ?format=ndjson|csv, or the matching Accept header; None means plain JSON
+def export_format(formats=('ndjson',)):
+    fmt = request.args.get('format')
+    if fmt in formats:
+        return fmt
+    best = request.accept_mimetypes.best
+    for fmt in formats:
+        if best == EXPORT_MIMETYPES[fmt]:
+            return fmt
+    return None
+
+def wants_ndjson():
+    return export_format() == 'ndjson'
+
+# Stream rows from a server-side cursor, yielding one chunk of
+# STREAM_BATCH_SIZE rows at a time so memory and time to first byte stay
+# flat however many rows there are. `query` may also be any iterable that
+# already streams its rows, such as a merge across shards.
+def stream_response(query, to_dict, fmt='ndjson', fieldnames=None, filename=None):
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        buffer = io.StringIO()
+        writer = None
+        if fmt == 'csv':
+            writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+            writer.writeheader()
+        pending = 0
+
+        if hasattr(query, 'yield_per'):
+            rows = query.execution_options(stream_results=True).yield_per(batch_size)
+        else:
+            rows = query
+        for row in rows:
+            if writer is not None:
+                writer.writerow(to_dict(row))
+            else:
+                buffer.write(dumps(to_dict(row)).decode())
+                buffer.write('\n')
+            pending += 1
+            if pending >= batch_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_MIMETYPES[fmt])
+    if filename:
+        response.headers['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+def ndjson_response(query, to_dict):
+    return stream_response(query, to_dict, 'ndjson')
@@ -0,0 +1,115 @@
+#app/password_pool.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError
+from flask import current_app
+from .hashers import get_hasher, hash_password, verify_password, configured_hasher
+from .metrics import registry
+
+class PasswordPoolBusy(Exception):
+    pass
+
+class _PoolState:
+    def __init__(self, kind, workers, max_queue, timeout):
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        # Running plus waiting jobs; anything beyond this is rejected at once
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        # Created lazily so preforked workers do not inherit pool threads
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    executor_class = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+                    self.executor = executor_class(max_workers=self.workers)
+        return self.executor
+
+# Module level so a process pool can pickle it
+def _hash_chunk(name, params, passwords):
+    return [hash_password(name, params, password) for password in passwords]
+
+# Runs password hashing and verification on a bounded worker pool so a burst
+# of logins cannot occupy every request thread
+class PasswordPool:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Fail at startup rather than on the first login if the hasher is misconfigured
+        get_hasher(*configured_hasher(app))
+        app.extensions['password_pool'] = _PoolState(
+            app.config['PASSWORD_POOL_KIND'],
+            app.config['PASSWORD_POOL_WORKERS'],
+            app.config['PASSWORD_POOL_MAX_QUEUE'],
+            app.config['PASSWORD_POOL_TIMEOUT']
+        )
+
+    def hash(self, password):
+        name, params = configured_hasher()
+        return self._timed('hash', hash_password, name, params, password)
+
+    def verify(self, password_hash, password):
+        return self._timed('verify', verify_password, password_hash, password)
+
+    # Hash a batch in chunks of PASSWORD_POOL_BATCH_CHUNK. Each chunk holds a
+    # slot like any login, waiting for one rather than failing, and at most
+    # half the workers run chunks at once, so logins arriving meanwhile still
+    # find a free worker
+    def hash_many(self, passwords):
+        name, params = configured_hasher()
+        state = current_app.extensions['password_pool']
+        if state.workers <= 0:
+            return [hash_password(name, params, password) for password in passwords]
+        size = current_app.config['PASSWORD_POOL_BATCH_CHUNK']
+        in_flight = threading.BoundedSemaphore(max(1, state.workers // 2))
+
+        def release(future):
+            state.slots.release()
+            in_flight.release()
+
+        futures = []
+        for i in range(0, len(passwords), size):
+            in_flight.acquire()
+            state.slots.acquire()
+            try:
+                future = state.get_executor().submit(_hash_chunk, name, params, passwords[i:i + size])
+            except Exception:
+                release(None)
+                raise
+            future.add_done_callback(release)
+            futures.append(future)
+        return [password_hash for future in futures for password_hash in future.result()]
+
+    def _timed(self, operation, fn, *args):
+        start = time.perf_counter()
+        try:
+            return self._run(fn, *args)
+        finally:
+            registry.observe('password_hash_duration_seconds', {'operation': operation}, time.perf_counter() - start)
+
+    def _run(self, fn, *args):
+        state = current_app.extensions['password_pool']
+        if state.workers <= 0:
+            return fn(*args)
+
+        if not state.slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = state.get_executor().submit(fn, *args)
+        except Exception:
+            state.slots.release()
+            raise
+        # The slot is held until the job really finishes, even if we stop waiting
+        future.add_done_callback(lambda f: state.slots.release())
+
+        try:
+            return future.result(timeout=state.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordPoolBusy()
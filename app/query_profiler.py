@@ -0,0 +1,115 @@
+#app/query_profiler.py
+
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Statement text with IN lists collapsed and whitespace normalised, so that
+# the same query with different parameters counts as one shape
+def statement_shape(statement):
+    shape = re.sub(r'\(\s*(?:\?|%s|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|%\(\w+\)s))*\s*\)', '(?)', statement)
+    return ' '.join(shape.split())
+
+# Statements are shaped only when someone asks, keeping record() cheap
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.statements[statement] += 1
+
+    @property
+    def shapes(self):
+        shapes = Counter()
+        for statement, n in self.statements.items():
+            shapes[statement_shape(statement)] += n
+        return shapes
+
+    def suspected_n_plus_one(self, threshold):
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+# Ad-hoc collectors opened by assert_max_queries(), fed from every engine
+_watchers = []
+_watchers_lock = threading.Lock()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_app_context():
+        stats = g.get('query_stats')
+        if stats is not None:
+            stats.record(statement, elapsed)
+    if _watchers:
+        with _watchers_lock:
+            for stats in _watchers:
+                stats.record(statement, elapsed)
+
+_installed = False
+
+# Counts statements and DB time per request and flags repeated statement
+# shapes. In debug mode (or with QUERY_PROFILER_HEADERS) the numbers are
+# returned as X-Query-* response headers.
+class QueryProfiler:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global _installed
+        if not _installed:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _installed = True
+
+        app.before_request(self._start)
+        app.after_request(self._report)
+
+    # Nothing is recorded unless the numbers will be reported
+    def _start(self):
+        if current_app.debug or current_app.config['QUERY_PROFILER_HEADERS']:
+            g.query_stats = QueryStats()
+
+    def _report(self, response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+
+        suspects = stats.suspected_n_plus_one(current_app.config['QUERY_N_PLUS_ONE_THRESHOLD'])
+        response.headers['X-Query-Count'] = str(stats.count)
+        response.headers['X-Query-Time-Ms'] = '{:.2f}'.format(stats.time * 1000)
+        if suspects:
+            response.headers['X-Query-N-Plus-One'] = str(len(suspects))
+            for shape, n in suspects:
+                logger.warning('Suspected N+1: %d x %s', n, shape)
+        return response
+
+# Fail if the block runs more than `limit` statements:
+#     with assert_max_queries(4):
+#         client.post('/auth/register', json=...)
+@contextmanager
+def assert_max_queries(limit):
+    stats = QueryStats()
+    with _watchers_lock:
+        _watchers.append(stats)
+    try:
+        yield stats
+    finally:
+        with _watchers_lock:
+            _watchers.remove(stats)
+    if stats.count > limit:
+        shapes = '\n'.join('  {} x {}'.format(n, shape) for shape, n in stats.shapes.most_common())
+        raise AssertionError('Expected at most {} queries, ran {}:\n{}'.format(limit, stats.count, shapes))
@@ -0,0 +1,185 @@
+#app/rate_limit.py
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request
+from .metrics import registry
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+# Token buckets: each key holds up to `capacity` tokens, refilled at `rate`
+# tokens per second; a request spends one. A store's take() returns
+# (allowed, tokens left).
+
+# Buckets of this process only, for single-process deployments and tests
+class LocalBucketStore:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+# Fixed-size open-addressing table of buckets in a memory-mapped file, shared
+# by every worker process on the host (put it on /dev/shm). Each slot is
+# (key hash, tokens, updated); a key probes PROBE slots from its home slot and
+# when all are taken the least recently used one is recycled, which at worst
+# hands that key a full bucket. Losing the file just refills every bucket.
+class SharedMemoryBucketStore:
+    SLOT = struct.Struct('<Qdd')
+    PROBE = 8
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    # flock() is per open file, so each process (including forked children)
+    # needs its own descriptor
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.slots * self.SLOT.size
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _slot_hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def take(self, key, capacity, rate, now):
+        if self._pid != os.getpid():
+            self._open()
+        h = self._slot_hash(key)
+        home = h % self.slots
+        slot, size = self.SLOT, self.SLOT.size
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                target, tokens, updated = None, capacity, now
+                oldest = None
+                for i in range(self.PROBE):
+                    offset = (home + i) % self.slots * size
+                    slot_hash, slot_tokens, slot_updated = slot.unpack_from(self._map, offset)
+                    if slot_hash == h:
+                        target, tokens, updated = offset, slot_tokens, slot_updated
+                        break
+                    if slot_hash == 0:
+                        target = offset
+                        break
+                    if oldest is None or slot_updated < oldest[1]:
+                        oldest = (offset, slot_updated)
+                if target is None:
+                    target = oldest[0]
+
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                slot.pack_into(self._map, target, h, tokens, now)
+                return allowed, tokens
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(len(self._map))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+class _LimiterState:
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+
+# Token-bucket limits on credential endpoints, so floods are turned away
+# before any password is hashed. Set RATE_LIMIT_FILE to share the buckets
+# between worker processes.
+class RateLimiter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # (capacity, tokens per second) per bucket kind
+        limits = {
+            'ip': (app.config['RATE_LIMIT_IP_BURST'], app.config['RATE_LIMIT_IP_PER_MINUTE'] / 60),
+            'user': (app.config['RATE_LIMIT_USER_BURST'], app.config['RATE_LIMIT_USER_PER_MINUTE'] / 60)
+        }
+        if app.config['RATE_LIMIT_FILE']:
+            store = SharedMemoryBucketStore(app.config['RATE_LIMIT_FILE'], app.config['RATE_LIMIT_SLOTS'])
+        else:
+            store = LocalBucketStore()
+        app.extensions['rate_limit'] = _LimiterState(store, limits)
+
+    # Switch to buckets in the shared file at `path`, e.g. one `flask serve`
+    # made for its workers
+    def share_buckets(self, app, path):
+        app.config['RATE_LIMIT_FILE'] = path
+        app.extensions['rate_limit'].store = SharedMemoryBucketStore(path, app.config['RATE_LIMIT_SLOTS'])
+
+    @property
+    def store(self):
+        return current_app.extensions['rate_limit'].store
+
+    # Spend a token from `key`'s bucket or raise RateLimited
+    def hit(self, scope, key, kind, state=None, now=None):
+        if state is None:
+            state = current_app.extensions['rate_limit']
+        capacity, rate = state.limits[kind]
+        allowed, tokens = state.store.take(scope + ':' + key, capacity, rate, now or time.time())
+        if not allowed:
+            registry.inc('rate_limited_total', {'scope': scope})
+            raise RateLimited(max(1, int((1 - tokens) / rate + 0.999)))
+
+    # Decorator for views taking credentials: limits by client IP (as told by
+    # TRUSTED_PROXIES, see app/__init__.py) before the body is touched, then by the JSON body's userId. Context-local proxies
+    # are resolved once, they are most of the cost at this scale.
+    def limit(self, name):
+        ip_scope, user_scope = name + ':ip', name + ':user'
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                app = current_app._get_current_object()
+                if app.config['RATE_LIMIT_ENABLED']:
+                    state = app.extensions['rate_limit']
+                    req = request._get_current_object()
+                    now = time.time()
+                    self.hit(ip_scope, req.remote_addr or '-', 'ip', state, now)
+                    data = req.get_json(silent=True)
+                    userId = data.get('userId') if isinstance(data, dict) else None
+                    if isinstance(userId, str) and userId:
+                        self.hit(user_scope, userId, 'user', state, now)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
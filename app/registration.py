@@ -0,0 +1,231 @@
+#app/registration.py
+
+import uuid
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from .models import db, User, Organization, OrganizationDirectory, user_organization, chunked
+from .cache import CachedUser
+
+USERID_TAKEN = 'Username already taken. Please choose a different one.'
+EMAIL_TAKEN = 'Email address already registered.'
+
+class RegistrationConflict(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+# The primary's table of organisation names: the directory when
+# organisations are sharded
+def _organizations():
+    from . import shards
+    return OrganizationDirectory if shards.enabled else Organization
+
+# One SELECT answers: is the userId taken, is the email taken, and which
+# organisation (if any) already has this name
+def check_registration(userId, email, organization_name):
+    organizations = _organizations()
+
+    def existing_organization(column):
+        return db.session.query(column)\
+            .filter(organizations.name == organization_name)\
+            .order_by(organizations.id)\
+            .limit(1)\
+            .scalar_subquery()
+
+    userId_taken, email_taken, organization_id, orgId = db.session.query(
+        db.exists().where(User.userId == userId),
+        db.exists().where(User.email == email),
+        existing_organization(organizations.id),
+        existing_organization(organizations.orgId)
+    ).one()
+
+    errors = {}
+    if userId_taken:
+        errors['userId'] = [USERID_TAKEN]
+    if email_taken:
+        errors['email'] = [EMAIL_TAKEN]
+    return errors, organization_id, orgId
+
+def new_org_id():
+    return str(uuid.uuid4())
+
+# Deferred work for a new user, queued in the registration's transaction: a
+# welcome and, if they joined an existing organisation, a notice to its
+# members (see app/tasks.py)
+def _registration_jobs(user_id, userId, orgId, organization_id, joined):
+    payload = {'userId': userId, 'orgId': orgId, 'organization_id': organization_id}
+    registration_jobs = [('welcome', payload, 'welcome:{}'.format(user_id))]
+    if joined:
+        registration_jobs.append(('member_joined', payload, 'member_joined:{}:{}'.format(organization_id, user_id)))
+    return registration_jobs
+
+# Create the organisation (if check_registration found none), the user, the
+# membership and its jobs in a single transaction, returning a user snapshot and the
+# organisation's orgId and internal id.
+# The unique constraints on userId/email settle races between concurrent
+# registrations: the loser gets RegistrationConflict.
+# Sharded, the user and directory entry are flushed on the primary, the
+# organisation and membership written to the shard, then the primary commits.
+def create_registration(userId, email, password_hash, firstName, lastName, phone,
+                        organization_name, organization_description, organization_id=None, orgId=None):
+    from . import shards, jobs
+    organization = None
+    if organization_id is None:
+        orgId = new_org_id()
+        if shards.enabled:
+            organization = OrganizationDirectory(orgId=orgId, name=organization_name, shard=shards.placement(orgId))
+        else:
+            organization = Organization(orgId=orgId, name=organization_name, description=organization_description)
+        db.session.add(organization)
+
+    user = User(userId=userId, email=email, firstName=firstName, lastName=lastName, phone=phone,
+                password_hash=password_hash)
+    db.session.add(user)
+
+    try:
+        db.session.flush()
+        # Snapshot now: reading the instance after commit would reload it
+        snapshot = CachedUser(user.id, userId, firstName, lastName, email, phone, user.version)
+        if organization is not None:
+            organization_id = organization.id
+        membership = {'user_id': user.id, 'organization_id': organization_id}
+        jobs.enqueue_many(_registration_jobs(user.id, userId, orgId, organization_id, organization is None))
+        if shards.enabled:
+            shard = organization.shard if organization is not None else shards.shard_of(organization_id)
+            new_organizations = [] if organization is None else [{
+                'id': organization_id, 'orgId': orgId, 'name': organization_name, 'description': organization_description
+            }]
+            shards.commit({shard: [(Organization.__table__, new_organizations), (user_organization, [membership])]})
+        else:
+            db.session.execute(user_organization.insert().values(**membership))
+            db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        errors = check_registration(userId, email, organization_name)[0]
+        raise RegistrationConflict(errors or {'userId': [USERID_TAKEN]})
+
+    return snapshot, orgId, organization_id
+
+# Bulk registration: rows are already form-validated dicts keyed by their
+# position in the request. Uniqueness is checked with chunked IN queries and
+# organisations, users and memberships are each written with one executemany.
+# Returns {index: orgId} for created rows and {index: errors} for rejected ones.
+# `actor` is recorded in each registration's auth event.
+def register_batch(rows, hash_many, actor=None):
+    errors = {}
+
+    # Duplicates inside the batch itself
+    seen_userIds, seen_emails = {}, {}
+    for index, row in rows.items():
+        if row['userId'] in seen_userIds:
+            errors.setdefault(index, {})['userId'] = ['Duplicate userId in batch.']
+        if row['email'] in seen_emails:
+            errors.setdefault(index, {})['email'] = ['Duplicate email in batch.']
+        seen_userIds.setdefault(row['userId'], index)
+        seen_emails.setdefault(row['email'], index)
+
+    # Duplicates against existing users
+    taken_userIds, taken_emails = set(), set()
+    for chunk in chunked(list(seen_userIds)):
+        taken_userIds.update(row[0] for row in db.session.query(User.userId).filter(User.userId.in_(chunk)))
+    for chunk in chunked(list(seen_emails)):
+        taken_emails.update(row[0] for row in db.session.query(User.email).filter(User.email.in_(chunk)))
+    for index, row in rows.items():
+        if row['userId'] in taken_userIds:
+            errors.setdefault(index, {})['userId'] = [USERID_TAKEN]
+        if row['email'] in taken_emails:
+            errors.setdefault(index, {})['email'] = [EMAIL_TAKEN]
+
+    valid = [(index, row) for index, row in rows.items() if index not in errors]
+    if not valid:
+        return {}, errors
+
+    # Hash before the first write so no write locks are held while the pool works
+    password_hashes = hash_many([row['password'] for _, row in valid])
+
+    try:
+        organizations, memberships = _insert_batch(valid, password_hashes)
+    except IntegrityError:
+        # Lost a race with a concurrent registration; nothing was written
+        db.session.rollback()
+        conflict = {'userId': ['Conflicting registration in progress, please retry.']}
+        return {}, {**errors, **{index: conflict for index, _ in valid}}
+
+    from . import membership_index, event_log
+    membership_index.add(memberships)
+    for (_, row), (_, organization_id) in zip(valid, memberships):
+        event_log.record('register', row['userId'], organization_id, actor=actor)
+
+    created = {index: organizations[row['organization_name']][1] for index, row in valid}
+    return created, errors
+
+def _insert_batch(valid, password_hashes):
+    from . import shards, jobs
+    # Organisations: reuse the oldest one with each name, create the rest
+    names = list(dict.fromkeys(row['organization_name'] for _, row in valid))
+    organizations = _organizations_by_name(names)
+    missing = [name for name in names if name not in organizations]
+    descriptions = {}
+    if missing:
+        for _, row in valid:
+            descriptions.setdefault(row['organization_name'], row.get('organization_description'))
+        new_organizations = [{'orgId': new_org_id(), 'name': name, 'description': descriptions[name]} for name in missing]
+        if shards.enabled:
+            db.session.execute(OrganizationDirectory.__table__.insert(), [
+                {'orgId': row['orgId'], 'name': row['name'], 'shard': shards.placement(row['orgId'])} for row in new_organizations
+            ])
+        else:
+            db.session.execute(Organization.__table__.insert(), new_organizations)
+        organizations.update(_organizations_by_name(missing))
+
+    db.session.execute(User.__table__.insert(), [
+        {
+            'userId': row['userId'],
+            'email': row['email'],
+            'firstName': row['firstName'],
+            'lastName': row['lastName'],
+            'phone': row.get('phone'),
+            'password_hash': password_hash
+        } for (_, row), password_hash in zip(valid, password_hashes)
+    ])
+
+    user_ids = {}
+    for chunk in chunked([row['userId'] for _, row in valid]):
+        user_ids.update(db.session.query(User.userId, User.id).filter(User.userId.in_(chunk)))
+    memberships = [(user_ids[row['userId']], organizations[row['organization_name']][0]) for _, row in valid]
+    jobs.enqueue_many([job for _, row in valid for job in _registration_jobs(
+        user_ids[row['userId']], row['userId'], organizations[row['organization_name']][1],
+        organizations[row['organization_name']][0], row['organization_name'] not in missing)])
+
+    if shards.enabled:
+        # Each shard gets its new organisations and its memberships
+        writes = {}
+        for name in missing:
+            organization_id, orgId, shard = organizations[name]
+            writes.setdefault(shard, ([], []))[0].append(
+                {'id': organization_id, 'orgId': orgId, 'name': name, 'description': descriptions[name]})
+        shard_of = {organization_id: shard for organization_id, _, shard in organizations.values()}
+        for user_id, organization_id in memberships:
+            writes.setdefault(shard_of[organization_id], ([], []))[1].append({'user_id': user_id, 'organization_id': organization_id})
+        shards.commit({shard: [(Organization.__table__, rows), (user_organization, members)]
+                       for shard, (rows, members) in writes.items()})
+    else:
+        db.session.execute(user_organization.insert(), [
+            {'user_id': user_id, 'organization_id': organization_id} for user_id, organization_id in memberships
+        ])
+        db.session.commit()
+    return organizations, memberships
+
+# name -> (organization id, orgId, shard); shard is None unless sharded
+def _organizations_by_name(names):
+    organizations = _organizations()
+    sharded = organizations is OrganizationDirectory
+    columns = [organizations.name, organizations.id, organizations.orgId] + ([organizations.shard] if sharded else [])
+    found = {}
+    for chunk in chunked(names):
+        oldest = db.session.query(func.min(organizations.id))\
+            .filter(organizations.name.in_(chunk))\
+            .group_by(organizations.name)
+        for row in db.session.query(*columns).filter(organizations.id.in_(oldest)):
+            found[row[0]] = (row[1], row[2], row[3] if sharded else None)
+    return found
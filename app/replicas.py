@@ -0,0 +1,221 @@
+#app/replicas.py
+
+import fcntl
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request, _request_ctx_stack
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from werkzeug.utils import import_string
+
+READ_METHODS = ('GET', 'HEAD')
+STICKY_SIZE = 100000
+
+class _ReplicaState:
+    def __init__(self, binds, sticky):
+        self.binds = binds
+        # Bind keys handed out round-robin, one per request
+        self.counter = itertools.count()
+        # userId -> True for callers that wrote in the last REPLICA_STICKY_SECONDS
+        self.sticky = sticky
+
+# Sticky userIds in a memory-mapped file shared by every worker process on
+# the host (put it on /dev/shm), laid out like the rate limiter's
+# SharedMemoryBucketStore: slots of (key hash, expiry time), probed PROBE at a
+# time from the key's home slot. When they are all taken the slot that
+# expires first is recycled, which at worst ends someone's stickiness early.
+class SharedMemoryStickyStore:
+    SLOT = struct.Struct('<Qd')
+    PROBE = 8
+
+    def __init__(self, path, slots, ttl):
+        self.path = path
+        self.slots = slots
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    # flock() is per open file, so each process (including forked children)
+    # needs its own descriptor
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.slots * self.SLOT.size
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _slot_hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    # Offset of key's slot, or of the slot to put it in when `claim`
+    def _find(self, h, claim):
+        slot, size = self.SLOT, self.SLOT.size
+        home = h % self.slots
+        soonest = None
+        for i in range(self.PROBE):
+            offset = (home + i) % self.slots * size
+            slot_hash, expires = slot.unpack_from(self._map, offset)
+            if slot_hash == h:
+                return offset
+            if slot_hash == 0:
+                return offset if claim else None
+            if soonest is None or expires < soonest[1]:
+                soonest = (offset, expires)
+        return soonest[0] if claim else None
+
+    @contextmanager
+    def _locked(self):
+        if self._pid != os.getpid():
+            self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, key):
+        h = self._slot_hash(key)
+        with self._locked():
+            offset = self._find(h, False)
+            if offset is None:
+                return None
+            slot_hash, expires = self.SLOT.unpack_from(self._map, offset)
+        return True if slot_hash == h and expires > time.time() else None
+
+    def set(self, key, value):
+        h = self._slot_hash(key)
+        with self._locked():
+            self.SLOT.pack_into(self._map, self._find(h, True), h, time.time() + self.ttl)
+
+    def delete(self, key):
+        h = self._slot_hash(key)
+        with self._locked():
+            offset = self._find(h, False)
+            # The hash stays, so keys probed past this slot are still found
+            if offset is not None and self.SLOT.unpack_from(self._map, offset)[0] == h:
+                self.SLOT.pack_into(self._map, offset, h, 0)
+
+    def clear(self):
+        with self._locked():
+            self._map[:] = bytes(len(self._map))
+
+# GET and HEAD requests read from one of the REPLICA_DATABASE_URLS, everything
+# else uses the primary. A caller who has just written reads from the primary
+# for REPLICA_STICKY_SECONDS, so they see their own writes despite replica
+# lag. Stickiness is kept in REPLICA_STICKY_BACKEND, a cache backend like
+# USER_CACHE_BACKEND, which is per process; set REPLICA_STICKY_FILE to share
+# it between worker processes (`flask serve` does that itself).
+class ReplicaRouter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        names = []
+        for i, url in enumerate(app.config['REPLICA_DATABASE_URLS']):
+            name = 'replica{}'.format(i)
+            binds[name] = url
+            names.append(name)
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+        if app.config['REPLICA_STICKY_FILE']:
+            sticky = SharedMemoryStickyStore(app.config['REPLICA_STICKY_FILE'], app.config['REPLICA_STICKY_SLOTS'],
+                                             app.config['REPLICA_STICKY_SECONDS'])
+        else:
+            backend_class = app.config['REPLICA_STICKY_BACKEND']
+            if isinstance(backend_class, str):
+                backend_class = import_string(backend_class)
+            sticky = backend_class(STICKY_SIZE, app.config['REPLICA_STICKY_SECONDS'])
+        app.extensions['replicas'] = _ReplicaState(names, sticky)
+
+        # The session picks its bind per request, so each request starts a
+        # new one rather than reusing objects read from the other database
+        from .models import db
+        app.teardown_appcontext(lambda exc: db.session.remove())
+
+    # Send userId's reads to the primary for the next REPLICA_STICKY_SECONDS
+    def stick(self, userId):
+        state = current_app.extensions['replicas']
+        if state.binds and userId is not None:
+            state.sticky.set(userId, True)
+
+    # Keep stickiness in the shared file `path` from now on
+    def share_sticky(self, app, path):
+        app.config['REPLICA_STICKY_FILE'] = path
+        app.extensions['replicas'].sticky = SharedMemoryStickyStore(path, app.config['REPLICA_STICKY_SLOTS'],
+                                                                    app.config['REPLICA_STICKY_SECONDS'])
+
+# Bind key this request reads from, None for the primary
+def read_bind():
+    if not has_request_context() or request.method not in READ_METHODS:
+        return None
+    state = current_app.extensions['replicas']
+    if not state.binds:
+        return None
+    ctx = _request_ctx_stack.top
+    if getattr(ctx, 'primary_reads', 0):
+        return None
+    bind = getattr(ctx, 'replica_bind', False)
+    if bind is not False:
+        return bind
+
+    try:
+        userId = get_jwt_identity()
+    except RuntimeError:
+        # Token not checked yet: decide again once it is
+        return state.binds[next(state.counter) % len(state.binds)]
+    if userId is not None and state.sticky.get(userId):
+        bind = None
+    else:
+        bind = state.binds[next(state.counter) % len(state.binds)]
+    ctx.replica_bind = bind
+    return bind
+
+# Reads in this block go to the primary. Caches shared between requests are
+# filled this way: a row from a lagging replica would otherwise be served to
+# a caller who is sticky to the primary, undoing read-your-writes.
+@contextmanager
+def primary_reads():
+    ctx = _request_ctx_stack.top if has_request_context() else None
+    if ctx is None:
+        yield
+        return
+    ctx.primary_reads = getattr(ctx, 'primary_reads', 0) + 1
+    try:
+        yield
+    finally:
+        ctx.primary_reads -= 1
+
+# Whether this request has read from a replica, so rows it loaded may be
+# behind the primary and must not go into a shared cache
+def used_replica():
+    if not has_request_context():
+        return False
+    return getattr(_request_ctx_stack.top, 'replica_bind', None) not in (None, False)
+
+# Session that sends reads to read_bind(). Flushes and INSERT/UPDATE/DELETE
+# statements always go to the primary.
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and not isinstance(clause, UpdateBase):
+            bind = read_bind()
+            if bind is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
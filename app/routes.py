@@ -1,8 +1,13 @@
 # routes.py
 
-from flask import Flask, Blueprint, current_app, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from .models import User, Organization
+from flask import Flask, Blueprint, current_app
+from flask_jwt_extended import jwt_required
+from .models import Organization
+from .serializers import jsonify, organization_schema, requested_schema, FieldsError
+from .conditional import check_not_modified, make_etag, with_etag
+from . import version_cache, shards
+from .claims import caller_user_id, may_view_organization
+from .replicas import used_replica
 
 main = Blueprint('main', __name__)
 app = Flask(__name__)
@@ -17,19 +22,19 @@ def index():
 @main.route('/api/organisations', methods=['GET'])
 @jwt_required()
 def get_organisations():
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(userId=current_user_id).first()
-    if not user:
+    # The caller's internal id comes from the token, no user lookup needed
+    user_id = caller_user_id()
+    if user_id is None:
         return jsonify({'message': 'User not found'}), 404
 
-    organizations = Organization.query.all()
-    user_organizations = []
-    for org in organizations:
-        user_organizations.append({
-            'orgId': org.orgId,
-            'name': org.name,
-            'description': org.description
-        })
+    try:
+        schema = requested_schema(organization_schema)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+
+    # Only the caller's memberships are read, so cost follows membership count
+    organizations = shards.organizations_of(user_id, schema.columns(Organization))
+    user_organizations = schema.dump_many(organizations)
 
     return jsonify({
         'status': 'success',
@@ -42,21 +47,23 @@ def get_organisations():
 @main.route('/api/organisations/<orgId>', methods=['GET'])
 @jwt_required()
 def get_organization(orgId):
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(userId=current_user_id).first()
-    if not user:
-        return jsonify({'message': 'User not found'}), 404
+    # Membership is checked against the token's claims where possible
+    unchanged = check_not_modified('organization', orgId,
+                                   lambda: shards.find(orgId, Organization.id, Organization.version),
+                                   may_view_organization)
+    if unchanged:
+        return unchanged
 
-    organization = Organization.query.filter_by(orgId=orgId).first()
+    organization = shards.find(orgId, Organization.id, *organization_schema.columns(Organization), Organization.version)
     if not organization:
         return jsonify({'message': 'Organization not found'}), 404
+    if not may_view_organization(organization.id):
+        return jsonify({'message': 'Forbidden'}), 403
+    if not used_replica():
+        version_cache.set('organization', orgId, organization.id, organization.version)
 
-    return jsonify({
+    return with_etag(jsonify({
         'status': 'success',
         'message': 'Organization retrieved successfully',
-        'data': {
-            'orgId': organization.orgId,
-            'name': organization.name,
-            'description': organization.description
-        }
-    }), 200
+        'data': organization_schema.dump(organization)
+    }), make_etag('organization', orgId, organization.version)), 200
@@ -0,0 +1,110 @@
+#app/serializers.py
+
+import json
+from operator import attrgetter
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask < 2.2 has no JSON provider API; jsonify() below covers it
+    DefaultJSONProvider = None
+
+# Field list compiled once into a single attrgetter, so dumping an object is
+# one C-level call plus a zip instead of a hand-written dict per handler.
+# Works on ORM instances, result rows and CachedUser snapshots alike.
+class Schema:
+    def __init__(self, *fields):
+        self.fields = fields
+        self._subsets = {}
+        self._get = attrgetter(*fields)
+        if len(fields) == 1:
+            getter = self._get
+            self._get = lambda obj: (getter(obj),)
+
+    def dump(self, obj):
+        return dict(zip(self.fields, self._get(obj)))
+
+    def dump_many(self, objs):
+        fields, get = self.fields, self._get
+        return [dict(zip(fields, get(obj))) for obj in objs]
+
+    # Columns to select for this schema from a model
+    def columns(self, model):
+        return [getattr(model, field) for field in self.fields]
+
+    # This schema narrowed to `fields` (kept in schema order), built once per
+    # distinct subset
+    def only(self, fields):
+        key = frozenset(fields)
+        subset = self._subsets.get(key)
+        if subset is None:
+            subset = self._subsets[key] = Schema(*[field for field in self.fields if field in key])
+        return subset
+
+class FieldsError(ValueError):
+    pass
+
+# Sparse fieldsets: ?fields=a,b narrows `schema` to those fields, so handlers
+# select and serialise only them. Only the schema's own fields can be named,
+# which keeps columns such as password_hash out of reach.
+def requested_schema(schema):
+    raw = request.args.get('fields')
+    if raw is None:
+        return schema
+    names = [name.strip() for name in raw.split(',') if name.strip()]
+    if not names:
+        raise FieldsError('fields must name at least one field')
+    unknown = [name for name in names if name not in schema.fields]
+    if unknown:
+        raise FieldsError('Unknown fields: {} (allowed: {})'.format(', '.join(unknown), ', '.join(schema.fields)))
+    return schema.only(names)
+
+user_schema = Schema('userId', 'firstName', 'lastName', 'email', 'phone')
+organization_schema = Schema('orgId', 'name', 'description')
+
+def dumps(obj, sort_keys=False):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':')).encode('utf-8')
+
+def loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            if orjson is None or kwargs:
+                return super().dumps(obj, **kwargs)
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS if self.sort_keys else 0).decode()
+
+        def loads(self, s, **kwargs):
+            if orjson is None or kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return current_app.response_class(self.dumps(obj), mimetype=self.mimetype)
+else:
+    FastJSONProvider = None
+
+def init_app(app):
+    if FastJSONProvider is not None:
+        app.json = FastJSONProvider(app)
+
+# Drop-in for flask.jsonify that uses orjson when it is installed
+def jsonify(*args, **kwargs):
+    if FastJSONProvider is not None:
+        return current_app.json.response(*args, **kwargs)
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    obj = args[0] if len(args) == 1 else (list(args) if args else kwargs)
+    return current_app.response_class(dumps(obj, current_app.config['JSON_SORT_KEYS']), mimetype='application/json')
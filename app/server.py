@@ -0,0 +1,389 @@
+#app/server.py
+
+import errno
+import gc
+import logging
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+logger = logging.getLogger(__name__)
+
+# Handed from a master to the master it re-executes as on reload
+LISTEN_FD_ENV = 'USER_AUTH_LISTEN_FD'
+OLD_WORKERS_ENV = 'USER_AUTH_OLD_WORKERS'
+
+# HTTP/1.1 with keep-alive. werkzeug closes every connection because it
+# cannot tell whether the app left part of a body unread; here bodies go
+# through a LimitedStream, so a connection is kept only once its request has
+# been read to the end (chunked bodies still close it). An idle connection
+# holds one of the worker's few threads, so the wait for its next request is
+# cut off after SERVER_KEEPALIVE seconds.
+class _RequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.requests = 0
+        self.body = None
+
+    def make_environ(self):
+        environ = super().make_environ()
+        if not environ.get('wsgi.input_terminated'):
+            self.body = LimitedStream(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+            environ['wsgi.input'] = self.body
+        return environ
+
+    def handle_one_request(self):
+        if self.requests:
+            self.connection.settimeout(self.server.keepalive)
+            try:
+                self.rfile.peek(1)
+            except TimeoutError:
+                self.close_connection = True
+                return
+            self.connection.settimeout(None)
+        self.requests += 1
+        self.body = None
+        super().handle_one_request()
+        if not self._reusable():
+            self.close_connection = True
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection' and value == 'close' and self._reusable():
+            value = 'keep-alive'
+        super().send_header(keyword, value)
+
+    def _reusable(self):
+        return (self.server.keepalive > 0 and not self.server.stopping and not self.close_connection
+                and self.body is not None and self.body.is_exhausted)
+
+# Runs requests on a fixed pool of threads. A worker with no free thread
+# stops accepting, so new connections wait in the shared listen backlog for
+# a worker that has one.
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, app, host, threads, fd, keepalive=0):
+        super().__init__(host, 0, app, handler=_RequestHandler, fd=fd)
+        self.socket.setblocking(False)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+        self.slots = threading.BoundedSemaphore(threads)
+        self.threads = threads
+        self.keepalive = keepalive
+        self.stopping = False
+
+    def get_request(self):
+        # Raising OSError makes serve_forever() skip this round, so a busy
+        # worker still notices shutdown()
+        if not self.slots.acquire(timeout=0.5):
+            raise OSError(errno.EAGAIN, 'no free request thread')
+        try:
+            return super().get_request()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    # Kept-alive connections are closed after their current request
+    def shutdown(self):
+        self.stopping = True
+        super().shutdown()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    # Wait up to `timeout` seconds for in-flight requests to finish
+    def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+        taken = 0
+        while taken < self.threads and self.slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            taken += 1
+        self.executor.shutdown(wait=False)
+        return taken == self.threads
+
+# The primary's engine, then those of any replicas and shards
+def _engines(app):
+    from .models import db
+    binds = app.extensions['replicas'].binds + app.extensions['shards'].binds
+    return [db.engine] + [db.get_engine(bind=bind) for bind in binds]
+
+# State the workers share lives in files named after the master's pid, which
+# a reload keeps, so re-executed masters share them with the workers they
+# take over
+def _shared_path(name):
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'user-auth-{}-{}'.format(name, os.getpid()))
+
+# Workers have to agree on which callers read from the primary after a
+# write. Unless REPLICA_STICKY_FILE names a shared file, the master makes
+# one. Returns the path if it was made here.
+def share_stickiness(app):
+    from . import replicas
+    if not app.extensions['replicas'].binds or app.config['REPLICA_STICKY_FILE']:
+        return None
+    path = _shared_path('sticky')
+    replicas.share_sticky(app, path)
+    return path
+
+# A user written through one worker has to drop out of every worker's user
+# cache. Unless USER_CACHE_INVALIDATION_FILE names a shared file, the master
+# makes one. Returns the path if it was made here.
+def share_user_cache(app):
+    from . import user_cache
+    if app.config['USER_CACHE_INVALIDATION_FILE']:
+        return None
+    path = _shared_path('users')
+    user_cache.share_invalidations(app, path)
+    return path
+
+# Each worker would otherwise keep its own buckets, letting a client through
+# once per worker. Unless RATE_LIMIT_FILE names a shared file, the master
+# makes one. Returns the path if it was made here.
+def share_rate_limits(app):
+    from . import rate_limiter
+    if not app.config['RATE_LIMIT_ENABLED'] or app.config['RATE_LIMIT_FILE']:
+        return None
+    path = _shared_path('limits')
+    rate_limiter.share_buckets(app, path)
+    return path
+
+# Each worker counts its own metrics. Unless METRICS_DIR names a shared
+# directory, the master makes one, so any worker's /metrics can sum them all.
+# Returns the path if it was made here.
+def share_metrics(app):
+    if app.config['METRICS_DIR']:
+        return None
+    path = _shared_path('metrics')
+    os.makedirs(path, exist_ok=True)
+    app.config['METRICS_DIR'] = path
+    return path
+
+# Done once in the master before forking: anything loaded here is shared
+# copy-on-write by every worker. Database connections must not cross the
+# fork, so the engines are disposed afterwards.
+def preload(app):
+    from . import membership_index
+    from .models import db
+    with app.app_context():
+        membership_index.load()
+        db.session.remove()
+        for engine in _engines(app):
+            engine.dispose()
+    # Keep the preloaded objects out of the children's collections, which
+    # would otherwise touch (and so copy) every page they live on
+    gc.freeze()
+
+# Done in each worker before it accepts: open the connections its threads
+# will need, on every database, so the first requests do not pay for
+# connecting
+def warm_up(app, threads):
+    with app.app_context():
+        for engine in _engines(app):
+            n = min(threads, engine.pool.size()) if isinstance(engine.pool, QueuePool) else 1
+            connections = [engine.connect() for _ in range(n)]
+            for connection in connections:
+                connection.execute(text('SELECT 1'))
+                connection.close()
+
+def _worker(app, host, fd, threads, graceful_timeout, keepalive, ready_fd):
+    from .metrics import registry
+    # Counters inherited from the master are not this worker's
+    registry.reset()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    signal.signal(signal.SIGINT, lambda *args: stopping.set())
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    warm_up(app, threads)
+    server = PooledWSGIServer(app, host, threads, fd, keepalive)
+    loop = threading.Thread(target=server.serve_forever, name='accept')
+    loop.start()
+    os.write(ready_fd, b'.')
+    os.close(ready_fd)
+
+    while not stopping.wait(1):
+        pass
+    server.shutdown()
+    loop.join()
+    if not server.drain(graceful_timeout):
+        logger.warning('Worker %d exiting with requests still running', os.getpid())
+    # os._exit skips atexit, so queued auth events are flushed here
+    if not app.extensions['event_log'].close(app.config['EVENT_LOG_CLOSE_TIMEOUT']):
+        logger.warning('Worker %d exiting with auth events unwritten', os.getpid())
+    os._exit(0)
+
+# Master process: owns the listening socket and the workers.
+#   SIGTERM/SIGINT  stop: workers finish in-flight requests, then exit
+#   SIGHUP          reload: re-execute with the same socket, start new
+#                   workers, then stop the old ones once the new are ready
+#   SIGTTIN/SIGTTOU one worker more/fewer
+class Arbiter:
+    def __init__(self, app, host, port, workers, threads, graceful_timeout):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.children = {}
+        self.signals = []
+        # Shared-state files and directories made by this master, removed on stop
+        self.shared_files = []
+
+    def run(self):
+        self.socket = self._listen()
+        old_workers = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+        self.shared_files = [path for path in (share_stickiness(self.app), share_user_cache(self.app),
+                                               share_rate_limits(self.app), share_metrics(self.app)) if path]
+        preload(self.app)
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(sig, lambda sig, frame: self.signals.append(sig))
+
+        self._spawn(self.workers)
+        for pid in old_workers:
+            self._kill(pid, signal.SIGTERM)
+        logger.info('Serving on %s:%d with %d workers x %d threads', self.host, self.socket.getsockname()[1],
+                    self.workers, self.threads)
+
+        while True:
+            while self.signals:
+                sig = self.signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT):
+                    return self.stop()
+                if sig == signal.SIGHUP:
+                    self.reload()
+                elif sig == signal.SIGTTIN:
+                    self.workers += 1
+                elif sig == signal.SIGTTOU and self.workers > 1:
+                    self.workers -= 1
+            self._reap()
+            if len(self.children) < self.workers:
+                self._spawn(self.workers - len(self.children))
+            elif len(self.children) > self.workers:
+                self._kill(next(iter(self.children)), signal.SIGTERM)
+            time.sleep(0.2)
+
+    def _listen(self):
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is not None:
+            return socket.socket(fileno=int(fd))
+        sock = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(1024)
+        return sock
+
+    # Fork n workers and wait until each has warmed up
+    def _spawn(self, n):
+        read_fd, write_fd = os.pipe()
+        for _ in range(n):
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    _worker(self.app, self.host, self.socket.fileno(), self.threads, self.graceful_timeout,
+                            self.app.config['SERVER_KEEPALIVE'], write_fd)
+                finally:
+                    os._exit(1)
+            self.children[pid] = time.monotonic()
+        os.close(write_fd)
+
+        ready, deadline = 0, time.monotonic() + 60
+        while ready < n and time.monotonic() < deadline:
+            if select.select([read_fd], [], [], 1)[0]:
+                chunk = os.read(read_fd, n)
+                if not chunk:
+                    break
+                ready += len(chunk)
+        os.close(read_fd)
+        if ready < n:
+            logger.error('%d of %d workers failed to start', n - ready, n)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.children.pop(pid, None) is not None and status != 0:
+                logger.warning('Worker %d exited with status %d', pid, status)
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            self.children.pop(pid, None)
+
+    def stop(self):
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGKILL)
+        self.socket.close()
+        for path in self.shared_files:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    # Re-execute this command (picking up new code and configuration) with
+    # the listening socket left open, so no connection is refused meanwhile.
+    # The pid does not change, so the current workers stay our children and
+    # the new master stops them once its own workers are ready.
+    def reload(self):
+        self._reap()
+        self.socket.set_inheritable(True)
+        os.environ[LISTEN_FD_ENV] = str(self.socket.fileno())
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in self.children)
+        argv = getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv
+        logger.info('Reloading: %s', ' '.join(argv))
+        os.execv(sys.executable, [sys.executable] + argv[1:])
+
+@click.command('serve')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=5000, show_default=True, type=int)
+@click.option('--workers', type=int, help='Worker processes [default: SERVER_WORKERS]')
+@click.option('--threads', type=int, help='Request threads per worker [default: SERVER_THREADS]')
+@with_appcontext
+def serve_command(host, port, workers, threads):
+    """Serve the app from preforked, pre-warmed worker processes."""
+    app = current_app._get_current_object()
+    config = app.config
+    Arbiter(app, host, port, workers or config['SERVER_WORKERS'], threads or config['SERVER_THREADS'],
+            config['SERVER_GRACEFUL_TIMEOUT']).run()
@@ -0,0 +1,499 @@
+#app/sharding.py
+
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, func, inspect, select
+from sqlalchemy.schema import CreateIndex, CreateTable
+from .cache import LocalBackend
+
+DIRECTORY_SIZE = 100000
+# Organisations per `flask shards rebalance` round (each round waits out
+# SHARD_DIRECTORY_TTL once)
+MOVE_BATCH_SIZE = 1000
+
+class _ShardState:
+    def __init__(self, binds, directory):
+        self.binds = binds
+        # orgId -> (organization id, shard) and organization id -> shard,
+        # read through from organization_directory
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def get_executor(self):
+        # Created lazily, and again in forked workers, which do not inherit
+        # their parent's threads
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.executor = ThreadPoolExecutor(max_workers=4 * len(self.binds), thread_name_prefix='shard')
+                    self.pid = os.getpid()
+        return self.executor
+
+# Rows from several id-ordered streams in one id-ordered stream. An
+# organisation being moved is briefly on two shards; its second copy is dropped.
+def _merged(streams, key):
+    last = object()
+    for row in heapq.merge(*streams, key=key):
+        current = key(row)
+        if current != last:
+            last = current
+            yield row
+
+# Organisations and their memberships partitioned by orgId across
+# SHARD_DATABASE_URLS. Users stay on the primary, and so does
+# organization_directory: each organisation's global id, orgId, name and
+# shard. New organisations go to the shard their orgId hashes to; `flask
+# shards move`/`rebalance` can put them anywhere. Queries about one
+# organisation go to its shard, queries across organisations (a user's
+# organisations, listings, the membership index) run on every shard in
+# parallel and are merged by id.
+#
+# Without SHARD_DATABASE_URLS nothing is sharded and every method here runs
+# its query on the primary's own tables, exactly as before.
+class Shards:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        names = []
+        for i, url in enumerate(app.config['SHARD_DATABASE_URLS']):
+            name = 'shard{}'.format(i)
+            binds[name] = url
+            names.append(name)
+        app.config['SQLALCHEMY_BINDS'] = binds
+        directory = LocalBackend(DIRECTORY_SIZE, app.config['SHARD_DIRECTORY_TTL'])
+        app.extensions['shards'] = _ShardState(names, directory)
+
+    @property
+    def _state(self):
+        return current_app.extensions['shards']
+
+    @property
+    def enabled(self):
+        return bool(self._state.binds)
+
+    @property
+    def count(self):
+        return len(self._state.binds)
+
+    def engine(self, shard):
+        from .models import db
+        return db.get_engine(bind=self._state.binds[shard])
+
+    # Shard a new organisation is created on
+    def placement(self, orgId, count=None):
+        digest = hashlib.blake2b(orgId.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') % (count or self.count)
+
+    # (organization id, shard) of orgId, None if there is no such organisation
+    def locate(self, orgId, fresh=False):
+        directory = self._state.directory
+        location = None if fresh else directory.get(orgId)
+        if location is None:
+            from .models import db, OrganizationDirectory
+            from .replicas import primary_reads
+            with primary_reads():
+                row = db.session.query(OrganizationDirectory.id, OrganizationDirectory.shard).filter_by(orgId=orgId).first()
+            if row is None:
+                return None
+            location = tuple(row)
+            directory.set(orgId, location)
+            directory.set(location[0], location[1])
+        return location
+
+    def shard_of(self, organization_id, fresh=False):
+        directory = self._state.directory
+        shard = None if fresh else directory.get(organization_id)
+        if shard is None:
+            from .models import db, OrganizationDirectory
+            from .replicas import primary_reads
+            with primary_reads():
+                shard = db.session.query(OrganizationDirectory.shard).filter_by(id=organization_id).scalar()
+            if shard is None:
+                return None
+            directory.set(organization_id, shard)
+        return shard
+
+    # fn(connection) on one organisation's shard. A cached location can
+    # predate a move, so an empty answer is retried where the directory
+    # says the organisation is now.
+    def _on_shard(self, organization_id, fn, shard=None):
+        if shard is None:
+            shard = self.shard_of(organization_id)
+            if shard is None:
+                return None
+        with self.engine(shard).connect() as connection:
+            result = fn(connection)
+        if not result:
+            moved = self.shard_of(organization_id, fresh=True)
+            if moved is not None and moved != shard:
+                with self.engine(moved).connect() as connection:
+                    result = fn(connection)
+        return result
+
+    # fn(connection) on every shard at once; results in shard order
+    def fan_out(self, fn):
+        engines = [self.engine(shard) for shard in range(self.count)]
+
+        def run(engine):
+            with engine.connect() as connection:
+                return fn(connection)
+
+        if len(engines) == 1:
+            return [run(engines[0])]
+        return list(self._state.get_executor().map(run, engines))
+
+    # Lazily streamed rows of `query` on one shard
+    def _stream(self, shard, query):
+        engine = self.engine(shard)
+
+        def rows():
+            with engine.connect() as connection:
+                yield from connection.execution_options(stream_results=True).execute(query)
+        return rows()
+
+    # Insert {shard: [(table, rows), ...]}, one transaction per shard. If a
+    # shard fails, what earlier shards committed is deleted before raising.
+    def write(self, writes):
+        done = []
+        try:
+            for shard, inserts in writes.items():
+                with self.engine(shard).begin() as connection:
+                    for table, rows in inserts:
+                        if rows:
+                            connection.execute(table.insert(), rows)
+                done.append(shard)
+        except Exception:
+            self.unwrite({shard: writes[shard] for shard in done})
+            raise
+
+    # Delete rows written by write(), by primary key
+    def unwrite(self, writes):
+        for shard, inserts in writes.items():
+            with self.engine(shard).begin() as connection:
+                for table, rows in reversed(inserts):
+                    if not rows:
+                        continue
+                    key = table.primary_key.columns
+                    connection.execute(table.delete().where(and_(*[column == bindparam('pk_' + column.name) for column in key])),
+                                       [{'pk_' + column.name: row[column.name] for column in key} for row in rows])
+
+    # Commit shard rows that depend on the primary session's pending rows
+    # (new users, directory entries): the shards first, then the primary. If
+    # the primary fails after all, the shard rows are deleted again.
+    def commit(self, writes):
+        from .models import db
+        try:
+            self.write(writes)
+        except Exception:
+            db.session.rollback()
+            raise
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.unwrite(writes)
+            raise
+
+    # Organisation by orgId as a row of `columns`, None if there is none
+    def find(self, orgId, *columns):
+        from .models import db, Organization
+        if not self.enabled:
+            return db.session.query(*columns).filter_by(orgId=orgId).first()
+        location = self.locate(orgId)
+        if location is None:
+            return None
+        query = select(*columns).where(Organization.orgId == orgId)
+        return self._on_shard(location[0], lambda connection: connection.execute(query).first(), location[1])
+
+    # Create an organisation and commit; returns it for dumping
+    def create(self, orgId, name, description):
+        from .models import db, Organization, OrganizationDirectory
+        if not self.enabled:
+            organization = Organization(orgId=orgId, name=name, description=description)
+            db.session.add(organization)
+            db.session.commit()
+            return organization
+
+        entry = OrganizationDirectory(orgId=orgId, name=name, shard=self.placement(orgId))
+        db.session.add(entry)
+        db.session.flush()
+        row = {'id': entry.id, 'orgId': orgId, 'name': name, 'description': description}
+        self.commit({entry.shard: [(Organization.__table__, [row])]})
+        return Organization(**row)
+
+    # One keyset page of the organisations user_id belongs to: (rows of id +
+    # `columns`, next cursor)
+    def organizations_page(self, user_id, columns, limit, after=None):
+        from .models import db, Organization, user_organization
+        from .pagination import keyset_page
+        if not self.enabled:
+            query = db.session.query(Organization.id, *columns)\
+                .join(user_organization, user_organization.c.organization_id == Organization.id)\
+                .filter(user_organization.c.user_id == user_id)
+            return keyset_page(query, Organization.id, limit, after)
+
+        query = select(Organization.id, *columns)\
+            .select_from(Organization.__table__.join(user_organization, user_organization.c.organization_id == Organization.id))\
+            .where(user_organization.c.user_id == user_id)\
+            .order_by(Organization.id).limit(limit + 1)
+        if after is not None:
+            query = query.where(Organization.id > after)
+        pages = self.fan_out(lambda connection: connection.execute(query).all())
+        rows = list(itertools.islice(_merged(pages, itemgetter(0)), limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1][0])
+        return rows, next_cursor
+
+    # Every organisation as rows of id + `columns`, ordered by id, streamed
+    def all_organizations(self, columns):
+        from .models import db, Organization
+        if not self.enabled:
+            return db.session.query(Organization.id, *columns).order_by(Organization.id)
+        query = select(Organization.id, *columns).order_by(Organization.id)
+        return _merged([self._stream(shard, query) for shard in range(self.count)], itemgetter(0))
+
+    # The organisations user_id belongs to, as rows of `columns` ordered by id
+    def organizations_of(self, user_id, columns):
+        from .models import db, Organization, user_organization
+        if not self.enabled:
+            return db.session.query(*columns)\
+                .join(user_organization, user_organization.c.organization_id == Organization.id)\
+                .filter(user_organization.c.user_id == user_id)\
+                .order_by(Organization.id)\
+                .all()
+        query = select(Organization.id, *columns)\
+            .select_from(Organization.__table__.join(user_organization, user_organization.c.organization_id == Organization.id))\
+            .where(user_organization.c.user_id == user_id)\
+            .order_by(Organization.id)
+        return list(_merged(self.fan_out(lambda connection: connection.execute(query).all()), itemgetter(0)))
+
+    # Members of an organisation as rows of User `columns`, ordered by user id.
+    # Sharded, the member ids come from the shard and the users from the
+    # primary, one IN query per chunk.
+    def members(self, organization_id, columns):
+        from .models import db, User, user_organization, chunked
+        if not self.enabled:
+            return db.session.query(*columns)\
+                .join(user_organization, user_organization.c.user_id == User.id)\
+                .filter(user_organization.c.organization_id == organization_id)\
+                .order_by(User.id)
+
+        query = select(user_organization.c.user_id)\
+            .where(user_organization.c.organization_id == organization_id)\
+            .order_by(user_organization.c.user_id)
+        user_ids = self._on_shard(organization_id, lambda connection: connection.scalars(query).all()) or []
+
+        def rows():
+            for chunk in chunked(user_ids):
+                yield from db.session.query(*columns).filter(User.id.in_(chunk)).order_by(User.id)
+        return rows()
+
+    # Sharded counterparts of the membership helpers in models.py,
+    # membership_index.py and claims.py
+
+    def organization_ids_of(self, user_id):
+        from .models import user_organization
+        query = select(user_organization.c.organization_id)\
+            .where(user_organization.c.user_id == user_id)\
+            .order_by(user_organization.c.organization_id)
+        return list(_merged(self.fan_out(lambda connection: connection.scalars(query).all()), lambda value: value))
+
+    def is_member(self, user_id, organization_id):
+        from .models import user_organization
+        query = select(user_organization.c.user_id).where(
+            (user_organization.c.organization_id == organization_id) & (user_organization.c.user_id == user_id))
+        return self._on_shard(organization_id, lambda connection: connection.execute(query).first() is not None) or False
+
+    # Which of user_ids already belong to the organisation
+    def existing_members(self, organization_id, user_ids):
+        from .models import user_organization, chunked
+
+        def find(connection):
+            existing = set()
+            for chunk in chunked(user_ids):
+                existing.update(connection.scalars(select(user_organization.c.user_id).where(
+                    user_organization.c.organization_id == organization_id,
+                    user_organization.c.user_id.in_(chunk))))
+            return existing
+        return self._on_shard(organization_id, find) or set()
+
+    # Every (user_id, organization_id), ordered, streamed from all shards
+    def all_memberships(self):
+        from .models import user_organization
+        query = select(user_organization.c.user_id, user_organization.c.organization_id)\
+            .order_by(user_organization.c.user_id, user_organization.c.organization_id)
+        return _merged([self._stream(shard, query) for shard in range(self.count)], tuple)
+
+    def shared_organizations(self, user_id, other_user_id):
+        from .models import user_organization
+        mine = user_organization.alias()
+        theirs = user_organization.alias()
+        query = select(mine.c.organization_id)\
+            .join(theirs, theirs.c.organization_id == mine.c.organization_id)\
+            .where(mine.c.user_id == user_id, theirs.c.user_id == other_user_id)
+        return [row for rows in self.fan_out(lambda connection: connection.execute(query).all()) for row in rows]
+
+    # Administration
+
+    # Create the organisation tables on every shard. Users are not there, so
+    # the foreign key to user is left out.
+    def create_tables(self):
+        from .models import Organization, user_organization
+        for shard in range(self.count):
+            with self.engine(shard).begin() as connection:
+                for table in (Organization.__table__, user_organization):
+                    if inspect(connection).has_table(table.name):
+                        continue
+                    foreign_keys = [fk for fk in table.foreign_key_constraints if fk.referred_table.name != 'user']
+                    connection.execute(CreateTable(table, include_foreign_key_constraints=foreign_keys))
+                    for index in table.indexes:
+                        connection.execute(CreateIndex(index))
+
+    # Copy organisations that are still only in the primary's tables to the
+    # shards, keeping their ids. The primary's rows are left in place.
+    def import_primary(self):
+        from .models import db, Organization, OrganizationDirectory, user_organization, chunked
+        imported = 0
+        known = db.session.query(OrganizationDirectory.id)
+        pending = [row[0] for row in db.session.query(Organization.id).filter(~Organization.id.in_(known)).order_by(Organization.id)]
+        for chunk in chunked(pending):
+            organizations = db.session.query(Organization.__table__).filter(Organization.id.in_(chunk)).all()
+            memberships = db.session.query(user_organization).filter(user_organization.c.organization_id.in_(chunk)).all()
+            writes, placed = {}, {}
+            for organization in organizations:
+                shard = placed[organization.id] = self.placement(organization.orgId)
+                db.session.add(OrganizationDirectory(id=organization.id, orgId=organization.orgId, name=organization.name,
+                                                     shard=shard))
+                writes.setdefault(shard, ([], []))[0].append(dict(organization._mapping))
+            for membership in memberships:
+                writes[placed[membership.organization_id]][1].append(dict(membership._mapping))
+            db.session.flush()
+            self.commit({shard: [(Organization.__table__, rows), (user_organization, members)]
+                         for shard, (rows, members) in writes.items()})
+            imported += len(organizations)
+        # Explicit ids do not advance a Postgres sequence
+        if imported and db.engine.dialect.name == 'postgresql':
+            db.session.execute(select(func.setval(func.pg_get_serial_sequence('organization_directory', 'id'),
+                                                  func.max(OrganizationDirectory.id))))
+            db.session.commit()
+        return imported
+
+    # Move organisations ({organization id: target shard}): copy each to its
+    # target, point the directory there, wait until every process's cached
+    # location has expired, copy memberships that were added to the old
+    # shard meanwhile, then delete the old copies. Returns how many moved.
+    def move(self, moves, wait=None):
+        from .models import db, Organization, OrganizationDirectory, user_organization
+        organizations = Organization.__table__
+        moving = {}
+        for organization_id, target in moves.items():
+            source = self.shard_of(organization_id, fresh=True)
+            if source is not None and source != target:
+                self._copy(organization_id, source, target, with_organization=True)
+                moving[organization_id] = (source, target)
+        if not moving:
+            return 0
+
+        for organization_id, (_, target) in moving.items():
+            db.session.query(OrganizationDirectory).filter_by(id=organization_id).update({'shard': target})
+        db.session.commit()
+        self._state.directory.clear()
+        time.sleep(self._state.directory.ttl + 1 if wait is None else wait)
+
+        for organization_id, (source, target) in moving.items():
+            self._copy(organization_id, source, target)
+            with self.engine(source).begin() as connection:
+                connection.execute(user_organization.delete().where(user_organization.c.organization_id == organization_id))
+                connection.execute(organizations.delete().where(organizations.c.id == organization_id))
+        return len(moving)
+
+    # Copy memberships the target does not have yet and, on the first pass,
+    # the organisation row itself
+    def _copy(self, organization_id, source, target, with_organization=False):
+        from .models import Organization, user_organization
+        organizations = Organization.__table__
+        members_query = select(user_organization.c.user_id).where(user_organization.c.organization_id == organization_id)
+        with self.engine(source).connect() as connection:
+            organization = connection.execute(select(organizations).where(organizations.c.id == organization_id)).first()
+            members = set(connection.scalars(members_query))
+        with self.engine(target).begin() as connection:
+            if with_organization and organization is not None:
+                # Left over from an interrupted move
+                connection.execute(organizations.delete().where(organizations.c.id == organization_id))
+                connection.execute(organizations.insert(), [dict(organization._mapping)])
+            missing = members - set(connection.scalars(members_query))
+            if missing:
+                connection.execute(user_organization.insert(), [
+                    {'user_id': user_id, 'organization_id': organization_id} for user_id in sorted(missing)
+                ])
+
+shards_cli = AppGroup('shards', help='Organisation shard tools.')
+
+@shards_cli.command('init')
+def init_command():
+    """Create the shard tables and copy organisations still on the primary."""
+    from . import shards
+    if not shards.enabled:
+        raise click.ClickException('SHARD_DATABASE_URLS is not set')
+    shards.create_tables()
+    click.echo('Copied {} organisations to {} shards'.format(shards.import_primary(), shards.count))
+
+@shards_cli.command('status')
+def status_command():
+    """Show how many organisations each shard holds."""
+    from . import shards
+    from .models import db, OrganizationDirectory
+    counts = dict(db.session.query(OrganizationDirectory.shard, func.count()).group_by(OrganizationDirectory.shard))
+    for shard in range(shards.count):
+        click.echo('shard{}: {} organisations'.format(shard, counts.get(shard, 0)))
+
+@shards_cli.command('move')
+@click.argument('orgid')
+@click.argument('shard', type=int)
+def move_command(orgid, shard):
+    """Move one organisation to another shard."""
+    from . import shards
+    if not 0 <= shard < shards.count:
+        raise click.ClickException('shard must be between 0 and {}'.format(shards.count - 1))
+    location = shards.locate(orgid, fresh=True)
+    if location is None:
+        raise click.ClickException('No organisation {}'.format(orgid))
+    moved = shards.move({location[0]: shard})
+    click.echo('Moved {} to shard{}'.format(orgid, shard) if moved else '{} is already on shard{}'.format(orgid, shard))
+
+@shards_cli.command('rebalance')
+@click.option('--dry-run', is_flag=True, help='Only report what would move.')
+def rebalance_command(dry_run):
+    """Move every organisation to the shard its orgId hashes to, e.g. after adding a shard."""
+    from . import shards
+    from .models import db, OrganizationDirectory
+    moves = {}
+    for organization_id, orgId, shard in db.session.query(OrganizationDirectory.id, OrganizationDirectory.orgId,
+                                                          OrganizationDirectory.shard):
+        target = shards.placement(orgId)
+        if target != shard:
+            moves[organization_id] = target
+    if dry_run:
+        click.echo('{} organisations would move'.format(len(moves)))
+        return
+    moved = 0
+    batch = list(moves.items())
+    for i in range(0, len(batch), MOVE_BATCH_SIZE):
+        moved += shards.move(dict(batch[i:i + MOVE_BATCH_SIZE]))
+    click.echo('Moved {} organisations'.format(moved))
@@ -0,0 +1,34 @@
+#app/tasks.py
+
+import logging
+from flask import current_app
+from werkzeug.utils import import_string
+from . import jobs
+
+logger = logging.getLogger(__name__)
+
+# Default NOTIFIER: nothing is delivered, only logged
+def log_notifier(userId, kind, data, key):
+    logger.info('Notification for %s: %s %s (%s)', userId, kind, data, key)
+
+def notify(userId, kind, data, key):
+    notifier = current_app.config['NOTIFIER']
+    if isinstance(notifier, str):
+        notifier = import_string(notifier)
+    notifier(userId, kind, data, key)
+
+# Queued by registration (see app/registration.py)
+@jobs.task('welcome')
+def welcome(payload, key):
+    notify(payload['userId'], 'welcome', {'orgId': payload['orgId']}, key)
+
+# A new user joined an existing organisation: tell its other members. A
+# retry notifies all of them again, so each gets its own key to deduplicate on.
+@jobs.task('member_joined')
+def member_joined(payload, key):
+    from . import shards
+    from .models import User
+    for (userId,) in shards.members(payload['organization_id'], [User.userId]):
+        if userId != payload['userId']:
+            notify(userId, 'member_joined', {'userId': payload['userId'], 'orgId': payload['orgId']},
+                   '{}:{}'.format(key, userId))
@@ -0,0 +1,150 @@
+#app/validation.py
+
+import re
+from flask import current_app
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
+
+try:
+    import email_validator
+except ImportError:
+    email_validator = None
+
+# Plain-function validation for the JSON API. Each field's rules are turned
+# into a tuple of checks once, at import, so validating a request is a loop
+# over small functions instead of building a FlaskForm and its fields.
+# Messages and the {field: [messages]} errors shape match WTForms, so
+# responses are the same as with app/forms.py.
+
+REQUIRED = 'This field is required.'
+NOT_A_STRING = 'Not a valid string.'
+INVALID_EMAIL = 'Invalid email address.'
+
+# Addresses this matches are always accepted by email_validator (plain ASCII
+# dot-atoms, no '--' in the domain, which IDNA treats specially). Anything
+# else goes through email_validator itself, like wtforms' Email() does.
+_SIMPLE_EMAIL = re.compile(
+    r'(?=.{1,254}\Z)'
+    r'(?=[^@]{1,64}@)'
+    r'[A-Za-z0-9_+-]+(?:\.[A-Za-z0-9_+-]+)*'
+    r'@(?!.*--)'
+    r'(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+'
+    r'[A-Za-z](?:[A-Za-z0-9-]{0,61}[A-Za-z])?\Z'
+)
+
+def length(min=-1, max=-1):
+    if max == -1:
+        message = 'Field must be at least {} character{} long.'.format(min, '' if min == 1 else 's')
+    elif min == -1:
+        message = 'Field cannot be longer than {} character{}.'.format(max, '' if max == 1 else 's')
+    elif min == max:
+        message = 'Field must be exactly {} character{} long.'.format(max, '' if max == 1 else 's')
+    else:
+        message = 'Field must be between {} and {} characters long.'.format(min, max)
+
+    def check(value, data):
+        n = len(value) if value else 0
+        if n < min or (max != -1 and n > max):
+            return message
+    return check
+
+def email(value, data):
+    if value and _SIMPLE_EMAIL.match(value):
+        return None
+    if email_validator is None:
+        raise RuntimeError('Email validation needs the email_validator package')
+    try:
+        if value is None:
+            raise email_validator.EmailNotValidError()
+        email_validator.validate_email(value, check_deliverability=False)
+    except email_validator.EmailNotValidError:
+        return INVALID_EMAIL
+
+def equal_to(other):
+    message = 'Field must be equal to {}.'.format(other)
+
+    def check(value, data):
+        if value != data.get(other):
+            return message
+    return check
+
+class Field:
+    def __init__(self, *checks, required=False):
+        self.checks = checks
+        self.required = required
+
+class Validator:
+    def __init__(self, **fields):
+        self.fields = tuple((name, field.required, field.checks) for name, field in fields.items())
+
+    # Returns (values, errors); values has every field, None when absent
+    def validate(self, data):
+        if not isinstance(data, dict):
+            data = {}
+        values, errors = {}, {}
+        for name, required, checks in self.fields:
+            value = data.get(name)
+            if value is not None and not isinstance(value, str):
+                errors[name] = [NOT_A_STRING]
+                continue
+            values[name] = value
+            # Like DataRequired, a missing value stops the field's other checks
+            if required and not (value and value.strip()):
+                errors[name] = [REQUIRED]
+                continue
+            field_errors = [message for message in (check(value, data) for check in checks) if message]
+            if field_errors:
+                errors[name] = field_errors
+        return values, errors
+
+    # validate() plus the CSRF token check FlaskForm does when
+    # WTF_CSRF_ENABLED is on; for single requests, not batch rows
+    def validate_request(self, data):
+        values, errors = self.validate(data)
+        if current_app.config.get('WTF_CSRF_ENABLED', True):
+            try:
+                validate_csrf(data.get('csrf_token') if isinstance(data, dict) else None)
+            except ValidationError as e:
+                errors['csrf_token'] = [str(e)]
+        return values, errors
+
+registration_validator = Validator(
+    userId=Field(length(min=4, max=20), required=True),
+    email=Field(email, required=True),
+    password=Field(length(min=6), required=True),
+    confirm_password=Field(equal_to('password'), required=True),
+    firstName=Field(required=True),
+    lastName=Field(required=True),
+    phone=Field(),
+    organization_name=Field(required=True),
+    organization_description=Field()
+)
+
+login_validator = Validator(
+    userId=Field(required=True),
+    password=Field(required=True)
+)
+
+# Rows of `flask bulk import` (see app/bulk.py), limited by the column sizes
+# rather than the registration form: migrated ids need not follow its rules.
+# Users need a password or an already computed password_hash.
+user_import_validator = Validator(
+    userId=Field(length(max=100), required=True),
+    email=Field(email, length(max=120), required=True),
+    firstName=Field(length(max=100), required=True),
+    lastName=Field(length(max=100), required=True),
+    phone=Field(length(max=20)),
+    password=Field(),
+    password_hash=Field(length(max=255))
+)
+
+organization_import_validator = Validator(
+    orgId=Field(length(max=100), required=True),
+    name=Field(length(max=100), required=True),
+    description=Field()
+)
+
+membership_import_validator = Validator(
+    userId=Field(required=True),
+    orgId=Field(required=True)
+)
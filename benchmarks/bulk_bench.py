@@ -0,0 +1,86 @@
+# benchmarks/bulk_bench.py
+#
+# Rows per second and peak memory of `flask bulk import` and `export` for
+# users, organisations and memberships. Generates the files in a temporary
+# directory (users carry ready-made password hashes, as in a migration) and
+# imports them into a throwaway SQLite database, once per --rows size. Peak
+# RSS growing with the row count would mean the import is not streaming.
+#
+#   python benchmarks/bulk_bench.py
+#   python benchmarks/bulk_bench.py --rows 10000,100000 --format jsonl
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from app.hashers import hash_password
+from app.models import db
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+def write_files(directory, rows, fmt):
+    password_hash = hash_password('pbkdf2', {'iterations': 1000}, 'password')
+    orgs = max(1, rows // 100)
+    data = {
+        'users': (['userId', 'email', 'firstName', 'lastName', 'password_hash'],
+                  (['user{}'.format(i), 'user{}@example.com'.format(i), 'Bulk', 'User', password_hash] for i in range(rows))),
+        'organizations': (['orgId', 'name', 'description'],
+                          (['org{}'.format(i), 'Org {}'.format(i), 'Imported'] for i in range(orgs))),
+        'memberships': (['userId', 'orgId'], (['user{}'.format(i), 'org{}'.format(i % orgs)] for i in range(rows)))
+    }
+    paths = {}
+    for kind, (header, values) in data.items():
+        path = paths[kind] = os.path.join(directory, '{}.{}'.format(kind, fmt))
+        with open(path, 'w', newline='') as f:
+            if fmt == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(values)
+            else:
+                for row in values:
+                    f.write(json.dumps(dict(zip(header, row))) + '\n')
+    return paths
+
+# Each command in its own process, so its peak RSS is its own
+def flask(database_url, *args):
+    env = dict(os.environ, FLASK_APP='run.py', DATABASE_URL=database_url)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'flask'] + list(args), cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError('flask {} failed'.format(' '.join(args)))
+    return elapsed, usage.ru_maxrss
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput and peak memory of flask bulk import/export.')
+    parser.add_argument('--rows', default='10000,100000', help='comma-separated user counts')
+    parser.add_argument('--format', default='csv', choices=('csv', 'jsonl'))
+    args = parser.parse_args(argv)
+
+    print('{:>8} {:<14} {:<7} {:>10} {:>14}'.format('rows', 'kind', 'op', 'rows/s', 'peak RSS (MB)'))
+    for rows in map(int, args.rows.split(',')):
+        directory = tempfile.mkdtemp()
+        database_url = 'sqlite:///' + os.path.join(directory, 'bulk.db')
+        app = create_app()
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+        with app.app_context():
+            db.create_all()
+        paths = write_files(directory, rows, args.format)
+        for kind in ('users', 'organizations', 'memberships'):
+            count = rows if kind != 'organizations' else max(1, rows // 100)
+            for op, target in (('import', paths[kind]), ('export', os.path.join(directory, 'out-' + kind + '.' + args.format))):
+                elapsed, peak = flask(database_url, 'bulk', op, kind, target)
+                print('{:>8} {:<14} {:<7} {:>10.0f} {:>14.1f}'.format(rows, kind, op, count / elapsed, peak / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# benchmarks/get_organisations_bench.py
+#
+# Shows that GET /api/api/organisations scales with the caller's membership
+# count, not with the total number of organisations.
+#
+#   python benchmarks/get_organisations_bench.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.models import db, User, Organization, user_organization
+
+TOTALS = [1000, 10000, 100000]
+MEMBERSHIPS = [1, 10, 100]
+REPEAT = 200
+
+def seed(total):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Organization.__table__.insert(), [
+        {'orgId': 'org{}'.format(i), 'name': 'Org {}'.format(i)} for i in range(total)
+    ])
+    db.session.execute(User.__table__.insert(), [
+        {'userId': 'member{}'.format(k), 'firstName': 'M', 'lastName': str(k),
+         'email': 'member{}@example.com'.format(k), 'password_hash': '-'} for k in MEMBERSHIPS
+    ])
+    users = dict(db.session.query(User.userId, User.id).all())
+    # Spread each member's organisations across the whole table
+    db.session.execute(user_organization.insert(), [
+        {'user_id': users['member{}'.format(k)], 'organization_id': 1 + j * (total // k)}
+        for k in MEMBERSHIPS for j in range(k)
+    ])
+    db.session.commit()
+
+def main():
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    client = app.test_client()
+
+    print('{:>10} {:>12} {:>12}'.format('total orgs', 'memberships', 'mean (ms)'))
+    with app.app_context():
+        for total in TOTALS:
+            seed(total)
+            for k in MEMBERSHIPS:
+                headers = {'Authorization': 'Bearer ' + create_access_token(identity='member{}'.format(k))}
+                client.get('/api/api/organisations', headers=headers)
+                start = time.perf_counter()
+                for _ in range(REPEAT):
+                    response = client.get('/api/api/organisations', headers=headers)
+                elapsed = (time.perf_counter() - start) / REPEAT
+                assert len(response.get_json()['data']['organisations']) == k
+                print('{:>10} {:>12} {:>12.3f}'.format(total, k, elapsed * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# benchmarks/load_test.py
+#
+# In-process load test: seeds USERS users and ORGS organisations, then drives
+# create_app() through the Flask test client and reports throughput and
+# p50/p95/p99 latency for register, login, organisation listing, member
+# listing and member add. Results are written as JSON and, given a baseline,
+# compared against it; the exit status is 1 if any scenario regressed.
+#
+#   python benchmarks/load_test.py
+#   python benchmarks/load_test.py --output results.json --baseline benchmarks/baseline.json
+#   python benchmarks/load_test.py --update-baseline
+#
+# --database-url may point at a local Postgres instead of the default
+# throwaway SQLite file; its tables are dropped and recreated.
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from app.claims import issue_tokens
+from app.hashers import hash_password
+from app.models import db, User, Organization, user_organization, chunked
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SCENARIOS = ['register', 'login', 'org_listing', 'member_listing', 'member_add']
+PASSWORD = 'loadtestpassword'
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def seed(users, orgs, hasher_params):
+    db.drop_all()
+    db.create_all()
+    password_hash = hash_password('pbkdf2', hasher_params, PASSWORD)
+    db.session.execute(Organization.__table__.insert(), [
+        {'orgId': 'org{}'.format(i), 'name': 'Org {}'.format(i)} for i in range(orgs)
+    ])
+    db.session.execute(User.__table__.insert(), [
+        {'userId': 'user{}'.format(i), 'firstName': 'Load', 'lastName': str(i),
+         'email': 'user{}@example.com'.format(i), 'password_hash': password_hash} for i in range(users)
+    ])
+    user_ids = dict(db.session.query(User.userId, User.id))
+    org_ids = dict(db.session.query(Organization.orgId, Organization.id))
+    # Every user belongs to two neighbouring organisations
+    memberships = [{'user_id': user_ids['user{}'.format(i)], 'organization_id': org_ids['org{}'.format((i + k) % orgs)]}
+                   for i in range(users) for k in range(2)]
+    for chunk in chunked(memberships):
+        db.session.execute(user_organization.insert(), chunk)
+    db.session.commit()
+    return user_ids
+
+# One request factory per scenario: request(i) -> (method, url, json, headers).
+# Every request is distinct where the endpoint writes, so runs never collide.
+def build_scenarios(args, user_ids):
+    rng = random.Random(args.seed)
+    tokens = {}
+
+    def auth(userId):
+        if userId not in tokens:
+            tokens[userId] = 'Bearer ' + issue_tokens(userId, user_ids[userId])[0]
+        return {'Authorization': tokens[userId]}
+
+    def any_user():
+        return 'user{}'.format(rng.randrange(args.users))
+
+    def register(i):
+        return 'post', '/auth/register', {
+            'userId': 'new{}'.format(i), 'email': 'new{}@example.com'.format(i), 'password': PASSWORD,
+            'confirm_password': PASSWORD, 'firstName': 'New', 'lastName': str(i),
+            'organization_name': 'Org {}'.format(rng.randrange(args.orgs))
+        }, {}
+
+    def login(i):
+        return 'post', '/auth/login', {'userId': any_user(), 'password': PASSWORD}, {}
+
+    def org_listing(i):
+        return 'get', '/api/api/organisations', None, auth(any_user())
+
+    def member_listing(i):
+        return 'get', '/auth/api/organisations/org{}/users'.format(rng.randrange(args.orgs)), None, auth(any_user())
+
+    def member_add(i):
+        # user i is in org i and org i+1; org i+orgs/2 is neither
+        user = i % args.users
+        org = (user + args.orgs // 2) % args.orgs
+        return 'post', '/auth/api/organisations/org{}/users'.format(org), {'userId': 'user{}'.format(user)}, auth('user0')
+
+    # Tokens are minted up front so signing is not timed
+    scenarios = {}
+    for name, factory in [('register', register), ('login', login), ('org_listing', org_listing),
+                          ('member_listing', member_listing), ('member_add', member_add)]:
+        scenarios[name] = [factory(i) for i in range(args.requests)]
+    return scenarios
+
+def run_scenario(app, requests, concurrency):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(part):
+        client = app.test_client()
+        mine, failed = [], 0
+        for method, url, body, headers in part:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, json=body, headers=headers)
+            mine.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(requests[i::concurrency],)) for i in range(concurrency)]
+    # Collection pauses land on whichever request triggers them; keep them
+    # out of the timed window
+    gc.collect()
+    gc.disable()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    gc.enable()
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3)
+    }
+
+# Each round measures a separate slice of the requests; the reported figure
+# is the median across rounds, so one noisy stretch does not move it
+def run_rounds(app, requests, concurrency, rounds):
+    per_round = [run_scenario(app, requests[i::rounds], concurrency) for i in range(rounds)]
+    stats = {}
+    for metric in per_round[0]:
+        values = sorted(r[metric] for r in per_round)
+        stats[metric] = sum(values) if metric in ('requests', 'errors') else values[len(values) // 2]
+    return stats
+
+# Regressions: p50/p95 above baseline * (1 + threshold), throughput below
+# baseline * (1 - threshold), or new errors. p99 is reported but not gated,
+# a few hundred samples make it too noisy.
+def compare(results, baseline, threshold):
+    regressions = []
+    print('\n{:<16} {:>12} {:>12} {:>9}'.format('scenario', 'p95 (ms)', 'baseline', 'change'))
+    for name, current in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        change = current['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0
+        print('{:<16} {:>12.3f} {:>12.3f} {:>+8.1f}%'.format(name, current['p95_ms'], base['p95_ms'], change * 100))
+        if current['errors'] > base['errors']:
+            regressions.append('{} errors: {} > {}'.format(name, current['errors'], base['errors']))
+        for metric in ('p50_ms', 'p95_ms'):
+            if current[metric] > base[metric] * (1 + threshold):
+                regressions.append('{} {}: {} > {}'.format(name, metric, current[metric], base[metric]))
+        if current['throughput_rps'] < base['throughput_rps'] * (1 - threshold):
+            regressions.append('{} throughput_rps: {} < {}'.format(name, current['throughput_rps'], base['throughput_rps']))
+    if results['config'] != baseline.get('config'):
+        print('note: baseline was recorded with a different configuration: {}'.format(baseline.get('config')))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='In-process load test with baseline comparison.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orgs', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=300, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--hash-iterations', type=int, default=1000,
+                        help='PBKDF2 iterations; low so database work is what gets measured')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--rounds', type=int, default=3, help='report the median of this many rounds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='compare against this results JSON')
+    parser.add_argument('--threshold', type=float, default=0.5, help='allowed relative regression')
+    parser.add_argument('--update-baseline', action='store_true', help='write results to ' + BASELINE)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name for name in args.scenarios.split(',') if name]
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db')
+
+    app = create_app()
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_url,
+        WTF_CSRF_ENABLED=False,
+        RATE_LIMIT_ENABLED=False,
+        PASSWORD_HASHER='pbkdf2',
+        PASSWORD_HASHER_PARAMS={'iterations': args.hash_iterations}
+    )
+    config = {key: getattr(args, key) for key in ('users', 'orgs', 'requests', 'concurrency', 'rounds', 'hash_iterations', 'seed')}
+    config['database'] = database_url.split(':', 1)[0]
+
+    with app.app_context():
+        user_ids = seed(args.users, args.orgs, {'iterations': args.hash_iterations})
+        scenarios = build_scenarios(args, user_ids)
+
+    results = {
+        'config': config,
+        'python': platform.python_version(),
+        'machine': '{} ({} CPUs)'.format(platform.machine(), os.cpu_count()),
+        'scenarios': {}
+    }
+    print('{:<16} {:>9} {:>7} {:>10} {:>10} {:>10}'.format('scenario', 'req/s', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'))
+    for name in names:
+        # Warm caches and connections outside the timed run
+        run_scenario(app, scenarios[name][:1], 1)
+        stats = results['scenarios'][name] = run_rounds(app, scenarios[name][1:], args.concurrency, args.rounds)
+        print('{:<16} {:>9.1f} {:>7} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            name, stats['throughput_rps'], stats['errors'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nRegressions beyond {:.0%}:'.format(args.threshold))
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# benchmarks/login_flood_bench.py
+#
+# p99 latency of GET /api/api/organisations/<orgId> while logins flood the
+# server, with password hashing inline versus on the bounded pool.
+#
+#   python benchmarks/login_flood_bench.py
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import json
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.models import db, User, Organization
+
+FLOOD_THREADS = 16
+PROBES = 50
+
+def post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def run(workers, db_path):
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    # The flood comes from one address and one userId; this measures hashing
+    app.config['RATE_LIMIT_ENABLED'] = False
+    app.extensions['password_pool'].workers = workers
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(userId='flooduser', email='flood@example.com', firstName='Flood', lastName='User',
+                    password_hash=generate_password_hash('floodpassword'))
+        user.organizations.append(Organization(orgId='org1', name='Org 1'))
+        db.session.add(user)
+        db.session.commit()
+        token = create_access_token(identity='flooduser')
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    base = 'http://127.0.0.1:{}'.format(server.server_port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stop = threading.Event()
+    statuses = {}
+
+    def flood():
+        while not stop.is_set():
+            status = post_json(base + '/auth/login', {'userId': 'flooduser', 'password': 'floodpassword'})
+            statuses[status] = statuses.get(status, 0) + 1
+
+    flooders = [threading.Thread(target=flood) for _ in range(FLOOD_THREADS)]
+    for t in flooders:
+        t.start()
+    time.sleep(1)
+
+    samples = []
+    probe = urllib.request.Request(base + '/api/api/organisations/org1', headers={'Authorization': 'Bearer ' + token})
+    for _ in range(PROBES):
+        start = time.perf_counter()
+        with urllib.request.urlopen(probe) as response:
+            response.read()
+        samples.append(time.perf_counter() - start)
+
+    stop.set()
+    for t in flooders:
+        t.join()
+    server.shutdown()
+
+    print('{:>8} {:>10.2f} {:>10.2f}   logins {}'.format(
+        workers or 'inline', percentile(samples, 50) * 1000, percentile(samples, 99) * 1000, statuses))
+
+def main():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    print('{:>8} {:>10} {:>10}'.format('workers', 'p50 (ms)', 'p99 (ms)'))
+    run(0, db_path)
+    run(max(1, (os.cpu_count() or 2) // 2), db_path)
+
+if __name__ == '__main__':
+    main()
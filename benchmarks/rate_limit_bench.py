@@ -0,0 +1,69 @@
+# benchmarks/rate_limit_bench.py
+#
+# Added cost per login/register request of the rate limiter (IP bucket plus
+# userId bucket), with process-local buckets, with the shared memory-mapped
+# table, and with several processes hitting the shared table at once. The
+# budget is 50us per request.
+#
+#   python benchmarks/rate_limit_bench.py
+
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, rate_limiter
+
+REQUESTS = 20000
+USERS = 1000
+PROCESSES = 4
+
+def view():
+    return 'ok'
+
+def per_request_us(app, n=REQUESTS):
+    limited = rate_limiter.limit('bench')(view)
+    # Enough capacity that nothing is rejected: only the bookkeeping is timed
+    app.extensions['rate_limit'].limits = {'ip': (10 ** 9, 10 ** 6), 'user': (10 ** 9, 10 ** 6)}
+    contexts = [app.test_request_context('/auth/login', method='POST', json={'userId': 'user{}'.format(i % USERS)},
+                                         environ_base={'REMOTE_ADDR': '10.0.{}.{}'.format(i % 250, i % 7)})
+                for i in range(n)]
+
+    def timed(fn):
+        elapsed = 0
+        for ctx in contexts:
+            with ctx:
+                # Body parsing is not part of the limiter's cost
+                ctx.request.get_json(silent=True)
+                start = time.perf_counter()
+                fn()
+                elapsed += time.perf_counter() - start
+        return elapsed / n * 1e6
+
+    return timed(limited) - timed(view)
+
+def make_app(path=None):
+    app = create_app()
+    app.config['RATE_LIMIT_FILE'] = path
+    rate_limiter.init_app(app)
+    return app
+
+def worker(path):
+    return per_request_us(make_app(path), REQUESTS // PROCESSES)
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'limits')
+    print('{:<28} {:>10}'.format('store', 'us/request'))
+    print('{:<28} {:>10.1f}'.format('local', per_request_us(make_app())))
+    print('{:<28} {:>10.1f}'.format('shared, 1 process', per_request_us(make_app(path))))
+    with Pool(PROCESSES) as pool:
+        results = pool.map(worker, [path] * PROCESSES)
+    print('{:<28} {:>10.1f}'.format('shared, {} processes'.format(PROCESSES), sum(results) / len(results)))
+    if (os.cpu_count() or 1) < PROCESSES:
+        print('(only {} CPUs: the multi-process figure includes time spent descheduled)'.format(os.cpu_count()))
+
+if __name__ == '__main__':
+    main()
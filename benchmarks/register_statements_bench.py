@@ -0,0 +1,60 @@
+# benchmarks/register_statements_bench.py
+#
+# Counts SQL statements (round trips) and time per POST /auth/register.
+#
+#   python benchmarks/register_statements_bench.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event
+from app import create_app
+from app.models import db
+
+REGISTRATIONS = 200
+
+def main():
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    # Keep hashing cheap so the numbers reflect database work
+    app.config['PASSWORD_HASHER_PARAMS'] = {'iterations': 1000}
+    # Every registration comes from one client address
+    app.config['RATE_LIMIT_ENABLED'] = False
+    client = app.test_client()
+
+    statements = []
+    with app.app_context():
+        db.create_all()
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    counts = []
+    start = time.perf_counter()
+    for i in range(REGISTRATIONS):
+        del statements[:]
+        response = client.post('/auth/register', json={
+            'userId': 'user{:05d}'.format(i),
+            'email': 'user{}@example.com'.format(i),
+            'password': 'password',
+            'confirm_password': 'password',
+            'firstName': 'Bench',
+            'lastName': 'User',
+            # Every other registration joins an existing organisation
+            'organization_name': 'Org {}'.format(i // 2),
+        })
+        assert response.status_code == 201, response.get_json()
+        counts.append(len(statements))
+    elapsed = time.perf_counter() - start
+
+    print('registrations:           {}'.format(REGISTRATIONS))
+    print('statements/registration: min {} max {} mean {:.2f}'.format(min(counts), max(counts), sum(counts) / len(counts)))
+    print('mean latency (ms):       {:.3f}'.format(elapsed / REGISTRATIONS * 1000))
+    print('statements of the last registration:')
+    for statement in statements:
+        print('  ' + ' '.join(statement.split())[:100])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# benchmarks/serialize_bench.py
+#
+# Serialises 100k organisation rows: hand-built dicts + stdlib json versus
+# the precompiled schema + app.serializers.dumps (orjson when installed).
+#
+#   python benchmarks/serialize_bench.py
+
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.serializers import organization_schema, dumps, orjson
+
+ROWS = 100000
+REPEAT = 5
+
+Row = namedtuple('Row', ['orgId', 'name', 'description'])
+
+def hand_built(rows):
+    return json.dumps({'organisations': [{
+        'orgId': org.orgId,
+        'name': org.name,
+        'description': org.description
+    } for org in rows]}, sort_keys=True).encode()
+
+def stdlib_schema(rows):
+    return json.dumps({'organisations': organization_schema.dump_many(rows)}).encode()
+
+def schema(rows):
+    return dumps({'organisations': organization_schema.dump_many(rows)})
+
+def best_of(fn, rows):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    rows = [Row('org{}'.format(i), 'Organisation {}'.format(i), 'Description of organisation {}'.format(i) * 3)
+            for i in range(ROWS)]
+    assert json.loads(hand_built(rows)) == json.loads(schema(rows))
+
+    print('{} rows, best of {}; JSON backend: {}'.format(ROWS, REPEAT, 'orjson' if orjson else 'stdlib json'))
+    baseline = None
+    for name, fn in [('hand-built dicts + json', hand_built), ('schema + json', stdlib_schema), ('schema + serializers.dumps', schema)]:
+        elapsed = best_of(fn, rows)
+        baseline = baseline or elapsed
+        print('{:<28} {:>8.1f} ms  {:>5.2f}x'.format(name, elapsed * 1000, baseline / elapsed))
+
+if __name__ == '__main__':
+    main()
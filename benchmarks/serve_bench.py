@@ -0,0 +1,119 @@
+# benchmarks/serve_bench.py
+#
+# Throughput of `flask serve` over real HTTP for several workers x threads
+# layouts. Seeds a throwaway SQLite database like load_test.py, starts the
+# server for each layout and drives the same requests at it from
+# --concurrency client threads.
+#
+#   python benchmarks/serve_bench.py
+#   python benchmarks/serve_bench.py --layouts 1x1,2x4,4x8 --scenarios login,org_listing
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from load_test import seed, build_scenarios, percentile
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+PORT = 5099
+
+def start_server(database_url, workers, threads, hash_iterations):
+    env = dict(os.environ, FLASK_APP='run.py', DATABASE_URL=database_url, WTF_CSRF_ENABLED='false',
+               RATE_LIMIT_ENABLED='false', PASSWORD_HASHER='pbkdf2',
+               PASSWORD_HASHER_PARAMS=json.dumps({'iterations': hash_iterations}))
+    process = subprocess.Popen([sys.executable, '-m', 'flask', 'serve', '--port', str(PORT),
+                                '--workers', str(workers), '--threads', str(threads)],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=5)
+            connection.request('GET', '/auth/csrf_token')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+def drive(requests, concurrency):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(part):
+        mine, failed = [], 0
+        for method, url, body, headers in part:
+            start = time.perf_counter()
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=30)
+            headers = dict(headers, **{'Content-Type': 'application/json'}) if body is not None else headers
+            connection.request(method.upper(), url, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            mine.append(time.perf_counter() - start)
+            if response.status >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(requests[i::concurrency],)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'errors': sum(errors),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP throughput of flask serve per workers x threads layout.')
+    parser.add_argument('--layouts', default='1x1,1x8,2x8', help='comma-separated WORKERSxTHREADS')
+    parser.add_argument('--scenarios', default='login,org_listing,member_listing')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orgs', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='client threads')
+    parser.add_argument('--hash-iterations', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'serve.db')
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    with app.app_context():
+        user_ids = seed(args.users, args.orgs, {'iterations': args.hash_iterations})
+        scenarios = build_scenarios(args, user_ids)
+
+    print('{} CPUs, {} client threads'.format(os.cpu_count(), args.concurrency))
+    print('{:<8} {:<16} {:>9} {:>7} {:>10} {:>10}'.format('layout', 'scenario', 'req/s', 'errors', 'p50 (ms)', 'p95 (ms)'))
+    for layout in args.layouts.split(','):
+        workers, threads = map(int, layout.split('x'))
+        process = start_server(database_url, workers, threads, args.hash_iterations)
+        try:
+            for name in args.scenarios.split(','):
+                drive(scenarios[name][:args.concurrency], args.concurrency)
+                stats = drive(scenarios[name], args.concurrency)
+                print('{:<8} {:<16} {:>9.1f} {:>7} {:>10.3f} {:>10.3f}'.format(
+                    layout, name, stats['throughput_rps'], stats['errors'], stats['p50_ms'], stats['p95_ms']))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# benchmarks/validation_bench.py
+#
+# Per-request cost of validating a registration and a login body with the
+# WTForms forms versus app.validation's precompiled validators.
+#
+#   python benchmarks/validation_bench.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from app.forms import RegistrationForm, LoginForm
+from app.validation import registration_validator, login_validator
+
+REPEAT = 5000
+
+REGISTRATION = {
+    'userId': 'newuser', 'email': 'newuser@example.com', 'password': 'secret1', 'confirm_password': 'secret1',
+    'firstName': 'New', 'lastName': 'User', 'phone': '0123', 'organization_name': 'Acme'
+}
+LOGIN = {'userId': 'newuser', 'password': 'secret1'}
+
+def per_call_us(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+def main():
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    print('{:<14} {:>12} {:>12} {:>9}'.format('body', 'forms (us)', 'validator', 'speedup'))
+    with app.test_request_context('/auth/register', method='POST', json=REGISTRATION):
+        for name, form_class, validator, data in [('registration', RegistrationForm, registration_validator, REGISTRATION),
+                                                  ('login', LoginForm, login_validator, LOGIN)]:
+            def forms():
+                assert form_class(data=data).validate_on_submit()
+
+            def compiled():
+                assert not validator.validate_request(data)[1]
+
+            forms_us, compiled_us = per_call_us(forms), per_call_us(compiled)
+            print('{:<14} {:>12.1f} {:>12.1f} {:>8.1f}x'.format(name, forms_us, compiled_us, forms_us / compiled_us))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+import pytest
+from app.query_profiler import assert_max_queries
+
+# Usage: with max_queries(3): client.get(...)
+@pytest.fixture
+def max_queries():
+    return assert_max_queries
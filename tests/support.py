@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+import unittest
+from app import create_app
+from app.models import db, User, Organization
+from app.claims import issue_tokens
+
+# An app on an in-memory database whose app context stays pushed for the
+# whole test, so tests can use the models between requests
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = self.database_uri()
+        self.app.config['PASSWORD_HASHER_PARAMS'] = {'iterations': 1000}
+        self.client = self.app.test_client()
+
+        context = self.app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def database_uri(self):
+        return 'sqlite:///:memory:'
+
+    # A directory removed after the test
+    def temp_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        return path
+
+# Adds testuser, a member of org1 and org2, with two other members in org1.
+# self.headers authorises requests as testuser.
+class SeededTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User')
+        user.set_password('testpassword')
+        org1 = Organization(orgId='org1', name='Org 1')
+        org2 = Organization(orgId='org2', name='Org 2')
+        user.organizations.extend([org1, org2])
+        for i in range(2):
+            other = User(userId='other{}'.format(i), email='other{}@example.com'.format(i), firstName='Other', lastName='User', password_hash='-')
+            other.organizations.append(org1)
+            db.session.add(other)
+        db.session.add(user)
+        db.session.commit()
+        access, _ = issue_tokens(user.userId, user.id)
+        self.headers = {'Authorization': 'Bearer ' + access}
@@ -0,0 +1,114 @@
+import csv
+import json
+import os
+import unittest
+from unittest import mock
+from app import bulk
+from app.models import db, User, Organization, user_organization
+from support import AppTestCase
+
+class BulkTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = self.temp_dir()
+        self.users = os.path.join(self.directory, 'users.csv')
+        with open(self.users, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['userId', 'email', 'firstName', 'lastName', 'phone', 'password'])
+            for i in range(5):
+                writer.writerow(['user{}'.format(i), 'user{}@example.com'.format(i), 'First, "quoted"', 'Last', '', 'password'])
+            writer.writerow(['bad', 'not-an-email', 'Bad', 'Row', '', 'password'])
+        self.organizations = os.path.join(self.directory, 'organizations.jsonl')
+        with open(self.organizations, 'w') as f:
+            f.write('\n'.join(json.dumps({'orgId': 'org{}'.format(i), 'name': 'Org {}'.format(i),
+                                          'description': 'Line one\nline two'}) for i in range(2)) + '\n')
+        self.memberships = os.path.join(self.directory, 'memberships.jsonl')
+        with open(self.memberships, 'w') as f:
+            f.write('\n'.join(json.dumps({'userId': 'user{}'.format(i), 'orgId': 'org{}'.format(i % 2)})
+                              for i in range(5)) + '\n{"userId": "nobody", "orgId": "org0"}\n')
+
+    def run_cli(self, *args):
+        result = self.app.test_cli_runner().invoke(args=['bulk'] + list(args))
+        self.assertEqual(result.exit_code, 0, result.output + result.stderr)
+        return result
+
+    def test_import(self):
+        result = self.run_cli('import', 'users', self.users)
+        self.assertEqual(result.stdout, '6 rows: 5 imported, 0 already present, 1 rejected\n')
+        self.assertTrue(result.stderr.startswith('Row 6: {"email"'))
+        self.run_cli('import', 'organizations', self.organizations)
+        result = self.run_cli('import', 'memberships', self.memberships)
+        self.assertEqual(result.stdout, '6 rows: 5 imported, 0 already present, 1 rejected\n')
+
+        self.assertEqual(User.query.filter_by(userId='user0').one().firstName, 'First, "quoted"')
+        self.assertEqual(Organization.query.filter_by(orgId='org1').one().description, 'Line one\nline two')
+        self.assertEqual(db.session.query(user_organization).count(), 5)
+        response = self.client.post('/auth/login', json={'userId': 'user3', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+
+        # Running again changes nothing
+        result = self.run_cli('import', 'users', self.users)
+        self.assertEqual(result.stdout, '6 rows: 0 imported, 5 already present, 1 rejected\n')
+        self.assertEqual(User.query.count(), 5)
+
+    def test_resume_after_interruption(self):
+        calls = []
+        importer = bulk.IMPORTERS['users']
+
+        def failing(chunk):
+            calls.append([number for number, _ in chunk])
+            if len(calls) == 2:
+                raise RuntimeError('interrupted')
+            return importer(chunk)
+
+        with mock.patch.dict(bulk.IMPORTERS, {'users': failing}):
+            with self.assertRaises(RuntimeError):
+                bulk.import_file('users', self.users, chunk_size=2)
+            self.assertEqual(User.query.count(), 2)
+            self.assertTrue(os.path.exists(self.users + '.checkpoint'))
+
+            result = bulk.import_file('users', self.users, chunk_size=2)
+        self.assertEqual(calls, [[1, 2], [3, 4], [3, 4], [5, 6]])
+        self.assertEqual((result['rows'], result['inserted'], result['rejected']), (6, 5, 1))
+        self.assertFalse(os.path.exists(self.users + '.checkpoint'))
+
+    def test_changed_file_needs_restart(self):
+        def interrupted(chunk):
+            raise RuntimeError('interrupted')
+
+        with mock.patch.dict(bulk.IMPORTERS, {'users': interrupted}):
+            with self.assertRaises(RuntimeError):
+                bulk.import_file('users', self.users, chunk_size=2)
+        with open(self.users + '.checkpoint', 'w') as f:
+            json.dump({'kind': 'users', 'stamp': [0, 0], 'offset': 10}, f)
+        result = self.app.test_cli_runner().invoke(args=['bulk', 'import', 'users', self.users])
+        self.assertIn('--restart', result.output)
+
+    def test_export_round_trip(self):
+        for kind, path in zip(('users', 'organizations', 'memberships'), (self.users, self.organizations, self.memberships)):
+            self.run_cli('import', kind, path)
+
+        out = os.path.join(self.directory, 'out.csv')
+        self.run_cli('export', 'memberships', out)
+        with open(out, newline='') as f:
+            self.assertEqual([(row['userId'], row['orgId']) for row in csv.DictReader(f)],
+                             [('user{}'.format(i), 'org{}'.format(i % 2)) for i in range(5)])
+
+        result = self.run_cli('export', 'organizations', '-')
+        with open(self.organizations) as f:
+            self.assertEqual([json.loads(line) for line in result.stdout.splitlines()], [json.loads(line) for line in f])
+
+        # Exported users import elsewhere with their password hashes
+        out = os.path.join(self.directory, 'out.jsonl')
+        self.run_cli('export', 'users', out)
+        with open(out) as f:
+            exported = [json.loads(line) for line in f]
+        self.assertEqual([row['userId'] for row in exported], ['user{}'.format(i) for i in range(5)])
+        db.session.query(user_organization).delete()
+        User.query.delete()
+        db.session.commit()
+        self.run_cli('import', 'users', out)
+        self.assertEqual([user.password_hash for user in User.query.order_by(User.id)], [row['password_hash'] for row in exported])
+
+if __name__ == '__main__':
+    unittest.main()
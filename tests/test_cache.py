@@ -0,0 +1,113 @@
+import os
+import unittest
+import time
+from flask_jwt_extended import create_access_token
+from app import create_app, user_cache
+from app.cache import LocalBackend, SharedInvalidations
+from app.models import db, User
+from app.server import share_user_cache
+from support import AppTestCase, SeededTestCase
+
+class LocalBackendTestCase(unittest.TestCase):
+    def test_lru_eviction(self):
+        backend = LocalBackend(maxsize=2, ttl=60)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_ttl_expiry(self):
+        backend = LocalBackend(maxsize=2, ttl=0.01)
+        backend.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(backend.get('a'))
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User', password_hash='-'))
+            db.session.commit()
+            self.headers = {'Authorization': 'Bearer ' + create_access_token(identity='testuser')}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_read_through(self):
+        with self.app.app_context():
+            self.assertEqual(user_cache.get('testuser').firstName, 'Test')
+            self.assertEqual(user_cache.get('testuser').firstName, 'Test')
+            self.assertIsNone(user_cache.get('missing'))
+            stats = user_cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_put_invalidates(self):
+        self.client.get('/auth/api/users/testuser', headers=self.headers)
+        self.client.put('/auth/api/users/testuser', json={'firstName': 'Changed'}, headers=self.headers)
+        response = self.client.get('/auth/api/users/testuser', headers=self.headers)
+        self.assertEqual(response.get_json()['data']['firstName'], 'Changed')
+
+class SharedInvalidationsTestCase(AppTestCase):
+    def test_shared_between_processes(self):
+        path = os.path.join(self.temp_dir(), 'users')
+        invalidations = SharedInvalidations(path, 64, 60)
+        self.assertEqual(invalidations.invalidated_at('alice'), 0)
+        before = time.time()
+        pid = os.fork()
+        if pid == 0:
+            # Child: a write on another worker
+            SharedInvalidations(path, 64, 60).invalidate('alice')
+            os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertGreaterEqual(invalidations.invalidated_at('alice'), before)
+        self.assertEqual(invalidations.invalidated_at('bobby'), 0)
+
+    def test_full_probe_raises_the_floor(self):
+        invalidations = SharedInvalidations(os.path.join(self.temp_dir(), 'users'), 1, 60)
+        invalidations.invalidate('alice')
+        first = invalidations.invalidated_at('alice')
+        invalidations.invalidate('bobby')
+        self.assertEqual(invalidations.invalidated_at('carol'), first)
+        self.assertGreaterEqual(invalidations.invalidated_at('bobby'), first)
+
+    def test_serve_shares_invalidations(self):
+        path = share_user_cache(self.app)
+        self.addCleanup(os.unlink, path)
+        self.assertEqual(self.app.config['USER_CACHE_INVALIDATION_FILE'], path)
+        self.assertIsInstance(self.app.extensions['user_cache'].invalidations, SharedInvalidations)
+        self.assertIsNone(share_user_cache(self.app))
+
+# Two apps on one file database, standing in for two workers
+class CrossWorkerTestCase(SeededTestCase):
+    def database_uri(self):
+        self.directory = self.temp_dir()
+        return 'sqlite:///' + os.path.join(self.directory, 'users.db')
+
+    def test_write_in_one_worker_reaches_the_other(self):
+        path = os.path.join(self.directory, 'users')
+        user_cache.share_invalidations(self.app, path)
+        other = create_app()
+        other.config['SQLALCHEMY_DATABASE_URI'] = self.app.config['SQLALCHEMY_DATABASE_URI']
+        user_cache.share_invalidations(other, path)
+
+        cached = self.client.get('/auth/api/users/testuser', headers=self.headers)
+        self.assertEqual(cached.get_json()['data']['firstName'], 'Test')
+        response = other.test_client().put('/auth/api/users/testuser', json={'firstName': 'Changed'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        changed = self.client.get('/auth/api/users/testuser', headers=self.headers)
+        self.assertEqual(changed.get_json()['data']['firstName'], 'Changed')
+        self.assertNotEqual(changed.headers['ETag'], cached.headers['ETag'])
+
+if __name__ == '__main__':
+    unittest.main()
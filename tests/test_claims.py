@@ -0,0 +1,64 @@
+import unittest
+from flask_jwt_extended import decode_token
+from app.models import db, User, Organization, user_organization
+from support import SeededTestCase
+
+class ClaimsTestCase(SeededTestCase):
+    def test_login_token_carries_memberships(self):
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        data = response.get_json()['data']
+        claims = decode_token(data['accessToken'])
+        user = User.query.filter_by(userId='testuser').first()
+        self.assertEqual(claims['uid'], user.id)
+        self.assertEqual(claims['orgs'], sorted(org.id for org in user.organizations))
+
+        response = self.client.post('/auth/refresh', headers={'Authorization': 'Bearer ' + data['refreshToken']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode_token(response.get_json()['data']['accessToken'])['orgs'], claims['orgs'])
+
+    def test_large_membership_claim_is_omitted(self):
+        self.app.config['JWT_MEMBERSHIP_CLAIM_MAX'] = 1
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertNotIn('orgs', decode_token(response.get_json()['data']['accessToken']))
+
+        # Falls back to a membership query
+        response = self.client.get('/api/api/organisations/org1', headers={'Authorization': 'Bearer ' + response.get_json()['data']['accessToken']})
+        self.assertEqual(response.status_code, 200)
+
+    def test_non_member_is_forbidden(self):
+        db.session.add(Organization(orgId='org3', name='Org 3'))
+        db.session.commit()
+        for url in ('/api/api/organisations/org3', '/auth/api/organisations/org3'):
+            self.assertEqual(self.client.get(url, headers=self.headers).status_code, 403)
+        for url in ('/api/api/organisations', '/auth/api/organisations'):
+            response = self.client.get(url, headers=self.headers)
+            data = response.get_json()['data']
+            self.assertEqual([org['orgId'] for org in data.get('organisations', data.get('organizations'))], ['org1', 'org2'])
+
+    def test_membership_added_after_token(self):
+        db.session.add(Organization(orgId='org3', name='Org 3'))
+        db.session.commit()
+        response = self.client.post('/auth/api/organisations/org3/users', json={'userId': 'testuser'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        # The old token does not list org3, so the database is asked
+        # instead of answering 403
+        response = self.client.get('/api/api/organisations/org3', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_member_added_by_another_process(self):
+        org3 = Organization(orgId='org3', name='Org 3')
+        db.session.add(org3)
+        db.session.commit()
+        response = self.client.get('/api/api/organisations/org3', headers=self.headers)
+        self.assertEqual(response.status_code, 403)
+
+        # Written behind this process's back
+        user = User.query.filter_by(userId='testuser').first()
+        db.session.execute(user_organization.insert().values(user_id=user.id, organization_id=org3.id))
+        db.session.commit()
+        response = self.client.get('/api/api/organisations/org3', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import unittest
+from unittest import mock
+from sqlalchemy import event
+from app import event_log, password_pool, user_cache
+from app.models import db, User
+from app.query_profiler import assert_max_queries
+from support import SeededTestCase
+
+class ConditionalTestCase(SeededTestCase):
+    def test_organisation_etag(self):
+        response = self.client.get('/api/api/organisations/org1', headers=self.headers)
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(etag.startswith('W/'))
+
+        # Served from the user cache and version cache: no queries at all
+        with assert_max_queries(0):
+            response = self.client.get('/api/api/organisations/org1', headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+
+        response = self.client.get('/auth/api/organisations/org1', headers=dict(self.headers, **{'If-None-Match': '"stale"'}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_etag_changes_on_update(self):
+        etag = self.client.get('/auth/api/users/testuser', headers=self.headers).headers['ETag']
+
+        with assert_max_queries(0):
+            response = self.client.get('/auth/api/users/testuser', headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+        self.client.put('/auth/api/users/testuser', json={'firstName': 'Changed'}, headers=self.headers)
+        response = self.client.get('/auth/api/users/testuser', headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.get_json()['data']['firstName'], 'Changed')
+
+# A file database, so another connection can change the row under a request
+class ConcurrentUpdateTestCase(SeededTestCase):
+    def database_uri(self):
+        return 'sqlite:///' + os.path.join(self.temp_dir(), 'updates.db')
+
+    # Logins are written behind on a file database; before the tables go
+    def tearDown(self):
+        event_log.close()
+        super().tearDown()
+
+    def update_behind(self, **values):
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.update().where(User.userId == 'testuser')
+                               .values(version=User.version + 1, **values))
+
+    def test_put_conflicts_with_concurrent_update(self):
+        def racing(session, context, instances):
+            self.update_behind(lastName='Raced')
+
+        event.listen(db.session, 'before_flush', racing)
+        self.addCleanup(event.remove, db.session, 'before_flush', racing)
+        response = self.client.put('/auth/api/users/testuser', json={'firstName': 'Mine'}, headers=self.headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(db.session.query(User.firstName, User.lastName).filter_by(userId='testuser').one(), ('Test', 'Raced'))
+
+    def test_rehash_gives_way_to_concurrent_update(self):
+        self.app.config['PASSWORD_HASHER_PARAMS'] = {'iterations': 2000}
+        hash = password_pool.hash
+
+        def racing(password):
+            self.update_behind(firstName='Raced')
+            return hash(password)
+
+        with mock.patch.object(password_pool, 'hash', racing):
+            response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['user']['firstName'], 'Raced')
+
+        # Rehashed by the next login, which drops the old version from the cache
+        version = user_cache.get('testuser').version
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_cache.get('testuser').version, version + 1)
+
+if __name__ == '__main__':
+    unittest.main()
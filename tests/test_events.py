@@ -0,0 +1,105 @@
+import os
+import unittest
+from sqlalchemy import event as sa_event
+from app import create_app, event_log
+from app.metrics import registry
+from app.models import db, User, AuthEvent
+from app.query_profiler import assert_max_queries
+from support import AppTestCase, SeededTestCase
+
+def events(app):
+    with app.app_context():
+        return [(e.type, e.userId, e.actor) for e in AuthEvent.query.order_by(AuthEvent.id)]
+
+def dropped():
+    return registry.counters.get('auth_events_dropped_total', {}).get((), 0)
+
+# A file database, so events are written by the background thread
+class WriteBehindTestCase(AppTestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.temp_dir(), 'events.db')
+        self.app.config['PASSWORD_HASHER_PARAMS'] = {'iterations': 1000}
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            user = User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User')
+            user.set_password('testpassword')
+            db.session.add(user)
+            db.session.commit()
+            db.session.remove()
+
+    def tearDown(self):
+        with self.app.app_context():
+            event_log.close()
+
+    def statements(self):
+        statements = []
+        with self.app.app_context():
+            sa_event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        return statements
+
+    def test_logins_are_written_behind(self):
+        statements = self.statements()
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 200)
+        self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'wrong'})
+        with self.app.app_context():
+            self.assertTrue(event_log.close())
+        self.assertEqual(events(self.app), [('login', 'testuser', None), ('login_failed', 'testuser', None)])
+        # Both events went out in one statement, after the responses
+        self.assertEqual(len([s for s in statements if s.startswith('INSERT INTO auth_event')]), 1)
+
+    def test_batches_are_capped(self):
+        self.app.config['EVENT_LOG_BATCH_SIZE'] = 3
+        self.app.config['EVENT_LOG_FLUSH_MS'] = 60000
+        statements = self.statements()
+        with self.app.app_context():
+            for i in range(7):
+                event_log.record('login', 'user{}'.format(i))
+            self.assertTrue(event_log.close())
+        self.assertEqual(len(events(self.app)), 7)
+        self.assertEqual(len([s for s in statements if s.startswith('INSERT INTO auth_event')]), 3)
+
+    def test_over_long_values_are_cut(self):
+        long_userId = 'x' * 10240
+        response = self.client.post('/auth/login', json={'userId': long_userId, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        with self.app.app_context():
+            event_log.record('member_added', 'testuser', actor=long_userId)
+            self.assertTrue(event_log.close())
+        self.assertEqual(events(self.app), [('login_failed', long_userId[:100], None), ('login', 'testuser', None),
+                                            ('member_added', 'testuser', long_userId[:100])])
+
+class EventLogTestCase(SeededTestCase):
+    def test_registration_and_membership_changes(self):
+        response = self.client.post('/auth/register', json={
+            'userId': 'newuser', 'email': 'newuser@example.com', 'password': 'password', 'confirm_password': 'password',
+            'firstName': 'New', 'lastName': 'User', 'organization_name': 'Org 1'
+        })
+        self.assertEqual(response.status_code, 201)
+        self.client.post('/auth/api/organisations/org2/users', json={'userId': 'newuser'}, headers=self.headers)
+        event_log.flush()
+        self.assertEqual(events(self.app), [('register', 'newuser', None), ('member_added', 'newuser', 'testuser')])
+
+    def test_full_queue_drops(self):
+        self.app.config['EVENT_LOG_QUEUE_SIZE'] = 2
+        self.app.config['EVENT_LOG_PUT_TIMEOUT'] = 0.01
+        before = dropped()
+        for i in range(3):
+            event_log.record('login', 'user{}'.format(i))
+        self.assertEqual(dropped(), before + 1)
+        event_log.flush()
+        self.assertEqual([userId for _, userId, _ in events(self.app)], ['user0', 'user1'])
+
+    def test_inline_when_queue_size_is_zero(self):
+        self.app.config['EVENT_LOG_QUEUE_SIZE'] = 0
+        with assert_max_queries(1):
+            event_log.record('login', 'testuser')
+        self.assertEqual(events(self.app), [('login', 'testuser', None)])
+
+if __name__ == '__main__':
+    unittest.main()
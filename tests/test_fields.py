@@ -0,0 +1,44 @@
+import unittest
+from app.query_profiler import assert_max_queries
+from app.serializers import organization_schema
+from support import SeededTestCase
+
+class SchemaOnlyTestCase(unittest.TestCase):
+    def test_schema_only_keeps_schema_order(self):
+        subset = organization_schema.only(['name', 'orgId'])
+        self.assertEqual(subset.fields, ('orgId', 'name'))
+        self.assertIs(organization_schema.only(['orgId', 'name']), subset)
+
+class FieldsTestCase(SeededTestCase):
+    def test_organisation_listing_selects_requested_columns(self):
+        with assert_max_queries(2) as stats:
+            response = self.client.get('/auth/api/organisations?fields=orgId', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['organizations'], [{'orgId': 'org1'}, {'orgId': 'org2'}])
+        self.assertFalse(any('description' in shape for shape in stats.shapes))
+
+        response = self.client.get('/api/api/organisations?fields=name,orgId', headers=self.headers)
+        self.assertEqual(response.get_json()['data']['organisations'][0], {'orgId': 'org1', 'name': 'Org 1'})
+
+    def test_member_listing_fields(self):
+        with assert_max_queries(2) as stats:
+            response = self.client.get('/auth/api/organisations/org1/users?fields=userId,email', headers=self.headers)
+        users = response.get_json()['data']['users']
+        self.assertEqual(users[0], {'userId': 'other0', 'email': 'other0@example.com'})
+        self.assertFalse(any('phone' in shape for shape in stats.shapes))
+
+        response = self.client.get('/auth/api/organisations/org1/users?fields=userId&format=csv', headers=self.headers)
+        self.assertEqual(response.get_data(as_text=True).splitlines()[0], 'userId')
+
+    def test_unknown_and_private_fields_are_rejected(self):
+        for url in ['/auth/api/organisations/org1/users?fields=userId,password_hash',
+                    '/auth/api/organisations?fields=secret',
+                    '/api/api/organisations?fields=,']:
+            response = self.client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 400, url)
+        response = self.client.get('/auth/api/organisations/org1/users?fields=password_hash', headers=self.headers)
+        self.assertIn('password_hash', response.get_json()['message'])
+        self.assertNotIn('password_hash', response.get_json()['message'].split('allowed:')[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from werkzeug.security import generate_password_hash
+from app import create_app
+from app.hashers import get_hasher, verify_password, calibrate, hashers_cli
+from app.models import db, User
+
+class HasherTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        for name, params in [('pbkdf2', {'iterations': 1000}), ('scrypt', {'n': 1024})]:
+            password_hash = get_hasher(name, params).hash('secret')
+            self.assertTrue(verify_password(password_hash, 'secret'))
+            self.assertFalse(verify_password(password_hash, 'wrong'))
+
+    def test_reads_werkzeug_hashes(self):
+        self.assertTrue(verify_password(generate_password_hash('secret'), 'secret'))
+
+    def test_needs_rehash(self):
+        hasher = get_hasher('pbkdf2', {'iterations': 2000})
+        self.assertTrue(hasher.needs_rehash(get_hasher('pbkdf2', {'iterations': 1000}).hash('secret')))
+        self.assertFalse(hasher.needs_rehash(hasher.hash('secret')))
+
+    def test_unknown_hasher(self):
+        with self.assertRaises(ValueError):
+            get_hasher('md5')
+
+    def test_calibrate(self):
+        params, elapsed = calibrate('pbkdf2', 1)
+        self.assertGreaterEqual(elapsed, 1)
+        self.assertIn('iterations', params)
+
+class RehashOnLoginTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['PASSWORD_HASHER'] = 'scrypt'
+        self.app.config['PASSWORD_HASHER_PARAMS'] = {'n': 1024}
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User',
+                                password_hash=generate_password_hash('testpassword')))
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_login_upgrades_hash(self):
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            password_hash = User.query.filter_by(userId='testuser').first().password_hash
+            self.assertTrue(password_hash.startswith('scrypt:1024:8:1$'))
+
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_calibrate_command(self):
+        result = self.app.test_cli_runner().invoke(hashers_cli, ['calibrate', '--algorithm', 'pbkdf2', '--target-ms', '1'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('PASSWORD_HASHER=pbkdf2', result.output)
+
+if __name__ == '__main__':
+    unittest.main()
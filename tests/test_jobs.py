@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime, timedelta
+from app import jobs
+from app.models import db, Job
+from support import SeededTestCase
+
+sent = []
+
+def recording_notifier(userId, kind, data, key):
+    sent.append((userId, kind, key))
+
+def statuses():
+    return [(job.task, job.status, job.attempts) for job in Job.query.order_by(Job.id)]
+
+class JobTestCase(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config['NOTIFIER'] = recording_notifier
+        sent.clear()
+
+    def register(self, userId, organization_name):
+        response = self.client.post('/auth/register', json={
+            'userId': userId, 'email': userId + '@example.com', 'password': 'password', 'confirm_password': 'password',
+            'firstName': 'New', 'lastName': 'User', 'organization_name': organization_name
+        })
+        self.assertEqual(response.status_code, 201)
+
+    def test_registration_jobs_run_later(self):
+        self.register('newuser', 'Org 1')
+        self.assertEqual(statuses(), [('welcome', 'queued', 0), ('member_joined', 'queued', 0)])
+        self.assertEqual(sent, [])
+
+        result = self.app.test_cli_runner().invoke(args=['jobs', 'work', '--burst', '--workers', '1'])
+        self.assertEqual(result.output, 'Ran 2 jobs\n')
+        self.assertEqual(statuses(), [('welcome', 'done', 1), ('member_joined', 'done', 1)])
+        self.assertEqual(sent[0][:2], ('newuser', 'welcome'))
+        self.assertEqual(sorted(userId for userId, kind, _ in sent[1:]), ['other0', 'other1', 'testuser'])
+
+    def test_idempotency_key(self):
+        for _ in range(2):
+            jobs.enqueue('welcome', {'userId': 'someone', 'orgId': 'org1'}, key='welcome:someone')
+            db.session.commit()
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_retries_with_backoff_then_fails(self):
+        self.app.config['NOTIFIER'] = 'app.nothing.here'
+        self.app.config['JOB_MAX_ATTEMPTS'] = 2
+        jobs.enqueue('welcome', {'userId': 'someone', 'orgId': 'org1'})
+        db.session.commit()
+
+        self.assertEqual(jobs.run(jobs.claim()), 'queued')
+        job = Job.query.one()
+        self.assertGreater(job.run_at, datetime.utcnow() + timedelta(seconds=5))
+        self.assertIn('ImportStringError', job.last_error)
+        # Not due until the backoff has passed
+        self.assertIsNone(jobs.claim())
+
+        Job.query.update({'run_at': datetime.utcnow()})
+        db.session.commit()
+        self.assertEqual(jobs.run(jobs.claim()), 'failed')
+        self.assertEqual(statuses(), [('welcome', 'failed', 2)])
+
+        self.app.test_cli_runner().invoke(args=['jobs', 'retry'])
+        self.assertEqual(statuses(), [('welcome', 'queued', 0)])
+
+    def test_expired_lease_is_claimed_again(self):
+        jobs.enqueue('welcome', {'userId': 'someone', 'orgId': 'org1'})
+        db.session.commit()
+        stale = jobs.claim()
+        self.assertIsNone(jobs.claim())
+
+        Job.query.update({'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        fresh = jobs.claim()
+        self.assertEqual(fresh.attempts, 2)
+        self.assertEqual(jobs.run(fresh), 'done')
+        # The first worker's late result does not touch the job any more
+        jobs.run(stale)
+        self.assertEqual(statuses(), [('welcome', 'done', 2)])
+        self.assertEqual(len(sent), 2)
+
+if __name__ == '__main__':
+    unittest.main()
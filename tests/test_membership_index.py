@@ -0,0 +1,98 @@
+import os
+import threading
+import unittest
+from unittest import mock
+from app import membership_index
+from app.models import db, User, Organization, user_organization
+from app.query_profiler import assert_max_queries
+from support import SeededTestCase
+
+def ids(*userIds):
+    return [User.query.filter_by(userId=userId).first().id for userId in userIds]
+
+class MembershipIndexTestCase(SeededTestCase):
+    def add_loner(self):
+        loner = User(userId='loner', email='loner@example.com', firstName='Lo', lastName='Ner', password_hash='-')
+        db.session.add(loner)
+        db.session.commit()
+        return loner
+
+    def test_index_answers_from_memory(self):
+        testuser, other0 = ids('testuser', 'other0')
+        membership_index.load()
+        with assert_max_queries(0):
+            self.assertTrue(membership_index.share_organization(testuser, other0))
+            self.assertEqual(list(membership_index.organizations(testuser)), sorted(membership_index.organizations(testuser)))
+            self.assertIn(testuser, membership_index.members(membership_index.organizations(other0)[0]))
+
+    def test_add_merges_a_batch(self):
+        testuser, other0 = ids('testuser', 'other0')
+        membership_index.load()
+        org1 = membership_index.organizations(other0)[0]
+        before = membership_index.members(org1)
+        membership_index.add([(user_id, org1) for user_id in (1000, 10, testuser, 1000, 5)] + [(10, 77), (10, 76)])
+        self.assertEqual(list(membership_index.members(org1)), sorted(set(before) | {5, 10, 1000}))
+        self.assertEqual(list(membership_index.organizations(10)), sorted([76, 77, org1]))
+        self.assertEqual(list(membership_index.members(77)), [10])
+
+        # Nothing new: the same arrays stay in place
+        after = membership_index.members(org1)
+        membership_index.add([(testuser, org1)])
+        self.assertIs(membership_index.members(org1), after)
+
+    def test_index_picks_up_memberships_from_other_processes(self):
+        loner = self.add_loner()
+        testuser, = ids('testuser')
+        self.assertFalse(membership_index.share_organization(testuser, loner.id))
+
+        # Written behind the index's back, as another worker would
+        organization_id = Organization.query.filter_by(orgId='org2').first().id
+        db.session.execute(user_organization.insert().values(user_id=loner.id, organization_id=organization_id))
+        db.session.commit()
+        self.assertTrue(membership_index.share_organization(testuser, loner.id))
+        self.assertIn(organization_id, membership_index.organizations(loner.id))
+
+    def test_user_details_of_co_member(self):
+        self.client.get('/auth/api/users/testuser', headers=self.headers)
+        response = self.client.get('/auth/api/users/other0', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['userId'], 'other0')
+
+        response = self.client.put('/auth/api/users/other0', json={'firstName': 'Nope'}, headers=self.headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_details_after_adding_member(self):
+        self.add_loner()
+        self.assertEqual(self.client.get('/auth/api/users/loner', headers=self.headers).status_code, 401)
+
+        self.client.post('/auth/api/organisations/org1/users', json={'userId': 'loner'}, headers=self.headers)
+        self.assertEqual(self.client.get('/auth/api/users/loner', headers=self.headers).status_code, 200)
+
+# A file database, so the index is loaded by a background thread
+class BackgroundLoadTestCase(SeededTestCase):
+    def database_uri(self):
+        return 'sqlite:///' + os.path.join(self.temp_dir(), 'index.db')
+
+    def test_requests_do_not_wait_for_the_load(self):
+        state = self.app.extensions['membership_index']
+        release = threading.Event()
+        load = membership_index.load
+
+        def slow_load():
+            release.wait(10)
+            load()
+
+        with mock.patch.object(membership_index, 'load', slow_load):
+            # Answered from the database while the index is being built
+            response = self.client.get('/auth/api/users/other0', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(state.loaded)
+            release.set()
+            state.loader.join(10)
+        self.assertTrue(state.loaded)
+        testuser, other0 = ids('testuser', 'other0')
+        with assert_max_queries(0):
+            self.assertTrue(membership_index.share_organization(testuser, other0))
+
+if __name__ == '__main__':
+    unittest.main()
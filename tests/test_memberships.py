@@ -0,0 +1,102 @@
+import unittest
+import json
+from unittest import mock
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app import models
+from app.models import db, User, Organization, user_organization, is_member
+
+class MembershipTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            org = Organization(orgId='org1', name='Org 1')
+            for i in range(3):
+                user = User(userId='user{}'.format(i), email='user{}@example.com'.format(i), firstName='Test', lastName='User', password_hash='-')
+                if i == 0:
+                    user.organizations.append(org)
+                db.session.add(user)
+            db.session.add(org)
+            db.session.commit()
+            self.headers = {'Authorization': 'Bearer ' + create_access_token(identity='user0')}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_add_user(self):
+        for _ in range(2):
+            response = self.client.post('/auth/api/organisations/org1/users', json={'userId': 'user1'}, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            user = User.query.filter_by(userId='user1').first()
+            org = Organization.query.filter_by(orgId='org1').first()
+            self.assertTrue(is_member(user.id, org.id))
+            self.assertEqual(org.users.count(), 2)
+
+    def test_add_user_raced_by_another_request(self):
+        with self.app.app_context():
+            user_id = User.query.filter_by(userId='user1').first().id
+            organization_id = Organization.query.filter_by(orgId='org1').first().id
+        chunked = models.chunked
+        raced = []
+
+        # The other request's membership lands between the lookup and the insert
+        def racing(items, *args):
+            yield from chunked(items, *args)
+            if not raced:
+                raced.append(True)
+                db.session.execute(user_organization.insert().values(user_id=user_id, organization_id=organization_id))
+
+        with mock.patch.object(models, 'chunked', racing):
+            response = self.client.post('/auth/api/organisations/org1/users', json={'userId': 'user1'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(Organization.query.filter_by(orgId='org1').first().users.count(), 2)
+
+    def test_add_users_batch(self):
+        response = self.client.post('/auth/api/organisations/org1/users/batch', json={
+            'userIds': ['user0', 'user1', 'user2', 'missing', 'user1']
+        }, headers=self.headers)
+        data = json.loads(response.data)['data']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(data['added']), ['user1', 'user2'])
+        self.assertEqual(data['alreadyMembers'], ['user0'])
+        self.assertEqual(data['notFound'], ['missing'])
+
+        with self.app.app_context():
+            self.assertEqual(Organization.query.filter_by(orgId='org1').first().users.count(), 3)
+
+    def test_list_members(self):
+        response = self.client.get('/auth/api/organisations/org1/users', headers=self.headers)
+        data = json.loads(response.data)['data']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['userId'] for user in data['users']], ['user0'])
+
+    def test_export_members(self):
+        self.client.post('/auth/api/organisations/org1/users/batch', json={'userIds': ['user1', 'user2']}, headers=self.headers)
+
+        response = self.client.get('/auth/api/organisations/org1/users?format=ndjson', headers=self.headers)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([row['userId'] for row in rows], ['user0', 'user1', 'user2'])
+
+        response = self.client.get('/auth/api/organisations/org1/users', headers=dict(self.headers, Accept='text/csv'))
+        self.assertEqual(response.mimetype, 'text/csv')
+        lines = response.data.decode().splitlines()
+        self.assertEqual(lines[0], 'userId,firstName,lastName,email,phone')
+        self.assertEqual(len(lines), 4)
+
+    def test_add_users_batch_unknown_org(self):
+        response = self.client.post('/auth/api/organisations/nope/users/batch', json={'userIds': ['user1']}, headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
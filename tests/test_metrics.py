@@ -0,0 +1,88 @@
+import unittest
+import json
+import os
+import tempfile
+from app import create_app
+from app.metrics import Registry, merge, render
+from app.models import db
+from app.server import share_metrics
+
+class RenderTestCase(unittest.TestCase):
+    def test_histogram_is_cumulative(self):
+        registry = Registry()
+        for value in (0.001, 0.02, 20):
+            registry.observe('http_request_duration_seconds', {'endpoint': 'auth.login', 'method': 'POST'}, value)
+        text = render(*merge([registry.snapshot()]))
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="auth.login",method="POST",le="0.005"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="auth.login",method="POST",le="0.025"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="auth.login",method="POST",le="+Inf"} 3', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="auth.login",method="POST"} 3', text)
+
+    def test_merge_sums_processes(self):
+        first, second = Registry(), Registry()
+        first.inc('http_requests_total', {'endpoint': 'auth.login'}, 2)
+        second.inc('http_requests_total', {'endpoint': 'auth.login'}, 3)
+        counters, _, _ = merge([first.snapshot(), second.snapshot()])
+        self.assertEqual(counters['http_requests_total'][(('endpoint', 'auth.login'),)], 5)
+
+    def test_reset_forgets_values(self):
+        registry = Registry()
+        registry.inc('http_requests_total', {'endpoint': 'auth.login'})
+        registry.observe('http_request_duration_seconds', {'endpoint': 'auth.login'}, 0.1)
+        registry.reset()
+        counters, _, histograms = merge([registry.snapshot()])
+        self.assertEqual(counters, {})
+        self.assertEqual(histograms, {})
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['METRICS_DIR'] = self.metrics_dir
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_metrics(self):
+        self.client.get('/auth/csrf_token')
+        # A snapshot left by another worker process
+        with open(os.path.join(self.metrics_dir, 'metrics_999999999.json'), 'w') as f:
+            json.dump({
+                'pid': 999999999,
+                'counters': {'http_requests_total': [[[['endpoint', 'auth.get_csrf_token'], ['method', 'GET'], ['status', '200']], 41]]},
+                'gauges': {'db_pool_size': [[[], 5]]},
+                'histograms': {}
+            }, f)
+
+        response = self.client.get('/metrics')
+        text = response.data.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('endpoint="auth.get_csrf_token"', text)
+        # Counters from exited workers are kept, their gauges are not
+        self.assertRegex(text, r'http_requests_total\{endpoint="auth.get_csrf_token",method="GET",status="200"\} 4[2-9]')
+        self.assertNotIn('pid="999999999"', text)
+
+        # ...folded into one file, whose totals later scrapes still include
+        self.assertCountEqual(os.listdir(self.metrics_dir), ['metrics.lock', 'metrics_exited.json', 'metrics_{}.json'.format(os.getpid())])
+        text = self.client.get('/metrics').data.decode()
+        self.assertRegex(text, r'http_requests_total\{endpoint="auth.get_csrf_token",method="GET",status="200"\} 4[2-9]')
+
+    def test_serve_shares_a_directory(self):
+        self.assertIsNone(share_metrics(self.app))
+        self.app.config['METRICS_DIR'] = None
+        path = share_metrics(self.app)
+        self.addCleanup(os.rmdir, path)
+        self.assertTrue(os.path.isdir(path))
+        self.assertEqual(self.app.config['METRICS_DIR'], path)
+
+if __name__ == '__main__':
+    unittest.main()
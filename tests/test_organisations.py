@@ -0,0 +1,91 @@
+import unittest
+import json
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.models import db, User, Organization
+
+class OrganisationListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.client = self.app.test_client()
+
+        # testuser belongs to org0-org6, not to the one in between
+        with self.app.app_context():
+            db.create_all()
+            user = User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User', password_hash='-')
+            for i in range(7):
+                user.organizations.append(Organization(orgId='org{}'.format(i), name='Org {}'.format(i)))
+                if i == 3:
+                    db.session.add(Organization(orgId='other', name='Other'))
+            db.session.add(user)
+            db.session.commit()
+            self.headers = {'Authorization': 'Bearer ' + create_access_token(identity='testuser')}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_keyset_pages(self):
+        seen = []
+        after = None
+        while True:
+            url = '/auth/api/organisations?limit=3'
+            if after:
+                url += '&after=' + after
+            response = self.client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)['data']
+            seen.extend(org['orgId'] for org in data['organizations'])
+            after = data['nextCursor']
+            if after is None:
+                break
+
+        self.assertEqual(seen, ['org{}'.format(i) for i in range(7)])
+
+    def test_invalid_limit(self):
+        response = self.client.get('/auth/api/organisations?limit=0', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_stream(self):
+        response = self.client.get('/auth/api/organisations?format=ndjson', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0]['orgId'], 'org0')
+
+class UserOrganisationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            user = User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User', password_hash='-')
+            for i in range(5):
+                org = Organization(orgId='org{}'.format(i), name='Org {}'.format(i))
+                if i % 2 == 0:
+                    user.organizations.append(org)
+                db.session.add(org)
+            db.session.add(user)
+            db.session.commit()
+            self.headers = {'Authorization': 'Bearer ' + create_access_token(identity='testuser')}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_only_member_organisations(self):
+        response = self.client.get('/api/api/organisations', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        orgs = json.loads(response.data)['data']['organisations']
+        self.assertEqual([org['orgId'] for org in orgs], ['org0', 'org2', 'org4'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import importlib
+import threading
+import time
+import unittest
+from unittest import mock
+from werkzeug.security import generate_password_hash
+from app import create_app, password_pool
+from app.models import db, User
+
+# app.password_pool is the extension; the module holds the hashing functions
+pool_module = importlib.import_module('app.password_pool')
+
+class PasswordPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(User(userId='testuser', email='testuser@example.com', firstName='Test', lastName='User',
+                                password_hash=generate_password_hash('testpassword')))
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_hash_and_verify(self):
+        with self.app.app_context():
+            password_hash = password_pool.hash('secret')
+            self.assertTrue(password_pool.verify(password_hash, 'secret'))
+            self.assertFalse(password_pool.verify(password_hash, 'wrong'))
+
+    def test_login_through_pool(self):
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_saturated_pool_returns_503(self):
+        slots = self.app.extensions['password_pool'].slots
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+        try:
+            response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+    def test_batch_leaves_workers_for_logins(self):
+        self.app.config['PASSWORD_POOL_WORKERS'] = 4
+        self.app.config['PASSWORD_POOL_MAX_QUEUE'] = 0
+        password_pool.init_app(self.app)
+        lock = threading.Lock()
+        running, most = [0], [0]
+
+        def slow_hash(name, params, password):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.005)
+            with lock:
+                running[0] -= 1
+            return password
+
+        passwords = [str(i) for i in range(100)]
+        hashes = []
+
+        def batch_job():
+            with self.app.app_context():
+                hashes.extend(password_pool.hash_many(passwords))
+
+        with mock.patch.object(pool_module, 'hash_password', slow_hash), self.app.app_context():
+            batch = threading.Thread(target=batch_job)
+            batch.start()
+            while not running[0]:
+                time.sleep(0.001)
+            # No queue to wait in: this fails unless a worker is free
+            self.assertEqual(password_pool.hash('login'), 'login')
+            batch.join()
+        self.assertEqual(hashes, passwords)
+        self.assertLessEqual(most[0], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import importlib
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine, text
+from app.query_profiler import assert_max_queries, statement_shape
+from support import AppTestCase, SeededTestCase
+
+# app.query_profiler is the extension; the module holds QueryStats
+profiler_module = importlib.import_module('app.query_profiler')
+
+# Statement budget per endpoint; raise one only with a good reason
+BUDGETS = [
+    ('get', '/api/api/organisations', None, 2),
+    ('get', '/api/api/organisations/org1', None, 2),
+    ('get', '/auth/api/organisations', None, 1),
+    ('get', '/auth/api/organisations/org1', None, 1),
+    ('get', '/auth/api/organisations/org1/users', None, 2),
+    ('get', '/auth/api/users/testuser', None, 1),
+    ('get', '/auth/api/users/other0', None, 2),
+    ('post', '/auth/api/organisations/org2/users', {'userId': 'other0'}, 5),
+    ('post', '/auth/api/organisations/org2/users/batch', {'userIds': ['other0', 'other1']}, 5),
+    ('post', '/auth/login', {'userId': 'testuser', 'password': 'testpassword'}, 2),
+]
+
+class QueryBudgetTestCase(SeededTestCase):
+    def test_query_budget(self):
+        for method, url, body, limit in BUDGETS:
+            with self.subTest(method=method, url=url):
+                with assert_max_queries(limit):
+                    response = getattr(self.client, method)(url, json=body, headers=self.headers)
+                self.assertLess(response.status_code, 400)
+
+    def test_debug_headers(self):
+        self.app.config['QUERY_PROFILER_HEADERS'] = True
+        response = self.client.get('/auth/api/organisations/org1/users', headers=self.headers)
+        self.assertEqual(response.headers['X-Query-Count'], '2')
+        self.assertIn('X-Query-Time-Ms', response.headers)
+        self.assertNotIn('X-Query-N-Plus-One', response.headers)
+
+    def test_nothing_recorded_without_headers(self):
+        with mock.patch.object(profiler_module, 'QueryStats') as stats:
+            response = self.client.get('/auth/api/organisations/org1/users', headers=self.headers)
+        stats.assert_not_called()
+        self.assertNotIn('X-Query-Count', response.headers)
+
+class RegisterBudgetTestCase(AppTestCase):
+    # Check, organisation, user, membership and the welcome job
+    def test_register_budget(self):
+        with assert_max_queries(5):
+            response = self.client.post('/auth/register', json={
+                'userId': 'newuser', 'email': 'newuser@example.com', 'password': 'password',
+                'confirm_password': 'password', 'firstName': 'New', 'lastName': 'User', 'organization_name': 'Acme'
+            })
+        self.assertEqual(response.status_code, 201)
+
+class StatementShapeTestCase(unittest.TestCase):
+    def test_statement_shape(self):
+        self.assertEqual(statement_shape('SELECT a FROM t WHERE id IN (?, ?,  ?)'), statement_shape('SELECT a FROM t WHERE id IN (?)'))
+
+# Through the max_queries fixture in conftest.py
+def test_max_queries_fixture(max_queries):
+    engine = create_engine('sqlite://')
+    with max_queries(1) as stats, engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    assert stats.count == 1
+    assert stats.shapes == {'SELECT 1': 1}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import unittest
+from unittest import mock
+from app import create_app
+from app.config import Config
+from app.rate_limit import LocalBucketStore, SharedMemoryBucketStore
+from app.server import share_rate_limits
+from support import AppTestCase, SeededTestCase
+
+class BucketStoreTestCase(AppTestCase):
+    def test_bucket_refills(self):
+        for store in (LocalBucketStore(), SharedMemoryBucketStore(os.path.join(self.temp_dir(), 'limits'))):
+            with self.subTest(store=type(store).__name__):
+                self.assertEqual([store.take('k', 2, 1, 100.0)[0] for _ in range(3)], [True, True, False])
+                allowed, tokens = store.take('k', 2, 1, 100.5)
+                self.assertFalse(allowed)
+                self.assertAlmostEqual(tokens, 0.5)
+                self.assertTrue(store.take('k', 2, 1, 101.0)[0])
+                # Refill is capped at the bucket's capacity
+                self.assertEqual([store.take('k', 2, 1, 1000.0)[0] for _ in range(3)], [True, True, False])
+                self.assertTrue(store.take('other', 2, 1, 1000.0)[0])
+
+    def test_shared_buckets_are_shared_between_processes(self):
+        path = os.path.join(self.temp_dir(), 'limits')
+        store = SharedMemoryBucketStore(path)
+        store.take('k', 3, 0.001, 100.0)
+
+        pid = os.fork()
+        if pid == 0:
+            # Child: spends one token through its own connection
+            allowed = SharedMemoryBucketStore(path).take('k', 3, 0.001, 100.0)[0]
+            os._exit(0 if allowed else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertTrue(store.take('k', 3, 0.001, 100.0)[0])
+        self.assertFalse(store.take('k', 3, 0.001, 100.0)[0])
+
+    def test_register_is_limited_per_ip(self):
+        self.app.extensions['rate_limit'].limits['ip'] = (2, 1 / 60)
+        statuses = [self.client.post('/auth/register', json={}, environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code
+                    for _ in range(3)]
+        self.assertEqual(statuses, [422, 422, 429])
+        response = self.client.post('/auth/register', json={}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_client_ip_is_taken_from_trusted_proxies(self):
+        with mock.patch.object(Config, 'TRUSTED_PROXIES', 1):
+            app = create_app()
+        app.extensions['rate_limit'].limits['ip'] = (1, 1 / 60)
+        client = app.test_client()
+
+        # Both clients come through the same load balancer
+        def register(ip):
+            return client.post('/auth/register', json={}, environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                               headers={'X-Forwarded-For': ip}).status_code
+
+        self.assertEqual([register('192.0.2.1'), register('192.0.2.1'), register('192.0.2.2')], [422, 429, 422])
+
+    def test_serve_shares_buckets(self):
+        path = share_rate_limits(self.app)
+        self.addCleanup(os.unlink, path)
+        self.assertEqual(self.app.config['RATE_LIMIT_FILE'], path)
+        self.assertIsInstance(self.app.extensions['rate_limit'].store, SharedMemoryBucketStore)
+        self.assertIsNone(share_rate_limits(self.app))
+
+class LoginLimitTestCase(SeededTestCase):
+    def test_login_is_limited_per_user(self):
+        statuses = [self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'wrong'}).status_code
+                    for _ in range(self.app.config['RATE_LIMIT_USER_BURST'] + 1)]
+        self.assertEqual(statuses[-1], 429)
+        self.assertNotIn(429, statuses[:-1])
+
+        response = self.client.post('/auth/login', json={'userId': 'testuser', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+        # Other users are only held back by the per-IP bucket
+        response = self.client.post('/auth/login', json={'userId': 'other0', 'password': 'wrong'})
+        self.assertNotEqual(response.status_code, 429)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import io
+import unittest
+import json
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.models import db, User, Organization
+
+def registration(userId, email, organization_name='Acme'):
+    return {
+        'userId': userId,
+        'email': email,
+        'password': 'testpassword',
+        'confirm_password': 'testpassword',
+        'firstName': 'Test',
+        'lastName': 'User',
+        'organization_name': organization_name
+    }
+
+class RegistrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['PASSWORD_HASHER_PARAMS'] = {'iterations': 1000}
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_register(self):
+        response = self.client.post('/auth/register', json=registration('testuser', 'testuser@example.com'))
+        data = json.loads(response.data)['data']
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(data['user']['userId'], 'testuser')
+        self.assertTrue(data['organization']['orgId'])
+
+        with self.app.app_context():
+            user = User.query.filter_by(userId='testuser').first()
+            self.assertEqual([org.orgId for org in user.organizations], [data['organization']['orgId']])
+
+    def test_joins_existing_organisation(self):
+        first = self.client.post('/auth/register', json=registration('testuser', 'testuser@example.com'))
+        second = self.client.post('/auth/register', json=registration('otheruser', 'otheruser@example.com'))
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(json.loads(first.data)['data']['organization']['orgId'],
+                         json.loads(second.data)['data']['organization']['orgId'])
+
+        with self.app.app_context():
+            self.assertEqual(Organization.query.count(), 1)
+            self.assertEqual(Organization.query.first().users.count(), 2)
+
+    def test_duplicate_userId_and_email(self):
+        self.client.post('/auth/register', json=registration('testuser', 'testuser@example.com'))
+        response = self.client.post('/auth/register', json=registration('testuser', 'testuser@example.com'))
+        errors = json.loads(response.data)['errors']
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('userId', errors)
+        self.assertIn('email', errors)
+
+    def test_statement_count(self):
+        statements = []
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        response = self.client.post('/auth/register', json=registration('testuser', 'testuser@example.com'))
+        self.assertEqual(response.status_code, 201)
+        # Check, organisation, user, membership and the welcome job
+        self.assertLessEqual(len(statements), 5)
+
+class BatchRegistrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['PASSWORD_HASHER_PARAMS'] = {'iterations': 1000}
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(User(userId='existing', email='existing@example.com', firstName='Test', lastName='User', password_hash='-'))
+            db.session.commit()
+            self.headers = {'Authorization': 'Bearer ' + create_access_token(identity='existing')}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_batch(self):
+        rows = [
+            registration('user0001', 'user1@example.com', 'Acme'),
+            registration('user0002', 'user2@example.com', 'Acme'),
+            registration('user0003', 'user3@example.com', 'Globex'),
+            registration('existing', 'new@example.com'),
+            registration('user0001', 'dup@example.com'),
+            {'userId': 'x'}
+        ]
+        response = self.client.post('/auth/register/batch', json=rows, headers=self.headers)
+        data = json.loads(response.data)['data']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['created'], data['failed']), (3, 3))
+        self.assertEqual([r['status'] for r in data['results']], ['success'] * 3 + ['error'] * 3)
+        self.assertEqual(data['results'][0]['orgId'], data['results'][1]['orgId'])
+        self.assertIn('userId', data['results'][3]['errors'])
+        self.assertIn('userId', data['results'][4]['errors'])
+        self.assertIn('email', data['results'][5]['errors'])
+
+        with self.app.app_context():
+            self.assertEqual(User.query.count(), 4)
+            self.assertEqual(Organization.query.filter_by(name='Acme').first().users.count(), 2)
+
+    def test_ndjson(self):
+        body = '\n'.join(json.dumps(registration('user{:04d}'.format(i), 'user{}@example.com'.format(i))) for i in range(5))
+        response = self.client.post('/auth/register/batch', data=body, content_type='application/x-ndjson', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['data']['created'], 5)
+
+        response = self.client.post('/auth/login', json={'userId': 'user0003', 'password': 'testpassword'})
+        self.assertNotEqual(response.status_code, 401)
+
+    def test_oversized_batches_are_not_read(self):
+        self.app.config['REGISTER_BATCH_MAX'] = 3
+        body = ''.join(json.dumps(registration('user{:04d}'.format(i), 'user{}@example.com'.format(i))) + '\n'
+                       for i in range(1000)).encode()
+        stream = io.BytesIO(body)
+        response = self.client.post('/auth/register/batch', input_stream=stream, content_length=len(body),
+                                    content_type='application/x-ndjson', headers=self.headers)
+        self.assertEqual(response.status_code, 413)
+        # Reading stopped after the fourth line
+        self.assertEqual(stream.tell(), len(b''.join(body.splitlines(True)[:4])))
+
+        self.app.config['REGISTER_BATCH_MAX_BYTES'] = 1000
+        stream = io.BytesIO(b'[' + b', '.join(json.dumps(registration('x', 'x@example.com')).encode() for _ in range(10)) + b']')
+        response = self.client.post('/auth/register/batch', input_stream=stream, content_length=len(stream.getvalue()),
+                                    content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(stream.tell(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
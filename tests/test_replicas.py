@@ -0,0 +1,122 @@
+import os
+import unittest
+from app import replicas, version_cache
+from app.claims import issue_tokens
+from app.models import db, User, Organization, user_organization
+from app.replicas import SharedMemoryStickyStore
+from app.server import share_stickiness
+from support import AppTestCase, SeededTestCase
+
+# The test database is the primary; a second in-memory database stands in
+# for a replica that has not caught up with anything
+class ReplicaTestCase(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.replica = self.add_replicas(1)[0]
+
+    def add_replicas(self, count):
+        self.app.config['REPLICA_DATABASE_URLS'] = ['sqlite:///:memory:'] * count
+        replicas.init_app(self.app)
+        engines = [db.get_engine(self.app, bind='replica{}'.format(i)) for i in range(count)]
+        for engine in engines:
+            db.Model.metadata.create_all(engine)
+            self.addCleanup(db.Model.metadata.drop_all, engine)
+        db.session.remove()
+        return engines
+
+    # An organisation only `engine` has, with testuser as its member
+    def add_organization(self, engine, orgId):
+        user_id = db.session.query(User.id).filter_by(userId='testuser').scalar()
+        with engine.begin() as connection:
+            organization_id = connection.execute(Organization.__table__.insert(), {'orgId': orgId, 'name': orgId}).inserted_primary_key[0]
+            connection.execute(user_organization.insert(), {'user_id': user_id, 'organization_id': organization_id})
+
+    def org_ids(self, headers=None):
+        response = self.client.get('/auth/api/organisations', headers=headers or self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [org['orgId'] for org in response.json['data']['organizations']]
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.org_ids(), [])
+        self.add_organization(self.replica, 'replica-only')
+        self.assertEqual(self.org_ids(), ['replica-only'])
+
+    def test_writes_go_to_primary_and_stick(self):
+        response = self.client.post('/auth/api/organisations', json={'orgId': 'new', 'name': 'New'}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(db.session.query(Organization).filter_by(orgId='new').count(), 1)
+        response = self.client.post('/auth/api/organisations/new/users', json={'userId': 'testuser'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        # The writer reads its own write from the primary...
+        self.assertEqual(self.org_ids(), ['org1', 'org2', 'new'])
+        # ...until the sticky window closes
+        self.app.extensions['replicas'].sticky.clear()
+        self.assertEqual(self.org_ids(), [])
+
+    def test_replicas_are_used_in_turn(self):
+        second = self.add_replicas(2)[1]
+        self.add_organization(second, 'second')
+
+        self.assertEqual(sorted(tuple(self.org_ids()) for _ in range(4)), [(), (), ('second',), ('second',)])
+
+    def test_registered_user_reads_own_details(self):
+        response = self.client.post('/auth/register', json={
+            'userId': 'newuser', 'email': 'newuser@example.com', 'password': 'password', 'confirm_password': 'password',
+            'firstName': 'New', 'lastName': 'User', 'organization_name': 'New Org'
+        })
+        self.assertEqual(response.status_code, 201)
+        headers = {'Authorization': 'Bearer ' + response.json['data']['accessToken']}
+        self.assertEqual(self.client.get('/auth/api/users/newuser', headers=headers).status_code, 200)
+
+    def test_caches_are_filled_from_the_primary(self):
+        # A replica that has caught up with the seeded rows, then falls behind
+        with self.replica.begin() as connection:
+            for table in db.Model.metadata.sorted_tables:
+                rows = [dict(row._mapping) for row in db.session.execute(table.select())]
+                if rows:
+                    connection.execute(table.insert(), rows)
+        db.session.remove()
+        response = self.client.put('/auth/api/users/testuser', json={'firstName': 'New'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        # Another caller's replica read does not put the old row in the cache
+        other0 = User.query.filter_by(userId='other0').first()
+        other = {'Authorization': 'Bearer ' + issue_tokens('other0', other0.id)[0]}
+        self.assertEqual(self.client.get('/auth/api/users/testuser', headers=other).status_code, 200)
+        self.client.get('/api/api/organisations/org1', headers=other)
+        self.assertIsNone(version_cache.get('organization', 'org1'))
+
+        response = self.client.get('/auth/api/users/testuser', headers=self.headers)
+        self.assertEqual(response.json['data']['firstName'], 'New')
+
+class StickyStoreTestCase(AppTestCase):
+    def test_shared_between_processes(self):
+        path = os.path.join(self.temp_dir(), 'sticky')
+        store = SharedMemoryStickyStore(path, 64, 60)
+        pid = os.fork()
+        if pid == 0:
+            # Child: a write on another worker
+            SharedMemoryStickyStore(path, 64, 60).set('alice', True)
+            os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertTrue(store.get('alice'))
+        self.assertIsNone(store.get('bobby'))
+        store.delete('alice')
+        self.assertIsNone(store.get('alice'))
+
+        expired = SharedMemoryStickyStore(path, 64, 0)
+        expired.set('bobby', True)
+        self.assertIsNone(expired.get('bobby'))
+
+    def test_serve_shares_stickiness(self):
+        self.assertIsNone(share_stickiness(self.app))
+        self.app.config['REPLICA_DATABASE_URLS'] = ['sqlite:///:memory:']
+        replicas.init_app(self.app)
+        path = share_stickiness(self.app)
+        self.addCleanup(os.unlink, path)
+        self.assertEqual(self.app.config['REPLICA_STICKY_FILE'], path)
+        self.assertIsInstance(self.app.extensions['replicas'].sticky, SharedMemoryStickyStore)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+from collections import namedtuple
+from app.serializers import Schema, organization_schema, dumps, loads, jsonify
+from support import AppTestCase
+
+class SerializerTestCase(unittest.TestCase):
+    def test_schema_dump(self):
+        Org = namedtuple('Org', ['id', 'orgId', 'name', 'description'])
+        org = Org(1, 'org1', 'Org 1', None)
+        self.assertEqual(organization_schema.dump(org), {'orgId': 'org1', 'name': 'Org 1', 'description': None})
+        self.assertEqual(organization_schema.dump_many([org, org]), [organization_schema.dump(org)] * 2)
+        self.assertEqual(Schema('name').dump(org), {'name': 'Org 1'})
+
+    def test_dumps_round_trip(self):
+        self.assertEqual(loads(dumps({'b': 1, 'a': [None, 'x']})), {'b': 1, 'a': [None, 'x']})
+
+class JsonifyTestCase(AppTestCase):
+    def test_jsonify(self):
+        response = jsonify({'status': 'success'})
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.get_json(), {'status': 'success'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+from app import create_app
+from app.models import db
+from app.server import PooledWSGIServer
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _workers(pid):
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as f:
+        return set(map(int, f.read().split()))
+
+def _request(port, path, body=None, opener=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request('http://127.0.0.1:{}{}'.format(port, path), data=data,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with (opener or urllib.request.build_opener()).open(req, timeout=30) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def _wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.1)
+    raise AssertionError('timed out')
+
+# Registration hashes inline with 1.5M PBKDF2 iterations, so the request is
+# still running when the signal arrives
+def _slow_register(port, results):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    with opener.open('http://127.0.0.1:{}/auth/csrf_token'.format(port), timeout=30) as response:
+        csrf_token = json.load(response)['csrf_token']
+    results.append(_request(port, '/auth/register', {
+        'userId': 'slowuser', 'email': 'slow@example.com', 'password': 'password',
+        'confirm_password': 'password', 'firstName': 'Slow', 'lastName': 'User',
+        'organization_name': 'Slow Org', 'csrf_token': csrf_token
+    }, opener))
+
+class ServeTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        uri = 'sqlite:///' + os.path.join(directory.name, 'serve.db')
+        app = create_app()
+        app.config['SQLALCHEMY_DATABASE_URI'] = uri
+        with app.app_context():
+            db.create_all()
+
+        self.port = _free_port()
+        env = dict(os.environ, FLASK_APP='run.py', DATABASE_URL=uri, RATE_LIMIT_ENABLED='false', PASSWORD_POOL_WORKERS='0',
+                   PASSWORD_HASHER_PARAMS='{"iterations": 1500000}')
+        self.process = subprocess.Popen([sys.executable, '-m', 'flask', 'serve', '--port', str(self.port), '--workers', '2', '--threads', '2'],
+                                        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.addCleanup(self.kill)
+        _wait_for(lambda: len(_workers(self.process.pid)) == 2 and _request(self.port, '/auth/csrf_token') == 200)
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def test_reload_replaces_workers_without_dropping_requests(self):
+        process, port = self.process, self.port
+        old = _workers(process.pid)
+        results = []
+        slow = threading.Thread(target=_slow_register, args=(port, results))
+        slow.start()
+        time.sleep(0.3)
+
+        process.send_signal(signal.SIGHUP)
+        # Served throughout: by the old workers until the new ones are ready
+        statuses = []
+        _wait_for(lambda: statuses.append(_request(port, '/auth/csrf_token')) or _workers(process.pid).isdisjoint(old)
+                  and len(_workers(process.pid)) == 2)
+        slow.join()
+
+        self.assertEqual(results, [201])
+        self.assertEqual(set(statuses), {200})
+        self.assertIsNone(process.poll())
+
+    def test_stop_finishes_in_flight_requests(self):
+        process, port = self.process, self.port
+        results = []
+        slow = threading.Thread(target=_slow_register, args=(port, results))
+        slow.start()
+        time.sleep(0.3)
+
+        process.send_signal(signal.SIGTERM)
+        slow.join()
+        self.assertEqual(results, [201])
+        self.assertEqual(process.wait(timeout=30), 0)
+
+# One worker's server, run in this process
+class KeepAliveTestCase(unittest.TestCase):
+    def setUp(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(16)
+        self.addCleanup(sock.close)
+        self.server = PooledWSGIServer(create_app(), '127.0.0.1', 2, sock.fileno(), keepalive=0.3)
+        loop = threading.Thread(target=self.server.serve_forever)
+        loop.start()
+        self.addCleanup(loop.join)
+        self.addCleanup(self.server.shutdown)
+        self.connection = http.client.HTTPConnection('127.0.0.1', sock.getsockname()[1], timeout=10)
+        self.addCleanup(self.connection.close)
+
+    def get(self, body=None):
+        self.connection.request('GET', '/auth/csrf_token', body=body)
+        response = self.connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 200)
+        return response.getheader('Connection')
+
+    def test_connection_is_reused(self):
+        self.assertEqual(self.get(), 'keep-alive')
+        first = self.connection.sock
+        self.assertEqual(self.get(), 'keep-alive')
+        self.assertIs(self.connection.sock, first)
+
+    def test_unread_body_closes_connection(self):
+        self.assertEqual(self.get(b'x' * 100), 'close')
+        self.assertIsNone(self.connection.sock)
+
+    def test_idle_connection_is_closed(self):
+        self.get()
+        time.sleep(0.6)
+        self.assertEqual(self.connection.sock.recv(1), b'')
+
+    def test_connections_close_on_shutdown(self):
+        self.get()
+        self.server.stopping = True
+        self.assertEqual(self.get(), 'close')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import unittest
+from unittest import mock
+from app import shards, membership_index
+from app.models import db, User, Organization, OrganizationDirectory, user_organization
+from support import SeededTestCase
+
+def on_shard(shard, table):
+    with shards.engine(shard).connect() as connection:
+        return connection.execute(table.select()).all()
+
+# Two file databases as shards. The seeded organisations are copied to them
+# and removed from the primary, so anything still read from there fails.
+class ShardingTestCase(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = self.temp_dir()
+        self.app.config['SHARD_DATABASE_URLS'] = ['sqlite:///' + os.path.join(directory, 'shard{}.db'.format(i)) for i in range(2)]
+        shards.init_app(self.app)
+        shards.create_tables()
+        self.assertEqual(shards.import_primary(), 2)
+        db.session.execute(user_organization.delete())
+        db.session.execute(Organization.__table__.delete())
+        db.session.commit()
+        db.session.remove()
+        for shard in range(2):
+            self.addCleanup(shards.engine(shard).dispose)
+
+    def org_ids(self, headers=None, url='/auth/api/organisations'):
+        response = self.client.get(url, headers=headers or self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.json['data']
+        return [org['orgId'] for org in data.get('organizations', data.get('organisations'))]
+
+    def members_on_shard(self, shard, organization_id):
+        return [row for row in on_shard(shard, user_organization) if row.organization_id == organization_id]
+
+    def test_import_places_by_orgId(self):
+        for orgId in ('org1', 'org2'):
+            organization_id, shard = shards.locate(orgId)
+            self.assertEqual([row.orgId for row in on_shard(shard, Organization.__table__) if row.id == organization_id], [orgId])
+        self.assertEqual(shards.find('org1', Organization.name).name, 'Org 1')
+        self.assertIsNone(shards.find('missing', Organization.name))
+
+    def test_listings_merge_every_shard(self):
+        self.assertEqual(self.org_ids(), ['org1', 'org2'])
+        self.assertEqual(self.org_ids(url='/api/api/organisations'), ['org1', 'org2'])
+
+        response = self.client.get('/auth/api/organisations?limit=1', headers=self.headers)
+        self.assertEqual([org['orgId'] for org in response.json['data']['organizations']], ['org1'])
+        response = self.client.get('/auth/api/organisations?limit=1&after=' + response.json['data']['nextCursor'], headers=self.headers)
+        self.assertEqual([org['orgId'] for org in response.json['data']['organizations']], ['org2'])
+        self.assertIsNone(response.json['data']['nextCursor'])
+
+    def test_create_and_add_members(self):
+        response = self.client.post('/auth/api/organisations', json={'orgId': 'new', 'name': 'New'}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        organization_id, shard = shards.locate('new')
+        self.assertEqual([row.orgId for row in on_shard(shard, Organization.__table__) if row.id == organization_id], ['new'])
+
+        response = self.client.post('/auth/api/organisations/new/users/batch', json={'userIds': ['other0', 'other1']}, headers=self.headers)
+        self.assertEqual(response.json['data']['added'], ['other0', 'other1'])
+        self.assertEqual(len(self.members_on_shard(shard, organization_id)), 2)
+
+        response = self.client.get('/auth/api/organisations/new/users', headers=self.headers)
+        self.assertEqual([user['userId'] for user in response.json['data']['users']], ['other0', 'other1'])
+        other = db.session.query(User.id).filter_by(userId='other0').scalar()
+        self.assertIn(organization_id, membership_index.organizations(other))
+
+    def test_add_member_raced_by_another_request(self):
+        organization_id, shard = shards.locate('org2')
+        other = db.session.query(User.id).filter_by(userId='other0').scalar()
+
+        # The first lookup misses the membership another request just wrote
+        def racing(*args):
+            with shards.engine(shard).begin() as connection:
+                connection.execute(user_organization.insert().values(user_id=other, organization_id=organization_id))
+            racing_patch.stop()
+            return set()
+
+        racing_patch = mock.patch.object(shards, 'existing_members', racing)
+        racing_patch.start()
+        self.addCleanup(mock.patch.stopall)
+        response = self.client.post('/auth/api/organisations/org2/users', json={'userId': 'other0'}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([row for row in self.members_on_shard(shard, organization_id) if row.user_id == other]), 1)
+
+    def test_register_joins_and_creates_on_shards(self):
+        def register(userId, organization_name):
+            response = self.client.post('/auth/register', json={
+                'userId': userId, 'email': userId + '@example.com', 'password': 'password', 'confirm_password': 'password',
+                'firstName': 'New', 'lastName': 'User', 'organization_name': organization_name
+            })
+            self.assertEqual(response.status_code, 201)
+            return {'Authorization': 'Bearer ' + response.json['data']['accessToken']}
+
+        headers = register('joiner', 'Org 1')
+        self.assertEqual(self.org_ids(headers, '/api/api/organisations'), ['org1'])
+        headers = register('founder', 'Brand New')
+        orgId = db.session.query(OrganizationDirectory.orgId).filter_by(name='Brand New').scalar()
+        self.assertEqual(self.org_ids(headers, '/api/api/organisations'), [orgId])
+        self.assertEqual(self.client.get('/api/api/organisations/' + orgId, headers=headers).status_code, 200)
+
+    def test_move_keeps_organisation_reachable(self):
+        organization_id, source = shards.locate('org1')
+        target = 1 - source
+        self.assertEqual(shards.move({organization_id: target}, wait=0), 1)
+
+        self.assertEqual(shards.locate('org1'), (organization_id, target))
+        self.assertEqual(self.members_on_shard(source, organization_id), [])
+        self.assertEqual(len(self.members_on_shard(target, organization_id)), 3)
+        response = self.client.get('/auth/api/organisations/org1/users', headers=self.headers)
+        self.assertEqual(len(response.json['data']['users']), 3)
+        self.assertEqual(self.org_ids(), ['org1', 'org2'])
+
+    def test_stale_location_is_retried(self):
+        organization_id, source = shards.locate('org1')
+        shards.move({organization_id: 1 - source}, wait=0)
+        # Another process still has the old location cached
+        self.app.extensions['shards'].directory.set('org1', (organization_id, source))
+        self.app.extensions['shards'].directory.set(organization_id, source)
+        self.assertEqual(shards.find('org1', Organization.name).name, 'Org 1')
+
+    def test_cli_status_and_rebalance(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['shards', 'status'])
+        self.assertEqual(result.output.count('organisations'), 2)
+        result = runner.invoke(args=['shards', 'rebalance', '--dry-run'])
+        self.assertEqual(result.output, '0 organisations would move\n')
+
+    def test_batch_registration_spreads_over_shards(self):
+        rows = [{'userId': 'batch{}'.format(i), 'email': 'batch{}@example.com'.format(i), 'password': 'password', 'confirm_password': 'password',
+                 'firstName': 'Batch', 'lastName': 'User', 'organization_name': name}
+                for i, name in enumerate(['Org 1', 'Acme', 'Acme', 'Globex'])]
+        response = self.client.post('/auth/register/batch', json=rows, headers=self.headers)
+        self.assertEqual(response.json['data']['created'], 4)
+
+        for name, members in (('Org 1', 4), ('Acme', 2), ('Globex', 1)):
+            organization_id, shard = db.session.query(OrganizationDirectory.id, OrganizationDirectory.shard).filter_by(name=name).one()
+            self.assertEqual(len(self.members_on_shard(shard, organization_id)), members, name)
+
+    def test_bulk_import_and_export(self):
+        directory = self.temp_dir()
+        organizations = os.path.join(directory, 'organizations.jsonl')
+        with open(organizations, 'w') as f:
+            f.write('{"orgId": "bulk1", "name": "Bulk 1"}\n{"orgId": "bulk2", "name": "Bulk 2"}\n')
+        memberships = os.path.join(directory, 'memberships.csv')
+        with open(memberships, 'w') as f:
+            f.write('userId,orgId\nother0,bulk1\nother1,bulk2\ntestuser,org1\n')
+        runner = self.app.test_cli_runner()
+        runner.invoke(args=['bulk', 'import', 'organizations', organizations])
+        result = runner.invoke(args=['bulk', 'import', 'memberships', memberships])
+        self.assertEqual(result.output, '3 rows: 2 imported, 1 already present, 0 rejected\n')
+
+        for orgId, userId in (('bulk1', 'other0'), ('bulk2', 'other1')):
+            organization_id, shard = shards.locate(orgId)
+            user_id = db.session.query(User.id).filter_by(userId=userId).scalar()
+            self.assertIn((user_id, organization_id), [tuple(row) for row in on_shard(shard, user_organization)])
+
+        result = runner.invoke(args=['bulk', 'export', 'memberships', '-'])
+        self.assertEqual(len(result.output.splitlines()), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from app.forms import RegistrationForm, LoginForm
+from app.validation import registration_validator, login_validator
+from support import AppTestCase
+
+VALID = {
+    'userId': 'newuser', 'email': 'newuser@example.com', 'password': 'secret1', 'confirm_password': 'secret1',
+    'firstName': 'New', 'lastName': 'User', 'phone': '0123', 'organization_name': 'Acme',
+    'organization_description': 'Widgets'
+}
+
+CASES = [
+    VALID,
+    {},
+    dict(VALID, userId='abc'),
+    dict(VALID, userId='a' * 21),
+    dict(VALID, userId='   '),
+    dict(VALID, password='short', confirm_password='short'),
+    dict(VALID, confirm_password='different'),
+    dict(VALID, confirm_password=''),
+    dict(VALID, firstName='', lastName=None),
+    dict(VALID, phone=None, organization_description=None),
+    dict(VALID, organization_name=' '),
+] + [dict(VALID, email=email) for email in [
+    'plain', 'a@b', 'a@b.c', 'first.last+tag@sub.example.co.uk', '.lead@example.com', 'two..dots@example.com',
+    'trail.@example.com', 'x@-bad.com', 'x@bad-.com', 'x@ab--cd.com', 'x@example.123', "o'brien@example.com",
+    'x' * 65 + '@example.com', 'x@' + 'a' * 64 + '.com', 'üser@example.com', 'user@exämple.com', 'a b@example.com',
+    'user@EXAMPLE.COM', 'user@localhost', '@example.com', 'user@', ''
+]]
+
+LOGIN_CASES = [{}, {'userId': 'someone'}, {'userId': 'someone', 'password': 'pw'}, {'password': ' '}]
+
+class ValidationTestCase(AppTestCase):
+    def test_registration_matches_form(self):
+        for data in CASES:
+            with self.subTest(data=data), self.app.test_request_context():
+                form = RegistrationForm(formdata=None, data=data, meta={'csrf': False})
+                form.validate()
+                values, errors = registration_validator.validate(data)
+                self.assertEqual(errors, form.errors)
+                if not errors:
+                    self.assertEqual(values, {name: form.data[name] for name in values})
+
+    def test_login_matches_form(self):
+        for data in LOGIN_CASES:
+            with self.subTest(data=data), self.app.test_request_context():
+                form = LoginForm(formdata=None, data=data, meta={'csrf': False})
+                form.validate()
+                self.assertEqual(login_validator.validate(data)[1], form.errors)
+
+    def test_non_string_values(self):
+        errors = registration_validator.validate(dict(VALID, userId=12345, phone=['x']))[1]
+        self.assertEqual(errors, {'userId': ['Not a valid string.'], 'phone': ['Not a valid string.']})
+        self.assertEqual(registration_validator.validate(['not', 'an', 'object'])[1]['userId'], ['This field is required.'])
+
+    def test_csrf_token_is_checked_when_enabled(self):
+        self.app.config['WTF_CSRF_ENABLED'] = True
+        response = self.client.post('/auth/login', json={'userId': 'someone', 'password': 'pw'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.get_json()['errors'], {'csrf_token': ['The CSRF token is missing.']})
+
+if __name__ == '__main__':
+    unittest.main()